@@ -0,0 +1,349 @@
+"""多客户端并发负载测试
+
+在本地启动一个模拟小红书页面结构的站点，把服务器指向该站点（XHS_BASE_URL），然后让 N 个模拟的
+MCP 客户端同时按配置的比例调用 search_notes、get_note_content、get_note_comments、post_comment，
+统计吞吐量、各工具的耗时分布、错误率以及浏览器进程的内存占用，用于确定页面池和容器的规格。
+
+服务器在当前进程内运行，每个模拟客户端通过独立的 MCP 会话连接，与多个客户端共用一个服务器时一样
+共享主页面、页面池和缓存。服务器的其他配置照常通过环境变量设置，例如：
+
+    python benchmarks/load_test.py --clients 8 --duration 120
+    XHS_PAGE_POOL_SIZE=4 XHS_SEARCH_CACHE_TTL=0 python benchmarks/load_test.py --clients 8 --json
+
+浏览器数据和抓取记录写入临时目录，不会影响正在使用的登录状态和数据。浏览器内存按 /proc 统计，
+仅在 Linux 上可用。
+"""
+import argparse
+import asyncio
+import hashlib
+import html
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "search_notes=3,get_note_content=4,get_note_comments=2,post_comment=1"
+# 工具返回以下内容时计为错误
+ERROR_PATTERN = re.compile(r"出错|失败|请先登录|未能找到|不一致")
+
+# 模拟站点
+
+NOTE_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<div id="noteContainer" class="note-container">
+  <div class="author-wrapper"><a class="name" href="/user/profile/{author_id}"><span class="username">{author}</span></a></div>
+  <div class="note-content">
+    <div id="detail-title" class="title">{title}</div>
+    <div id="detail-desc" class="desc"><span class="note-text">{content}</span></div>
+    <div class="bottom-container"><span class="date">{date}</span></div>
+  </div>
+  <div class="comments-container">
+    <div class="total">共 {comment_count} 条评论</div>
+    <div class="comment-list">{comments}</div>
+  </div>
+  <div class="engage-bar">
+    <div class="content-input" contenteditable="true"></div>
+    <button class="btn submit">发送</button>
+  </div>
+</div>
+<script>
+  document.querySelector('button.submit').addEventListener('click', () => {{
+    const input = document.querySelector('.content-input');
+    const text = input.innerText.trim();
+    if (!text) return;
+    input.innerText = '';
+    fetch('/api/comment', {{method: 'POST', body: text}}).then(() => {{
+      const item = document.createElement('div');
+      item.className = 'comment-item';
+      item.id = 'comment-p' + Date.now() + Math.floor(Math.random() * 1000);
+      item.innerHTML = '<a class="name" href="/user/profile/me">我</a><div class="content"></div><span class="date">刚刚</span>';
+      item.querySelector('.content').textContent = text;
+      document.querySelector('.comment-list').prepend(item);
+    }});
+  }});
+</script>
+</body></html>"""
+
+COMMENT_ITEM = ('<div class="comment-item" id="comment-{comment_id}"><a class="name" href="/user/profile/{user_id}">'
+                '{user}</a><div class="content">{content}</div><span class="date">{date}</span></div>')
+
+SEARCH_CARD = ('<section class="note-item"><a href="/search_result/{note_id}" class="cover"></a>'
+               '<div class="footer"><a class="title"><span>{title}</span></a></div></section>')
+
+def fixture_note_id(seed: str) -> str:
+    return hashlib.sha1(seed.encode("utf-8")).hexdigest()[:24]
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """按请求路径生成与小红书页面结构一致的页面，内容由路径确定，同一地址每次返回相同内容"""
+
+    latency = 0.0
+    results_per_search = 20
+    comments_per_note = 10
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body: str, status: int = 200, content_type: str = "text/html; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        parsed = urlparse(self.path)
+        if parsed.path in ("/", "/explore"):
+            self._send("<!DOCTYPE html><html><body><div class=\"feeds-container\">首页</div></body></html>")
+        elif parsed.path == "/search_result":
+            keyword = parse_qs(parsed.query).get("keyword", [""])[0]
+            cards = "".join(
+                SEARCH_CARD.format(note_id=fixture_note_id(f"{keyword}/{i}"), title=html.escape(f"{keyword} 相关笔记 {i}"))
+                for i in range(self.results_per_search)
+            )
+            self._send(f"<!DOCTYPE html><html><body><div class=\"feeds-container\">{cards}</div></body></html>")
+        elif parsed.path.startswith(("/explore/", "/search_result/")):
+            self._send(self._note_page(parsed.path.rsplit("/", 1)[-1]))
+        else:
+            self._send("not found", status=404, content_type="text/plain")
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self._send("{}", content_type="application/json")
+
+    def _note_page(self, note_id: str) -> str:
+        rng = random.Random(note_id)
+        comments = "".join(
+            COMMENT_ITEM.format(comment_id=f"{note_id[:8]}{i}", user_id=f"u{rng.randrange(10 ** 6)}", user=f"用户{i}",
+                                content=f"这是第 {i} 条模拟评论，内容编号 {rng.randrange(10 ** 6)}", date="03-15")
+            for i in range(self.comments_per_note)
+        )
+        return NOTE_PAGE.format(
+            title=f"模拟笔记 {note_id[:8]}",
+            author=f"作者{rng.randrange(1000)}",
+            author_id=f"a{rng.randrange(10 ** 6)}",
+            content="这是一篇用于负载测试的模拟笔记正文，" * 8 + note_id,
+            date="2024-03-15",
+            comment_count=self.comments_per_note,
+            comments=comments,
+        )
+
+def start_fixture_site(latency_ms: float) -> ThreadingHTTPServer:
+    FixtureHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# 浏览器内存
+
+def _children(pid: int):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+def _process_memory(pid: int) -> int:
+    """进程的内存占用（字节），优先使用按共享比例分摊的 PSS，避免多进程浏览器重复计算共享内存"""
+    for path, field in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return 0
+
+def browser_memory() -> int:
+    """当前进程所有子孙进程（浏览器及其渲染进程）的内存占用之和（字节）"""
+    total = 0
+    stack = _children(os.getpid())
+    while stack:
+        pid = stack.pop()
+        total += _process_memory(pid)
+        stack.extend(_children(pid))
+    return total
+
+async def sample_memory(samples, interval: float = 1.0):
+    while True:
+        samples.append(browser_memory())
+        await asyncio.sleep(interval)
+
+# 负载生成
+
+def parse_mix(text: str):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip():
+            mix[name.strip()] = float(weight or 1)
+    return mix
+
+def build_call(tool: str, base_url: str, keywords, rng: random.Random):
+    keyword = rng.choice(keywords)
+    note_url = f"{base_url}/explore/{fixture_note_id(f'{keyword}/{rng.randrange(FixtureHandler.results_per_search)}')}"
+    if tool == "search_notes":
+        return {"keywords": keyword, "limit": 5}
+    if tool in ("get_note_content", "get_note_comments"):
+        return {"url": note_url}
+    if tool == "post_comment":
+        return {"url": note_url, "comment": f"负载测试评论{rng.randrange(10 ** 8)}", "force": True}
+    raise ValueError(f"不支持的工具: {tool}")
+
+async def run_client(client_id: int, server, base_url: str, args, deadline: float, results):
+    from fastmcp import Client
+
+    rng = random.Random(args.seed + client_id)
+    mix = parse_mix(args.mix)
+    tools, weights = list(mix.keys()), list(mix.values())
+    keywords = [f"关键词{i}" for i in range(args.keywords)]
+    async with Client(server) as client:
+        while time.monotonic() < deadline:
+            tool = rng.choices(tools, weights)[0]
+            start = time.perf_counter()
+            try:
+                content = await client.call_tool(tool, build_call(tool, base_url, keywords, rng))
+                text = "".join(getattr(item, "text", "") for item in content)
+                error = text[:200] if ERROR_PATTERN.search(text) else None
+            except Exception as e:
+                error = str(e)[:200]
+            results.append({"client": client_id, "tool": tool, "ms": (time.perf_counter() - start) * 1000,
+                            "error": error, "end": time.monotonic()})
+            if args.think_time > 0:
+                await asyncio.sleep(rng.expovariate(1000 / args.think_time))
+
+def summarize(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 1)
+
+    return {
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": round(ordered[-1], 1),
+        "mean_ms": round(statistics.fmean(ordered), 1),
+    }
+
+async def run(args):
+    site = start_fixture_site(args.site_latency)
+    base_url = f"http://127.0.0.1:{site.server_address[1]}"
+    work_dir = tempfile.mkdtemp(prefix="xhs_load_")
+    os.environ.update({
+        "XHS_BASE_URL": base_url,
+        "XHS_HEADLESS": "1",
+        "XHS_DATA_DIR": os.path.join(work_dir, "data"),
+        "XHS_BROWSER_DATA_DIR": os.path.join(work_dir, "browser_data"),
+    })
+    os.environ.setdefault("XHS_SLEEP_SCALE", str(args.sleep_scale))
+    sys.path.insert(0, ROOT_DIR)
+    import xiaohongshu_mcp
+    from fastmcp import Client
+
+    # 预热：启动浏览器并打开首页，启动耗时单独统计
+    start = time.perf_counter()
+    async with Client(xiaohongshu_mcp.mcp) as client:
+        try:
+            await client.call_tool("get_note_content", {"url": f"{base_url}/explore/{fixture_note_id('warmup')}"})
+        except Exception as e:
+            raise SystemExit(f"启动浏览器失败: {str(e)}")
+    startup_ms = (time.perf_counter() - start) * 1000
+
+    memory_samples = [browser_memory()]
+    sampler = asyncio.create_task(sample_memory(memory_samples))
+    results = []
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(*(
+        run_client(i, xiaohongshu_mcp.mcp, base_url, args, deadline, results) for i in range(args.clients)
+    ))
+    elapsed = time.monotonic() - started
+    sampler.cancel()
+    memory_samples.append(browser_memory())
+
+    per_tool = {}
+    for tool in parse_mix(args.mix):
+        calls = [r for r in results if r["tool"] == tool]
+        errors = [r for r in calls if r["error"]]
+        per_tool[tool] = {
+            "calls": len(calls),
+            "errors": len(errors),
+            "error_rate": round(len(errors) / len(calls), 3) if calls else 0,
+            **summarize([r["ms"] for r in calls]),
+            "sample_errors": list(dict.fromkeys(r["error"] for r in errors))[:3],
+        }
+    errors = sum(1 for r in results if r["error"])
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "clients": args.clients,
+        "duration_s": round(elapsed, 1),
+        "mix": args.mix,
+        "config": {key: value for key, value in os.environ.items()
+                   if key.startswith("XHS_") and key not in ("XHS_BASE_URL", "XHS_DATA_DIR", "XHS_BROWSER_DATA_DIR")},
+        "startup_ms": round(startup_ms, 1),
+        "calls": len(results),
+        "throughput_per_s": round(len(results) / elapsed, 2) if elapsed else 0,
+        "error_rate": round(errors / len(results), 3) if results else 0,
+        "latency": summarize([r["ms"] for r in results]),
+        "tools": per_tool,
+        "browser_memory_mb": {
+            "peak": round(max(memory_samples) / 2 ** 20, 1),
+            "end": round(memory_samples[-1] / 2 ** 20, 1),
+        },
+        "work_dir": work_dir,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟多个 MCP 客户端并发调用服务器，测量吞吐量、耗时、错误率和浏览器内存")
+    parser.add_argument("--clients", type=int, default=4, help="同时运行的模拟客户端数量")
+    parser.add_argument("--duration", type=float, default=60, help="测试时长（秒）")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="工具调用比例，格式为 工具=权重，逗号分隔")
+    parser.add_argument("--think-time", type=float, default=0, help="每个客户端两次调用之间的平均间隔（毫秒），按指数分布随机")
+    parser.add_argument("--keywords", type=int, default=50, help="随机选用的搜索关键词数量，越多缓存命中越少")
+    parser.add_argument("--site-latency", type=float, default=50, help="模拟站点每个请求的响应延迟（毫秒）")
+    parser.add_argument("--sleep-scale", type=float, default=0.1,
+                        help="页面固定等待的缩放比例（未设置 XHS_SLEEP_SCALE 时生效），1 表示与真实使用一致")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--json", action="store_true", help="以单行JSON输出结果，便于追加到历史记录")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    print(f"客户端: {result['clients']}，时长: {result['duration_s']} 秒，浏览器启动: {result['startup_ms']} ms")
+    print(f"调用: {result['calls']} 次，吞吐量: {result['throughput_per_s']} 次/秒，错误率: {result['error_rate']:.1%}")
+    latency = result["latency"]
+    if latency:
+        print(f"耗时: p50 {latency['p50_ms']} ms，p90 {latency['p90_ms']} ms，p99 {latency['p99_ms']} ms，最大 {latency['max_ms']} ms")
+    for tool, stats in result["tools"].items():
+        if not stats["calls"]:
+            continue
+        print(f"  {tool:>18}: {stats['calls']} 次，错误率 {stats['error_rate']:.1%}，"
+              f"p50 {stats['p50_ms']} ms，p90 {stats['p90_ms']} ms，p99 {stats['p99_ms']} ms")
+        for error in stats["sample_errors"]:
+            print(f"  {'':>18}  错误示例: {error}")
+    memory = result["browser_memory_mb"]
+    print(f"浏览器内存: 峰值 {memory['peak']} MB，结束时 {memory['end']} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""服务器冷启动耗时基准
+
+分别测量两项耗时（毫秒）：
+- import: 新进程中导入 xiaohongshu_mcp 模块的耗时
+- handshake: 客户端启动服务器进程、完成 MCP 初始化握手并收到 list_tools 结果的总耗时
+
+用法:
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --json >> startup_history.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from fastmcp import Client
+from fastmcp.client.transports import PythonStdioTransport
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(ROOT_DIR, "xiaohongshu_mcp.py")
+
+IMPORT_SNIPPET = (
+    "import sys, time; sys.path.insert(0, sys.argv[1]); start = time.perf_counter(); "
+    "import xiaohongshu_mcp; print((time.perf_counter() - start) * 1000)"
+)
+
+def measure_import() -> float:
+    """在新进程中导入服务器模块，返回导入耗时（毫秒）"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET, ROOT_DIR],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+async def measure_handshake() -> float:
+    """启动服务器进程并完成握手和 list_tools，返回总耗时（毫秒）"""
+    start = time.perf_counter()
+    async with Client(PythonStdioTransport(SERVER_SCRIPT, python_cmd=sys.executable)) as client:
+        tools = await client.list_tools()
+    elapsed = (time.perf_counter() - start) * 1000
+    if not tools:
+        raise RuntimeError("服务器没有返回任何工具")
+    return elapsed
+
+def summarize(samples):
+    return {
+        "min_ms": round(min(samples), 1),
+        "median_ms": round(statistics.median(samples), 1),
+        "max_ms": round(max(samples), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="测量服务器冷启动耗时")
+    parser.add_argument("--runs", type=int, default=5, help="每项测量的次数")
+    parser.add_argument("--json", action="store_true", help="以单行JSON输出结果，便于追加到历史记录")
+    args = parser.parse_args()
+
+    import_samples = [measure_import() for _ in range(args.runs)]
+    handshake_samples = [asyncio.run(measure_handshake()) for _ in range(args.runs)]
+
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import": summarize(import_samples),
+        "handshake": summarize(handshake_samples),
+    }
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    print(f"运行次数: {args.runs}")
+    for name in ("import", "handshake"):
+        stats = result[name]
+        print(f"{name:>9}: 最小 {stats['min_ms']} ms，中位数 {stats['median_ms']} ms，最大 {stats['max_ms']} ms")
+
+if __name__ == "__main__":
+    main()
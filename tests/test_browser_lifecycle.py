@@ -0,0 +1,35 @@
+"""浏览器启动、关闭和恢复的串行化"""
+import asyncio
+
+import xiaohongshu_mcp as xhs
+
+
+def test_concurrent_launch_and_recovery_start_one_browser(monkeypatch):
+    launches = []
+
+    async def fake_launch():
+        launches.append(object())
+        # 启动过程中让出事件循环，模拟启动 Playwright 的耗时
+        await asyncio.sleep(0.01)
+        monkeypatch.setattr(xhs, "browser_context", launches[-1])
+        monkeypatch.setattr(xhs, "browser_unhealthy", False)
+
+    async def fake_shutdown():
+        monkeypatch.setattr(xhs, "browser_context", None)
+        await asyncio.sleep(0.01)
+
+    monkeypatch.setattr(xhs, "_launch_browser", fake_launch)
+    monkeypatch.setattr(xhs, "_shutdown_browser", fake_shutdown)
+    monkeypatch.setattr(xhs, "_browser_lock", None)
+    monkeypatch.setattr(xhs, "browser_context", None)
+
+    async def run():
+        await asyncio.gather(xhs.launch_browser(), xhs.launch_browser(), xhs.launch_browser())
+        assert len(launches) == 1
+        # 看门狗和工具调用同时发现浏览器异常时只重启一次
+        xhs.browser_unhealthy = True
+        await asyncio.gather(xhs.recover_browser(), xhs.recover_browser(), xhs.launch_browser())
+        assert len(launches) == 2
+        assert xhs.browser_context is launches[-1]
+
+    asyncio.run(run())
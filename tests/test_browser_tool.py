@@ -0,0 +1,28 @@
+"""浏览器工具装饰器：浏览器恢复后的重试"""
+import asyncio
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+
+@pytest.mark.parametrize("retry, expected_calls", [(True, 2), (False, 1)])
+def test_browser_tool_retry_after_recovery(monkeypatch, fake_browser, retry, expected_calls):
+    calls = []
+
+    async def recover_browser():
+        pass
+
+    monkeypatch.setattr(xhs, "recover_browser", recover_browser)
+    monkeypatch.setattr(xhs, "browser_generation", 0)
+
+    @xhs.browser_tool(uses_main_page=False, retry=retry)
+    async def tool() -> str:
+        calls.append(xhs.browser_generation)
+        # 第一次调用期间浏览器被看门狗重新启动
+        if len(calls) == 1:
+            xhs.browser_generation += 1
+        return "ok"
+
+    assert asyncio.run(tool()) == "ok"
+    assert len(calls) == expected_calls
@@ -0,0 +1,137 @@
+"""营销任务流水线：标题过滤、检查点恢复和停止"""
+import asyncio
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+
+@pytest.fixture
+def campaign_env(monkeypatch, tmp_path):
+    monkeypatch.setattr(xhs, "CAMPAIGN_DIR", str(tmp_path / "campaigns"))
+    monkeypatch.setattr(xhs, "engagement_history", xhs.EngagementHistory(str(tmp_path / "engagement.jsonl")))
+    monkeypatch.setattr(xhs, "CAMPAIGN_ANALYZE_WORKERS", 1)
+    return tmp_path
+
+
+def _config(**overrides):
+    config = {
+        "keywords": ["咖啡"],
+        "limit": 10,
+        "include": [],
+        "exclude": [],
+        "domains": [],
+        "comment_type": "引流",
+        "post_interval": 0,
+        "sort_by_time": True,
+    }
+    config.update(overrides)
+    return config
+
+
+def _note_record(note_id, title):
+    return {"note_id": note_id, "title": title, "author": "作者", "content": f"{title}的正文"}
+
+
+def test_prefilter(campaign_env):
+    xhs.engagement_history.record("comment", "done", comment="评论过")
+    campaign = xhs.Campaign("job", _config(exclude=["广告"]))
+    assert campaign._prefilter("a", "这是一条广告笔记") == "标题包含排除词\"广告\""
+    assert campaign._prefilter("done", "之前评论过的笔记") == "已经评论过"
+    assert campaign._prefilter("b", "上海咖啡探店合集推荐") is None
+    assert campaign._prefilter("c", "上海咖啡探店合集推荐！") == "与本任务中的其他笔记近似重复"
+    # 占位标题和过短的标题无法比较，不当作重复
+    assert campaign._prefilter("d", "未知标题") is None
+    assert campaign._prefilter("e", "未知标题") is None
+    assert campaign._prefilter("f", "咖啡") is None
+    assert campaign._prefilter("g", "咖啡") is None
+
+
+def test_resume_from_checkpoint(campaign_env, monkeypatch):
+    searched, fetched, posted = [], [], []
+
+    async def poll_keyword(keyword, sort_by_time, limit, stop_ids):
+        searched.append(keyword)
+        return [{"note_id": "new", "title": "新搜索到的一篇笔记标题", "url": "https://x/search_result/new"}]
+
+    async def fetch_note_record(url):
+        fetched.append(url)
+        note_id = url.rsplit("/", 1)[-1]
+        return _note_record(note_id, f"笔记{note_id}的完整标题")
+
+    async def post_comment(url, comment):
+        posted.append((url, comment))
+        return f"已成功发布评论：{comment}"
+
+    monkeypatch.setattr(xhs, "poll_keyword", poll_keyword)
+    monkeypatch.setattr(xhs, "fetch_note_record", fetch_note_record)
+    monkeypatch.setattr(xhs, "post_comment", post_comment)
+    monkeypatch.setattr(xhs, "detect_domains", lambda title, content: [])
+
+    saved = xhs.Campaign("job", _config(keywords=["咖啡", "茶"]))
+    saved.searched = ["咖啡"]
+    saved.notes = {
+        "queued": {"url": "https://x/explore/queued", "title": "还没有分析的笔记", "status": "queued"},
+        "delivered": {"url": "https://x/explore/delivered", "title": "交给客户端的笔记", "status": "delivered"},
+        "submitted": {"url": "https://x/explore/submitted", "title": "已提交评论的笔记", "status": "submitted",
+                      "comment": "写好的评论"},
+    }
+    saved.state = "stopped"
+    saved.save()
+
+    async def run():
+        campaign = xhs.Campaign.load("job")
+        assert campaign.searched == ["咖啡"]
+        assert campaign.notes["delivered"]["status"] == "delivered"
+        campaign.start()
+        drafts = []
+        while len(drafts) < 3:
+            drafts += await campaign.next_drafts(5, 1)
+        for _ in range(50):
+            if posted:
+                break
+            await asyncio.sleep(0.01)
+        campaign.stop()
+        return campaign, drafts
+
+    campaign, drafts = asyncio.run(run())
+    # 已搜索过的关键词不再搜索，未分析的笔记继续分析，已交付的笔记重新交付，已提交的评论继续发布
+    assert searched == ["茶"]
+    assert sorted(fetched) == ["https://x/explore/new", "https://x/explore/queued"]
+    assert sorted(draft["note_id"] for draft in drafts) == ["delivered", "new", "queued"]
+    assert posted == [("https://x/explore/submitted", "写好的评论")]
+    assert campaign.notes["submitted"]["status"] == "posted"
+    assert xhs.Campaign.load("job").state == "stopped"
+
+
+def test_stop_with_full_analyze_queue_does_not_leak(campaign_env, monkeypatch):
+    monkeypatch.setattr(xhs, "CAMPAIGN_QUEUE_SIZE", 1)
+
+    async def poll_keyword(keyword, sort_by_time, limit, stop_ids):
+        return [{"note_id": f"n{i}", "title": f"第{i}篇互不相同的笔记标题{'甲乙丙丁戊'[i]}", "url": f"https://x/explore/n{i}"}
+                for i in range(5)]
+
+    async def fetch_note_record(url):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(xhs, "poll_keyword", poll_keyword)
+    monkeypatch.setattr(xhs, "fetch_note_record", fetch_note_record)
+
+    async def run():
+        campaign = xhs.Campaign("job", _config())
+        campaign.start()
+        await asyncio.sleep(0.05)
+        tasks = list(campaign._tasks)
+        campaign.stop()
+        done, pending = await asyncio.wait(tasks, timeout=1)
+        return pending
+
+    assert not asyncio.run(run())
+
+
+def test_job_ids_are_unique_within_a_second(campaign_env, monkeypatch):
+    monkeypatch.setattr(xhs, "campaigns", {})
+    monkeypatch.setattr(xhs.Campaign, "start", lambda self: None)
+    asyncio.run(xhs.start_campaign("咖啡"))
+    asyncio.run(xhs.start_campaign("咖啡"))
+    assert len(xhs.campaigns) == 2
@@ -0,0 +1,49 @@
+"""增量获取评论的高水位记录"""
+import asyncio
+
+import xiaohongshu_mcp as xhs
+
+
+def _comment(content, comment_id=None):
+    comment = {"用户名": "用户", "内容": content, "时间": "1天前"}
+    if comment_id is not None:
+        comment["id"] = comment_id
+    return comment
+
+
+def test_comment_key_prefers_page_ids():
+    assert xhs.comment_key(_comment("内容", "6650aa")) == "6650aa"
+    # 页面上没有ID时使用的序号和缺少ID一样，按用户名和内容区分
+    assert xhs.comment_key(_comment("内容", "c3")) == xhs.comment_key(_comment("内容"))
+    assert xhs.comment_key(_comment("内容")) != xhs.comment_key(_comment("其他内容"))
+
+
+def test_comment_mark_round_trip(monkeypatch, tmp_path):
+    monkeypatch.setattr(xhs, "COMMENT_MARKS_DIR", str(tmp_path))
+    monkeypatch.setattr(xhs, "COMMENT_MARK_LIMIT", 3)
+
+    mark = xhs.load_comment_mark("note")
+    assert mark == {"updated_at": None, "seen": []}
+    xhs.save_comment_mark("note", mark, [_comment("一", "a"), _comment("二", "b")])
+    mark = xhs.load_comment_mark("note")
+    assert mark["seen"] == ["a", "b"]
+    assert mark["updated_at"]
+
+    # 新评论排在前面，重复的只保留一次，超出上限时丢弃最旧的
+    xhs.save_comment_mark("note", mark, [_comment("三", "c"), _comment("一", "a")])
+    assert xhs.load_comment_mark("note")["seen"] == ["c", "a", "b"]
+    xhs.save_comment_mark("note", xhs.load_comment_mark("note"), [_comment("四", "d")])
+    assert xhs.load_comment_mark("note")["seen"] == ["d", "c", "a"]
+    assert xhs.load_comment_mark("other")["seen"] == []
+
+
+def test_since_requires_note_id(monkeypatch, tmp_path):
+    async def ensure_browser():
+        raise AssertionError("无法识别笔记ID时不应打开浏览器")
+
+    monkeypatch.setattr(xhs, "COMMENT_MARKS_DIR", str(tmp_path))
+    monkeypatch.setattr(xhs, "ensure_browser", ensure_browser)
+
+    result = asyncio.run(xhs.get_note_comments("https://example.com/not-a-note", since=True))
+    assert "笔记ID" in result
+    assert not list(tmp_path.iterdir())
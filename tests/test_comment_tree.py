@@ -0,0 +1,34 @@
+"""评论树的组织与按一级评论分页"""
+import json
+
+import xiaohongshu_mcp as xhs
+
+
+def _comment(comment_id, content, parent_id=None):
+    return {"id": comment_id, "parent_id": parent_id, "用户名": f"用户{content}", "内容": content, "时间": "1天前"}
+
+
+def test_comment_threads_nest_replies_and_keep_comments_without_id():
+    comments = [
+        _comment("a", "一级"),
+        _comment("b", "回复", parent_id="a"),
+        _comment("c", "回复的回复", parent_id="b"),
+        _comment("", "没有ID"),
+        _comment(None, "也没有ID"),
+        _comment("d", "父评论未提取", parent_id="missing"),
+    ]
+    threads = xhs.build_comment_threads(comments)
+    assert [thread["内容"] for thread in threads] == ["一级", "没有ID", "也没有ID", "父评论未提取"]
+    assert threads[0]["回复"][0]["内容"] == "回复"
+    assert threads[0]["回复"][0]["回复"][0]["内容"] == "回复的回复"
+
+
+def test_comment_tree_pages_by_top_level_comment():
+    comments = [_comment("a", "一"), _comment("b", "回复", parent_id="a"), _comment("c", "二"), _comment("d", "三")]
+    payload = json.loads(xhs.format_comment_tree(comments, 0, 1, True, "", 0, False))
+    assert (payload["total"], payload["offset"], payload["count"]) == (3, 0, 2)
+    assert [item["id"] for item in payload["items"]] == ["a", "b"]
+
+    text = xhs.format_comment_tree(comments, 1, 1, False, "", 0, False)
+    assert "以下为第 2-2 条" in text
+    assert "二" in text and "三" not in text
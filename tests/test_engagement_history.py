@@ -0,0 +1,50 @@
+"""互动记录索引：按笔记和作者判断是否已经互动过"""
+import xiaohongshu_mcp as xhs
+
+
+def test_record_and_lookup(tmp_path):
+    history = xhs.EngagementHistory(str(tmp_path / "data" / "engagements.jsonl"))
+    assert history.lookup("comment", "n1") is None
+
+    history.record("comment", "n1", "u1", comment="写得真好")
+    history.record("like", "n2")
+    assert history.lookup("comment", "n1")["comment"] == "写得真好"
+    assert history.lookup("like", "n2")["author_id"] == ""
+    # 按动作区分，没有笔记ID时不匹配
+    assert history.lookup("like", "n1") is None
+    assert history.lookup("comment") is None
+
+
+def test_follow_is_looked_up_by_author_across_notes(tmp_path):
+    history = xhs.EngagementHistory(str(tmp_path / "engagements.jsonl"))
+    history.record("follow", "n1", "u1")
+    history.record("comment", "n2", "u1")
+
+    assert history.lookup("follow", author_id="u1")["note_id"] == "n1"
+    # 同一作者的另一篇笔记：由笔记ID查到作者，再按作者判断关注
+    assert history.lookup("follow", "n2")["note_id"] == "n1"
+    assert history.author_of("n2") == "u1"
+    assert history.lookup("follow", "n3") is None
+    assert history.author_of("n3") == ""
+
+
+def test_records_from_other_processes_are_picked_up(tmp_path):
+    path = str(tmp_path / "engagements.jsonl")
+    history = xhs.EngagementHistory(path)
+    other = xhs.EngagementHistory(path)
+    history.record("comment", "n1", "u1")
+    assert history.lookup("comment", "n1") is not None
+    assert other.lookup("comment", "n2") is None
+
+    other.record("comment", "n2", "u2")
+    # 写了一半的行在补全之前不读入
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"action": "like", "note_id": "n3"')
+    assert history.lookup("comment", "n2")["author_id"] == "u2"
+    assert history.lookup("like", "n3") is None
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(', "author_id": ""}\n')
+    assert history.lookup("like", "n3") is not None
+
+    # 新实例从文件重建完整索引
+    assert xhs.EngagementHistory(path).author_of("n2") == "u2"
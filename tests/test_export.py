@@ -0,0 +1,60 @@
+"""抓取记录的分块导出"""
+import asyncio
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+
+@pytest.fixture
+def data_dirs(monkeypatch, tmp_path):
+    monkeypatch.setattr(xhs, "RECORDS_DIR", str(tmp_path / "records"))
+    monkeypatch.setattr(xhs, "EXPORT_DIR", str(tmp_path / "exports"))
+    return tmp_path
+
+
+def test_coerce_value():
+    assert xhs._coerce_value("3", "int") == 3
+    assert xhs._coerce_value("第3", "int") == 0
+    assert xhs._coerce_value(None, "int") == 0
+    assert xhs._coerce_value(1, "bool") is True
+    assert xhs._coerce_value(None, "str") == ""
+    assert xhs._coerce_value(12, "str") == "12"
+
+
+def test_records_are_chunked_with_fixed_schema(data_dirs):
+    xhs.append_records("search", [{"keywords": "咖啡", "rank": i, "note_id": f"n{i}", "extra": "忽略"}
+                                  for i in range(1, 6)])
+    # 损坏的行跳过，缺失的字段置空
+    with open(os.path.join(xhs.RECORDS_DIR, "search.jsonl"), "a", encoding="utf-8") as f:
+        f.write("{broken\n\n" + json.dumps({"rank": "x"}) + "\n")
+
+    chunks = list(xhs._iter_record_chunks("search", 2))
+    assert [len(df) for df in chunks] == [2, 2, 2]
+    for df in chunks:
+        assert list(df.columns) == list(xhs.EXPORT_SCHEMAS["search"])
+    last = chunks[-1].iloc[-1]
+    assert (last["rank"], last["keywords"], last["sort_by_time"]) == (0, "", False)
+    assert list(xhs._iter_record_chunks("notes", 2)) == []
+
+
+def test_export_parquet_and_csv(data_dirs):
+    xhs.append_records("search", [{"keywords": "咖啡", "rank": i, "note_id": f"n{i}"} for i in range(1, 6)])
+
+    result = asyncio.run(xhs.export_data("search", "parquet", chunk_rows=2))
+    assert "导出 5 行（3 个分块）" in result
+    output_dir = result.rsplit("到 ", 1)[1]
+    parts = sorted(os.listdir(output_dir))
+    assert parts == ["part-00000.parquet", "part-00001.parquet", "part-00002.parquet"]
+    df = pd.concat(pd.read_parquet(os.path.join(output_dir, part)) for part in parts)
+    assert list(df["rank"]) == [1, 2, 3, 4, 5]
+
+    result = asyncio.run(xhs.export_data("search", "csv", chunk_rows=2))
+    df = pd.read_csv(result.rsplit("到 ", 1)[1])
+    # 各分块追加到同一个文件，只写一次表头
+    assert list(df["note_id"]) == ["n1", "n2", "n3", "n4", "n5"]
+    assert "暂无可导出的数据" in asyncio.run(xhs.export_data("notes", "csv"))
+    assert "未知的数据集" in asyncio.run(xhs.export_data("likes"))
@@ -0,0 +1,15 @@
+"""紧凑模式输出的分页、字段选择和截断"""
+import json
+
+import xiaohongshu_mcp as xhs
+
+
+def test_format_compact_paging_and_fields():
+    records = [{"title": "一个很长的标题", "likes": 3}, {"title": "短", "likes": 5}]
+    payload = json.loads(xhs.format_compact(records, fields="title", max_field_length=4, total=10, offset=4,
+                                            partial=True))
+    assert payload == {
+        "total": 10, "offset": 4, "count": 2, "partial": True,
+        "items": [{"title": "一个很长…"}, {"title": "短"}],
+    }
+    assert json.loads(xhs.format_compact(records[1])) == records[1]
@@ -0,0 +1,18 @@
+"""由耗时分位数得出的超时"""
+
+import xiaohongshu_mcp as xhs
+
+
+def test_latency_model_timeouts():
+    model = xhs.LatencyModel(window=10, min_samples=3, percentile=50, margin=2)
+    assert model.timeout_ms("selector") == 10000
+    for seconds in (4, 5, 6):
+        model.observe("selector", seconds)
+    assert model.timeout_ms("selector") == 10000
+    for seconds in (0.1, 0.1, 0.1, 0.1):
+        model.observe("selector", seconds)
+    # 耗时很短时不低于下限
+    assert model.timeout_ms("selector") == 5000
+    for seconds in (100,) * 10:
+        model.observe("navigation", seconds)
+    assert model.timeout_ms("navigation") == 60000
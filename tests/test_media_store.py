@@ -0,0 +1,76 @@
+"""媒体文件的内容寻址存储"""
+import asyncio
+import os
+import types
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+IMAGE_A = "https://sns-img.xhscdn.com/1040g2sg31abcdefghijklmn!nd_dft_wlteh_webp_3?sign=1"
+IMAGE_A_RESIGNED = "https://sns-img.xhscdn.com/1040g2sg31abcdefghijklmn!nd_dft_wlteh_webp_3?sign=2"
+IMAGE_B = "https://sns-img.xhscdn.com/1040g2sg31zyxwvutsrqponm!nd_dft_wlteh_webp_3"
+MISSING = "https://sns-img.xhscdn.com/1040g2sg31missingmissing00"
+
+
+class FakeRequest:
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.calls = []
+
+    async def get(self, url, headers=None, timeout=None):
+        self.calls.append(url)
+        await asyncio.sleep(0)
+        body = self.bodies.get(url.split("?")[0])
+        return types.SimpleNamespace(ok=body is not None, status=200 if body else 404,
+                                     headers={"content-type": "image/png"}, body=self._body(body))
+
+    @staticmethod
+    def _body(body):
+        async def read():
+            return body
+        return read
+
+
+@pytest.fixture
+def request_api(monkeypatch):
+    same = b"\x89PNG same image"
+    request = FakeRequest({IMAGE_A.split("?")[0]: same, IMAGE_B: same})
+    monkeypatch.setattr(xhs, "browser_context", types.SimpleNamespace(request=request))
+    return request
+
+
+def test_same_content_is_stored_once(tmp_path, request_api):
+    store = xhs.MediaStore(str(tmp_path), 2)
+
+    async def run():
+        # 同一文件的并发请求共用一个下载任务
+        first, (a_again,) = await asyncio.gather(store.fetch_all([IMAGE_A, IMAGE_B, MISSING], timeout=5),
+                                                 store.fetch_all([IMAGE_A], timeout=5))
+        # 签名变化后的链接仍然命中已下载的文件
+        second = await store.fetch_all([IMAGE_A_RESIGNED], timeout=5)
+        return first + [a_again], second
+
+    (a, b, missing, a_again), (resigned,) = asyncio.run(run())
+    assert sorted(request_api.calls) == sorted([IMAGE_A, IMAGE_B, MISSING])
+    assert missing == "下载失败: HTTP 404"
+    assert a["sha256"] == b["sha256"] and a["path"] == b["path"] == a_again["path"] == resigned["path"]
+    assert a["path"].endswith(".png") and os.path.exists(a["path"])
+    files = [name for _, _, names in os.walk(tmp_path) for name in names if name != "index.jsonl"]
+    assert len(files) == 1
+
+
+def test_index_is_reloaded_and_missing_files_redownloaded(tmp_path, request_api):
+    asyncio.run(xhs.MediaStore(str(tmp_path), 2).fetch_all([IMAGE_A], timeout=5))
+
+    store = xhs.MediaStore(str(tmp_path), 2)
+    entry = store.lookup(IMAGE_A_RESIGNED)
+    assert entry is not None and entry["url"] == IMAGE_A
+    assert xhs.MediaStore.url_key("https://example.com/a/b.jpg") == "example.com/a/b.jpg"
+
+    # 文件被删除后视为未下载
+    os.remove(entry["path"])
+    assert store.lookup(IMAGE_A) is None
+    asyncio.run(store.fetch_all([IMAGE_A], timeout=5))
+    assert request_api.calls == [IMAGE_A, IMAGE_A]
+    assert os.path.exists(entry["path"])
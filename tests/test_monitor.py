@@ -0,0 +1,45 @@
+"""关键词监控的增量检测"""
+import asyncio
+
+import xiaohongshu_mcp as xhs
+
+
+def test_poll_keyword_filters_seen_notes_under_relevance_sort(monkeypatch, fake_browser):
+    posts = [{"note_id": note_id, "title": note_id, "url": ""} for note_id in ("seen", "new1", "new2")]
+    calls = []
+
+    async def ensure_browser():
+        return True
+
+    async def open_search_page(page, keywords, sort_by_time):
+        pass
+
+    async def harvest_search_results(page, limit, stop_ids=None):
+        calls.append(stop_ids)
+        return posts, False
+
+    monkeypatch.setattr(xhs, "ensure_browser", ensure_browser)
+    monkeypatch.setattr(xhs, "open_search_page", open_search_page)
+    monkeypatch.setattr(xhs, "harvest_search_results", harvest_search_results)
+    monkeypatch.setattr(xhs, "page_scheduler", xhs.PageScheduler(1, {}))
+
+    result = asyncio.run(xhs.poll_keyword("咖啡", False, 10, ["seen"]))
+    assert [post["note_id"] for post in result] == ["new1", "new2"]
+    # 综合排序时不能遇到已见过的笔记就停止滚动
+    assert calls == [None]
+
+
+def test_registered_watches_start_with_the_server(monkeypatch, tmp_path):
+    started = []
+    monkeypatch.setattr(xhs, "MONITOR_DIR", str(tmp_path))
+    monkeypatch.setattr(xhs.keyword_monitor, "start", lambda: started.append(True))
+
+    async def run():
+        async with xhs.server_lifespan(xhs.mcp):
+            pass
+
+    asyncio.run(run())
+    assert started == []
+    (tmp_path / "watches.json").write_text("{}", encoding="utf-8")
+    asyncio.run(run())
+    assert started == [True]
@@ -0,0 +1,84 @@
+"""多关键词并发搜索：合并排序、去重，以及后台页面工具的登录检查"""
+import asyncio
+import json
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+
+class FakeMainPage:
+    def __init__(self, log):
+        self.log = log
+
+    def set_default_timeout(self, timeout):
+        pass
+
+    async def query_selector_all(self, selector):
+        return []
+
+
+def test_login_check_waits_for_main_page(monkeypatch, fake_browser):
+    log = []
+
+    async def goto_page(page, url, progress=None, settle=0):
+        log.append("login check")
+
+    monkeypatch.setattr(xhs, "main_page", FakeMainPage(log))
+    monkeypatch.setattr(xhs, "is_logged_in", False)
+    monkeypatch.setattr(xhs, "goto_page", goto_page)
+    monkeypatch.setattr(xhs, "page_scheduler", xhs.PageScheduler(1, {}))
+
+    async def interactive_call(started):
+        async with xhs.page_scheduler.main_page_slot():
+            started.set()
+            await asyncio.sleep(0.02)
+            log.append("interactive done")
+
+    async def run():
+        started = asyncio.Event()
+        interactive = asyncio.ensure_future(interactive_call(started))
+        await started.wait()
+        # 只使用后台页面的工具不持有主页面，登录检查要等交互式调用结束
+        assert await xhs.ensure_browser()
+        await interactive
+
+    asyncio.run(run())
+    assert log == ["interactive done", "login check"]
+
+
+@pytest.fixture
+def fake_search(monkeypatch):
+    results = {
+        "露营": [
+            {"note_id": "a", "title": "露营装备清单大全分享", "url": "https://x/search_result/a"},
+            {"note_id": "b", "title": "帐篷怎么选才不踩坑", "url": "https://x/search_result/b"},
+        ],
+        "帐篷": [
+            {"note_id": "b", "title": "帐篷怎么选才不踩坑", "url": "https://x/search_result/b"},
+            {"note_id": "c", "title": "露营装备清单大全分享！", "url": "https://x/search_result/c"},
+        ],
+    }
+
+    async def ensure_browser():
+        return True
+
+    async def search_on_pool_page(keywords, sort_by_time, limit):
+        return results[keywords]
+
+    monkeypatch.setattr(xhs, "ensure_browser", ensure_browser)
+    monkeypatch.setattr(xhs, "_search_on_pool_page", search_on_pool_page)
+    monkeypatch.setattr(xhs, "fingerprint_index", xhs.SimHashIndex(None))
+
+
+def test_merged_ranking(fake_search):
+    payload = json.loads(asyncio.run(xhs.multi_search_notes("露营,帐篷", compact=True)))
+    assert [item["note_id"] for item in payload["items"]] == ["b", "a", "c"]
+    assert payload["items"][0]["keywords"] == ["露营", "帐篷"]
+
+
+def test_dedupe(fake_search):
+    payload = json.loads(asyncio.run(xhs.multi_search_notes("露营,帐篷", compact=True, dedupe=True)))
+    assert [item["note_id"] for item in payload["items"]] == ["b", "a"]
+    assert payload["items"][1]["duplicates"] == ["c"]
+    assert "另有 1 条相似笔记已合并" in asyncio.run(xhs.multi_search_notes("露营,帐篷", dedupe=True))
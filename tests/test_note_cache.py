@@ -0,0 +1,64 @@
+"""笔记内容缓存与预取"""
+import asyncio
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+URL = "https://www.xiaohongshu.com/explore/abc123"
+
+
+def test_note_cache_expires_and_evicts(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(xhs.time, "monotonic", lambda: now[0])
+    cache = xhs.NoteCache(ttl=10, max_entries=2)
+    cache.put("a", {"title": "A"})
+    cache.put("b", {"title": "B"})
+    assert cache.get("a") == {"title": "A"}
+    # a 刚被读取过，超出数量上限时淘汰最久未使用的 b
+    cache.put("c", {"title": "C"})
+    assert cache.get("b") is None
+    now[0] += 11
+    assert cache.get("a") is None
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    calls = []
+
+    async def load_note_content(page, url, progress=None, media=False):
+        calls.append(url)
+        return {"标题": f"第{len(calls)}次加载", "作者": "作者", "发布时间": "", "内容": "正文"}
+
+    monkeypatch.setattr(xhs, "load_note_content", load_note_content)
+    monkeypatch.setattr(xhs, "append_records", lambda dataset, records: None)
+    monkeypatch.setattr(xhs, "index_note_fingerprint", lambda record: None)
+    monkeypatch.setattr(xhs, "note_cache", xhs.NoteCache(600, 10))
+    return calls
+
+
+def test_without_prefetch_notes_are_always_reloaded(monkeypatch, loads):
+    monkeypatch.setattr(xhs, "PREFETCH_TOP_K", 0)
+
+    async def run():
+        first = await xhs.read_note_record(None, URL)
+        second = await xhs.read_note_record(None, URL)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert (first["title"], second["title"]) == ("第1次加载", "第2次加载")
+
+
+def test_prefetched_notes_are_served_from_cache(monkeypatch, loads):
+    monkeypatch.setattr(xhs, "PREFETCH_TOP_K", 3)
+
+    async def run():
+        xhs.note_cache.put("abc123", {"note_id": "abc123", "url": URL, "title": "预取的内容"})
+        cached = await xhs.read_note_record(None, URL)
+        refreshed = await xhs.read_note_record(None, URL, refresh=True)
+        return cached, refreshed
+
+    cached, refreshed = asyncio.run(run())
+    assert cached["title"] == "预取的内容"
+    assert refreshed["title"] == "第1次加载"
+    assert loads == [URL]
@@ -0,0 +1,101 @@
+"""页面调度器：优先级顺序、类别并发上限和取消后的容量归还"""
+import asyncio
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_scheduler_grants_by_priority(fake_browser):
+    async def run():
+        scheduler = xhs.PageScheduler(1, {})
+        first = await scheduler.acquire("background")
+        order = []
+
+        async def borrow(priority):
+            page = await scheduler.acquire(priority)
+            order.append(priority)
+            scheduler.release(page, priority)
+
+        tasks = [asyncio.ensure_future(borrow(priority)) for priority in ("background", "batch", "interactive")]
+        await _settle()
+        assert order == []
+        scheduler.release(first, "background")
+        await asyncio.gather(*tasks)
+        return order, len(fake_browser.pages)
+
+    order, created = asyncio.run(run())
+    assert order == ["interactive", "batch", "background"]
+    assert created == 1
+
+
+def test_scheduler_respects_caps(fake_browser):
+    async def run():
+        scheduler = xhs.PageScheduler(3, {"background": 1})
+        first = await scheduler.acquire("background")
+        blocked = asyncio.ensure_future(scheduler.acquire("background"))
+        await _settle()
+        assert not blocked.done()
+        # 后台类别达到上限时，其他类别仍可使用空余页面
+        interactive = await scheduler.acquire("interactive")
+        assert scheduler.status()["waiting"]["background"] == 1
+        scheduler.release(first, "background")
+        second = await blocked
+        scheduler.release(second, "background")
+        scheduler.release(interactive, "interactive")
+        return scheduler.status()
+
+    status = asyncio.run(run())
+    assert status["active"] == {"interactive": 0, "batch": 0, "background": 0}
+    assert status["pages"] == status["idle"] == 2
+
+
+def test_scheduler_cancel_after_grant_releases_capacity(fake_browser):
+    async def run():
+        scheduler = xhs.PageScheduler(1, {})
+        page = await scheduler.acquire("batch")
+        waiter = asyncio.ensure_future(scheduler.acquire("interactive"))
+        await _settle()
+        # 页面已分配给等待者，但等待者在恢复执行前被取消
+        scheduler.release(page, "batch")
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        again = await asyncio.wait_for(scheduler.acquire("background"), 1)
+        return again is page, scheduler.status()
+
+    reused, status = asyncio.run(run())
+    assert reused
+    assert status["active"] == {"interactive": 0, "batch": 0, "background": 1}
+
+
+def test_scheduler_cancel_while_creating_page(fake_browser, monkeypatch):
+    async def run():
+        created = fake_browser.new_page
+        gate = asyncio.Event()
+
+        async def slow_new_page():
+            await gate.wait()
+            return await created()
+
+        monkeypatch.setattr(fake_browser, "new_page", slow_new_page)
+        scheduler = xhs.PageScheduler(1, {})
+        waiter = asyncio.ensure_future(scheduler.acquire("batch"))
+        # 分配到新建页面的名额后，在页面创建完成前被取消
+        await _settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        gate.set()
+        page = await asyncio.wait_for(scheduler.acquire("batch"), 1)
+        return page, scheduler
+
+    page, scheduler = asyncio.run(run())
+    assert page is not None
+    assert scheduler._creating == 0
+    assert scheduler.status()["active"]["batch"] == 1
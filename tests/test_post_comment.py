@@ -0,0 +1,87 @@
+"""发布评论后的确认：评论区新评论与发布接口响应"""
+import asyncio
+
+import xiaohongshu_mcp as xhs
+
+POST_URL = f"https://edith.xiaohongshu.com{xhs.COMMENT_POST_API}"
+
+
+class FakeResponse:
+    def __init__(self, url, data, method="POST"):
+        self.url = url
+        self.request = type("Request", (), {"method": method})()
+        self._data = data
+
+    async def json(self):
+        return self._data
+
+
+class FakeHandle:
+    def __init__(self, value):
+        self.value = value
+
+    async def json_value(self):
+        return self.value
+
+
+class FakeCommentPage:
+    def __init__(self, observed_after=None):
+        self.handlers = []
+        self.observed_after = observed_after
+
+    def on(self, event, handler):
+        self.handlers.append(handler)
+
+    def remove_listener(self, event, handler):
+        self.handlers.remove(handler)
+
+    async def wait_for_function(self, script, timeout):
+        if self.observed_after is None:
+            await asyncio.sleep(timeout / 1000)
+            raise TimeoutError("timeout")
+        await asyncio.sleep(self.observed_after)
+        return FakeHandle({"id": "from-dom"})
+
+    async def evaluate(self, script, *args):
+        pass
+
+    async def respond(self, response, delay=0.01):
+        await asyncio.sleep(delay)
+        for handler in list(self.handlers):
+            await handler(response)
+
+
+def _confirm(page, response=None, timeout=1):
+    async def run():
+        future = xhs.watch_comment_response(page)
+        if response is not None:
+            asyncio.ensure_future(page.respond(response))
+        result = await xhs.wait_for_posted_comment(page, future, timeout=timeout)
+        await asyncio.sleep(0)
+        return result
+
+    return asyncio.run(run())
+
+
+def test_comment_id_from_post_response():
+    page = FakeCommentPage()
+    response = FakeResponse(POST_URL, {"success": True, "data": {"comment": {"id": "c42"}}})
+    assert _confirm(page, response) == {"id": "c42"}
+    assert page.handlers == []
+
+
+def test_post_response_error():
+    page = FakeCommentPage()
+    assert _confirm(page, FakeResponse(POST_URL, {"success": False, "msg": "评论过于频繁"})) == {"error": "评论过于频繁"}
+
+
+def test_unrelated_responses_are_ignored():
+    page = FakeCommentPage(observed_after=0.05)
+    response = FakeResponse("https://edith.xiaohongshu.com/api/sns/web/v1/feed", {"success": True})
+    assert _confirm(page, response) == {"id": "from-dom"}
+
+
+def test_no_signal_returns_none():
+    page = FakeCommentPage()
+    assert _confirm(page, timeout=0.1) is None
+    assert page.handlers == []
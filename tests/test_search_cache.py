@@ -0,0 +1,77 @@
+"""搜索结果缓存：只有滚动到结果末尾时才视为完整"""
+import asyncio
+import contextlib
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+
+class FakeSearchPage:
+    """每次滚动多显示一批卡片，直到全部显示"""
+
+    def __init__(self, total, batch=5):
+        self.cards = [{"href": f"/search_result/n{i}", "title": f"笔记{i}"} for i in range(total)]
+        self.batch = batch
+        self.shown = batch
+
+    async def evaluate(self, script):
+        if script == xhs.SEARCH_CARDS_JS:
+            return self.cards[:self.shown]
+        self.shown += self.batch
+
+
+@pytest.fixture
+def search_env(monkeypatch):
+    opened = []
+
+    class Scheduler:
+        @contextlib.asynccontextmanager
+        async def page(self, priority):
+            yield opened[-1]
+
+    async def open_search_page(page, keywords, sort_by_time, progress=None):
+        pass
+
+    monkeypatch.setattr(xhs, "SLEEP_SCALE", 0)
+    monkeypatch.setattr(xhs, "page_scheduler", Scheduler())
+    monkeypatch.setattr(xhs, "open_search_page", open_search_page)
+    monkeypatch.setattr(xhs, "append_records", lambda dataset, records: None)
+    monkeypatch.setattr(xhs, "search_cache", xhs.NoteCache(600, 10))
+    return opened
+
+
+def test_harvest_reports_whether_results_ran_out(monkeypatch):
+    monkeypatch.setattr(xhs, "SLEEP_SCALE", 0)
+    posts, complete = asyncio.run(xhs.harvest_search_results(FakeSearchPage(12), 20))
+    assert len(posts) == 12 and complete
+    # 滚动次数用尽时结果不足，但不能当作已到末尾
+    posts, complete = asyncio.run(xhs.harvest_search_results(FakeSearchPage(100), 80, max_scrolls=3))
+    assert len(posts) == 20 and not complete
+    posts, complete = asyncio.run(xhs.harvest_search_results(FakeSearchPage(100), 8))
+    assert len(posts) == 8 and not complete
+
+
+def test_complete_results_are_served_from_cache(search_env):
+    search_env.append(FakeSearchPage(12))
+    posts = asyncio.run(xhs._search_on_pool_page("咖啡", True, 20))
+    assert len(posts) == 12
+    assert xhs.search_cache.get(xhs.search_cache_key("咖啡", True))["complete"]
+
+    # 已经到底的结果直接满足更大的请求，不再打开页面
+    search_env.append(None)
+    assert len(asyncio.run(xhs._search_on_pool_page("咖啡", True, 30))) == 12
+
+
+def test_truncated_results_are_extended(search_env):
+    search_env.append(FakeSearchPage(100))
+    posts = asyncio.run(xhs._search_on_pool_page("咖啡", True, 80))
+    assert len(posts) == 55
+    assert not xhs.search_cache.get(xhs.search_cache_key("咖啡", True))["complete"]
+
+    # 缓存不足且未到末尾时重新搜索，而不是返回截断的缓存
+    search_env.append(FakeSearchPage(100, batch=10))
+    assert len(asyncio.run(xhs._search_on_pool_page("咖啡", True, 60))) == 60
+    # 数量足够的请求直接使用缓存
+    search_env.append(None)
+    assert len(asyncio.run(xhs._search_on_pool_page("咖啡", True, 40))) == 40
@@ -0,0 +1,37 @@
+"""近似重复笔记合并"""
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+
+@pytest.fixture
+def memory_fingerprints(monkeypatch):
+    index = xhs.SimHashIndex(None)
+    monkeypatch.setattr(xhs, "fingerprint_index", index)
+    return index
+
+
+def test_collapse_duplicates_skips_placeholder_titles(memory_fingerprints):
+    posts = [
+        {"note_id": "a", "title": "未知标题"},
+        {"note_id": "b", "title": "未知标题"},
+        {"note_id": "c", "title": "短"},
+        {"note_id": "d", "title": "短"},
+        {"note_id": "e", "title": "上海咖啡探店合集推荐"},
+        {"note_id": "f", "title": "上海咖啡探店合集推荐！！"},
+    ]
+    kept = xhs.collapse_duplicates(posts)
+    assert [post["note_id"] for post in kept] == ["a", "b", "c", "d", "e"]
+    assert kept[-1]["duplicates"] == ["f"]
+
+
+def test_collapse_duplicates_matches_indexed_bodies(memory_fingerprints):
+    body = "这是一篇关于上海咖啡探店的长笔记，包含很多具体的店铺推荐、价格和营业时间"
+    for note_id in ("old", "a", "b"):
+        memory_fingerprints.add(note_id, body)
+    posts = [{"note_id": "a", "title": "标题完全不同的第一篇"}, {"note_id": "b", "title": "另一个毫不相关的标题"}]
+    kept = xhs.collapse_duplicates(posts)
+    assert len(kept) == 1
+    assert kept[0]["duplicates"] == ["b"]
+    assert kept[0]["similar"] == ["old"]
@@ -0,0 +1,72 @@
+"""页面快照的保存与离线重新提取"""
+import asyncio
+import gzip
+import json
+import os
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+URL = "https://www.xiaohongshu.com/explore/abc123"
+BODY = "这是一篇关于上海咖啡探店的笔记正文，记录了五家值得一去的独立咖啡馆以及它们各自的招牌饮品和环境。"
+HTML = f"""<html><body>
+<div id="detail-title">上海咖啡探店</div>
+<span class="username">作者甲</span>
+<span class="date">编辑于 05-20</span>
+<div id="detail-desc"><span class="note-text">{BODY}</span></div>
+<div class="comments-container">
+  <div class="comment-item"><span class="user-name">用户乙</span><div class="content">收藏了，周末去</div><span class="time">1天前</span></div>
+  <div class="comment-item"><span class="user-name">用户丙</span><div class="content">第二家很好喝</div><span class="time">2天前</span></div>
+</div>
+</body></html>"""
+
+
+@pytest.fixture
+def snapshot_dirs(monkeypatch, tmp_path):
+    monkeypatch.setattr(xhs, "SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    monkeypatch.setattr(xhs, "RECORDS_DIR", str(tmp_path / "records"))
+    return tmp_path
+
+
+def _records(dataset):
+    with open(os.path.join(xhs.RECORDS_DIR, f"{dataset}.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_snapshot_round_trip(snapshot_dirs):
+    xhs._write_snapshot("abc123", URL, HTML)
+    path = os.path.join(xhs.SNAPSHOT_DIR, "abc123.html.gz")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert f.readline().startswith(f'<!--xhs-snapshot url="{URL}"')
+    assert not os.path.exists(path + ".tmp")
+
+    snapshot = xhs.read_snapshot(path)
+    assert (snapshot["note_id"], snapshot["url"]) == ("abc123", URL)
+    assert snapshot["html"].endswith(HTML)
+
+
+def test_reextract_from_snapshot(snapshot_dirs):
+    xhs._write_snapshot("abc123", URL, HTML)
+
+    result = asyncio.run(xhs.reextract_snapshots("abc123,missing"))
+    assert "已处理 1 个快照，提取 1 篇笔记，2 条评论" in result
+    assert "未找到快照: missing" in result
+    assert "标题: 上海咖啡探店" in result
+
+    note = _records("notes")[0]
+    assert (note["note_id"], note["url"], note["author"]) == ("abc123", URL, "作者甲")
+    assert (note["publish_time"], note["content"]) == ("编辑于 05-20", BODY)
+    comments = _records("comments")
+    assert [(c["username"], c["content"], c["time"]) for c in comments] == [
+        ("用户乙", "收藏了，周末去", "1天前"),
+        ("用户丙", "第二家很好喝", "2天前"),
+    ]
+
+
+def test_reextract_without_backfill_or_snapshots(snapshot_dirs):
+    assert "未找到可用的页面快照" in asyncio.run(xhs.reextract_snapshots())
+    xhs._write_snapshot("abc123", URL, HTML)
+    assert "提取 1 篇笔记" in asyncio.run(xhs.reextract_snapshots(dataset="notes", backfill=False))
+    assert not os.path.exists(xhs.RECORDS_DIR)
+    assert "未知的数据集" in asyncio.run(xhs.reextract_snapshots(dataset="likes"))
@@ -0,0 +1,58 @@
+"""用户笔记列表：笔记作者解析与缓存"""
+import asyncio
+
+import pytest
+
+import xiaohongshu_mcp as xhs
+
+NOTE_URL = "https://www.xiaohongshu.com/explore/note1"
+
+
+class FakeNotePage:
+    def __init__(self):
+        self.visits = []
+
+    async def evaluate(self, script):
+        return "/user/profile/author1?xsec_token=t"
+
+
+@pytest.fixture
+def profile_env(monkeypatch, tmp_path):
+    page = FakeNotePage()
+
+    async def goto_page(target, url, progress=None, settle=0):
+        page.visits.append(url)
+
+    async def is_same_page(url, target=None):
+        return False
+
+    monkeypatch.setattr(xhs, "goto_page", goto_page)
+    monkeypatch.setattr(xhs, "is_same_page", is_same_page)
+    monkeypatch.setattr(xhs, "note_author_urls", xhs.OrderedDict())
+    monkeypatch.setattr(xhs, "engagement_history", xhs.EngagementHistory(str(tmp_path / "engagement.jsonl")))
+    return page
+
+
+def test_note_author_is_resolved_once(profile_env):
+    async def run():
+        first = await xhs.resolve_user_profile(profile_env, NOTE_URL)
+        second = await xhs.resolve_user_profile(profile_env, NOTE_URL)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == f"{xhs.BASE_URL}/user/profile/author1?xsec_token=t"
+    assert profile_env.visits == [NOTE_URL]
+
+
+def test_note_author_from_engagement_history(profile_env):
+    xhs.engagement_history.record("like", "note1", "author2")
+    profile_url = asyncio.run(xhs.resolve_user_profile(profile_env, NOTE_URL))
+    assert profile_url == f"{xhs.BASE_URL}/user/profile/author2"
+    assert profile_env.visits == []
+
+
+def test_user_ids_and_profile_urls_need_no_page(profile_env):
+    assert asyncio.run(xhs.resolve_user_profile(profile_env, "abc")) == f"{xhs.BASE_URL}/user/profile/abc"
+    url = "https://www.xiaohongshu.com/user/profile/abc?xsec_token=t"
+    assert asyncio.run(xhs.resolve_user_profile(profile_env, url)) == url
+    assert profile_env.visits == []
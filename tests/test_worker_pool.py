@@ -0,0 +1,62 @@
+"""浏览器工作进程池：工作进程退出时结束丢失的调用，领取到已放弃的调用时跳过"""
+import asyncio
+import queue
+
+import xiaohongshu_mcp as xhs
+
+
+class DeadProcess:
+    def is_alive(self):
+        return False
+
+
+def _drain(q):
+    items = []
+    while not q.empty():
+        items.append(q.get_nowait())
+    return items
+
+
+def test_worker_skips_abandoned_tasks(monkeypatch):
+    async def tool() -> str:
+        return "ok"
+
+    monkeypatch.setitem(xhs._WORKER_TOOLS, "test_tool", tool)
+    task_queue, result_queue, cancel_queue = queue.Queue(), queue.Queue(), queue.Queue()
+    cancel_queue.put(1)
+    for task in ((1, "test_tool", {}), (2, "test_tool", {}), None):
+        task_queue.put(task)
+
+    asyncio.run(xhs._worker_loop(0, task_queue, result_queue, cancel_queue))
+    assert _drain(result_queue) == [
+        ("done", 0, 1, "调用已取消"),
+        ("start", 0, 2, None),
+        ("done", 0, 2, "ok"),
+    ]
+
+
+def test_dead_worker_fails_inflight_and_unstarted_tasks(monkeypatch):
+    pool = xhs.BrowserWorkerPool(2)
+    respawned = []
+    monkeypatch.setattr(pool, "_spawn", respawned.append)
+
+    async def run():
+        pool._loop = asyncio.get_running_loop()
+        pool._processes = {0: DeadProcess()}
+        pool._cancel_queues = {0: queue.Queue(), 1: queue.Queue()}
+        futures = {task_id: pool._loop.create_future() for task_id in (5, 6, 7)}
+        pool._futures = dict(futures)
+        pool._inflight = {0: 5}
+        pool._queued = {6, 7}
+        pool._check_workers()
+        results = await asyncio.gather(*futures.values())
+        return dict(zip(futures, results))
+
+    results = asyncio.run(run())
+    assert "意外退出" in results[5]
+    assert "未能开始执行" in results[6] and "未能开始执行" in results[7]
+    assert respawned == [0]
+    assert pool._queued == set()
+    assert pool._abandoned == {6, 7}
+    # 仍在队列中的调用被存活的工作进程领取时会跳过
+    assert sorted(_drain(pool._cancel_queues[1])) == [6, 7]
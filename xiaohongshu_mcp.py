@@ -1,70 +1,1182 @@
-from typing import Any, List, Dict, Optional
+from typing import Any, List, Dict, Optional, Tuple
 import asyncio
+import contextlib
+import contextvars
+import functools
+import gzip
+import hashlib
+import heapq
+import inspect
+import itertools
 import json
+import mimetypes
+import multiprocessing
 import os
-import pandas as pd
+import queue
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
 from datetime import datetime
-from playwright.async_api import async_playwright
-from fastmcp import FastMCP
+from urllib.parse import urlparse
+import schedule
+from fastmcp import FastMCP, Context
+
+@contextlib.asynccontextmanager
+async def server_lifespan(server):
+    """服务器启动时即启动后台服务，已登记的关键词监控在重启后无需等待工具调用就继续运行"""
+    start_background_services()
+    yield {}
 
 # 初始化 FastMCP 服务器
-mcp = FastMCP("xiaohongshu_scraper")
+mcp = FastMCP("xiaohongshu_scraper", lifespan=server_lifespan)
 
 # 全局变量
-BROWSER_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "browser_data")
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+BROWSER_DATA_DIR = os.environ.get("XHS_BROWSER_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "browser_data")
+DATA_DIR = os.environ.get("XHS_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# 站点地址，负载测试等场景下可指向本地模拟站点
+BASE_URL = os.environ.get("XHS_BASE_URL", "https://www.xiaohongshu.com").rstrip("/")
+# 是否以无界面模式启动浏览器；首次登录需要界面，默认关闭
+HEADLESS = os.environ.get("XHS_HEADLESS", "").lower() in ("1", "true", "yes")
 TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-# 确保目录存在
-os.makedirs(BROWSER_DATA_DIR, exist_ok=True)
-os.makedirs(DATA_DIR, exist_ok=True)
+# 导入时不创建目录也不加载 Playwright、pandas 等重量级模块，
+# 使客户端启动服务器后能立即完成握手并列出工具；需要时在首次使用处创建和导入
 
 # 用于存储浏览器上下文，以便在不同方法之间共享
 browser_context = None
 main_page = None
 is_logged_in = False
+playwright_instance = None
+
+# 浏览器看门狗：定期检查页面是否有响应，崩溃或卡死时自动恢复
+WATCHDOG_INTERVAL = float(os.environ.get("XHS_WATCHDOG_INTERVAL", "15"))  # 检查间隔（秒），0表示关闭
+WATCHDOG_TIMEOUT = float(os.environ.get("XHS_WATCHDOG_TIMEOUT", "10"))  # 单次探测以及关闭、新建页面的超时（秒）
+# 每次重新启动浏览器或替换主页面时递增，用于判断调用期间浏览器是否被恢复过
+browser_generation = 0
+browser_unhealthy = False
+_watchdog_task = None
+# 串行化浏览器的启动、关闭和恢复，避免并发调用在同一数据目录上启动第二个浏览器
+_browser_lock = None
+
+# 自适应超时：取每类操作最近 LATENCY_WINDOW 次耗时的分位数，乘以安全系数作为超时
+LATENCY_WINDOW = int(os.environ.get("XHS_LATENCY_WINDOW", "200"))
+LATENCY_MIN_SAMPLES = int(os.environ.get("XHS_LATENCY_MIN_SAMPLES", "10"))
+TIMEOUT_PERCENTILE = float(os.environ.get("XHS_TIMEOUT_PERCENTILE", "95"))
+TIMEOUT_MARGIN = float(os.environ.get("XHS_TIMEOUT_MARGIN", "3"))
+
+# HAR录制与回放：record 模式把会话的网络请求保存为HAR，replay 模式所有请求都从HAR中读取
+HAR_MODE = os.environ.get("XHS_HAR_MODE", "").lower()
+HAR_DIR = os.path.join(DATA_DIR, "har")
+HAR_PATH = os.environ.get("XHS_HAR_PATH", "")
+# 等待页面渲染的固定延时的缩放比例，回放模式下默认大幅缩短
+SLEEP_SCALE = float(os.environ.get("XHS_SLEEP_SCALE", "0.1" if HAR_MODE == "replay" else "1"))
+har_recording_path = None
+
+# 后台页面池大小：主页面之外可同时打开的页面数量，供预取、监控等后台任务使用
+PAGE_POOL_SIZE = int(os.environ.get("XHS_PAGE_POOL_SIZE", "2"))
+# 页面调度的优先级类别（按优先级从高到低）及各类别的最大并发页面数，0表示不限制
+PRIORITY_CLASSES = ("interactive", "batch", "background")
+PRIORITY_CAPS = {
+    "interactive": int(os.environ.get("XHS_CAP_INTERACTIVE", "0")),
+    "batch": int(os.environ.get("XHS_CAP_BATCH", "0")),
+    "background": int(os.environ.get("XHS_CAP_BACKGROUND", "1")),
+}
+# 搜索完成后在后台预取前K条结果的内容，0表示关闭
+PREFETCH_TOP_K = int(os.environ.get("XHS_PREFETCH_TOP_K", "0"))
+# 笔记内容缓存的有效期（秒）和最大条数
+NOTE_CACHE_TTL = float(os.environ.get("XHS_NOTE_CACHE_TTL", "600"))
+NOTE_CACHE_SIZE = int(os.environ.get("XHS_NOTE_CACHE_SIZE", "200"))
+# 用户笔记列表缓存有效期（秒）和最大用户数
+USER_NOTES_CACHE_TTL = float(os.environ.get("XHS_USER_NOTES_CACHE_TTL", "3600"))
+USER_NOTES_CACHE_SIZE = int(os.environ.get("XHS_USER_NOTES_CACHE_SIZE", "100"))
+# 搜索结果缓存有效期（秒）和最大查询数，0表示关闭缓存
+SEARCH_CACHE_TTL = float(os.environ.get("XHS_SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_SIZE = int(os.environ.get("XHS_SEARCH_CACHE_SIZE", "50"))
+# 笔记 SimHash 指纹索引文件，以及视为近似重复的最大汉明距离（需小于4）
+SIMHASH_INDEX_PATH = os.path.join(DATA_DIR, "simhash_index.txt")
+SIMHASH_DISTANCE = int(os.environ.get("XHS_SIMHASH_DISTANCE", "3"))
+# 去除标点后短于该长度的标题指纹不可靠，不参与标题去重
+SIMHASH_MIN_TITLE_LENGTH = int(os.environ.get("XHS_SIMHASH_MIN_TITLE_LENGTH", "6"))
+# 笔记图片和视频的存储目录（按内容哈希去重），以及同时下载的最大数量
+MEDIA_DIR = os.path.join(DATA_DIR, "media")
+MEDIA_CONCURRENCY = int(os.environ.get("XHS_MEDIA_CONCURRENCY", "4"))
+MEDIA_TIMEOUT = float(os.environ.get("XHS_MEDIA_TIMEOUT", "120"))  # 单个文件的下载超时（秒）
+# 性能分析：对 XHS_PROFILE 中的工具（逗号分隔，all 表示全部浏览器工具）的每次调用采集 Python 采样和 Playwright trace
+PROFILE_TOOLS = {name.strip() for name in os.environ.get("XHS_PROFILE", "").split(",") if name.strip()}
+PROFILE_INTERVAL = float(os.environ.get("XHS_PROFILE_INTERVAL", "5"))  # 采样间隔（毫秒）
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+
+# 多进程模式配置：XHS_WORKERS > 0 时，浏览器工具由独立的工作进程执行
+WORKER_COUNT = int(os.environ.get("XHS_WORKERS", "0"))
+WORKER_DATA_ROOT = BROWSER_DATA_DIR + "_workers"
+
+# 当前进程是否为工作进程（工作进程内直接执行工具，不再转发）
+_IS_WORKER = False
+# 工具名称 -> 原始协程函数，供工作进程按名称调用
+_WORKER_TOOLS = {}
+_worker_pool = None
+
+# 抓取记录与导出目录
+RECORDS_DIR = os.path.join(DATA_DIR, "records")
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
+
+# 导出数据的固定表结构：列名 -> 类型
+EXPORT_SCHEMAS = {
+    "notes": {
+        "note_id": "str",
+        "url": "str",
+        "title": "str",
+        "author": "str",
+        "publish_time": "str",
+        "content": "str",
+        "scraped_at": "str",
+    },
+    "comments": {
+        "note_id": "str",
+        "url": "str",
+        "username": "str",
+        "content": "str",
+        "time": "str",
+        "scraped_at": "str",
+    },
+    "search": {
+        "keywords": "str",
+        "rank": "int",
+        "note_id": "str",
+        "url": "str",
+        "title": "str",
+        "sort_by_time": "bool",
+        "scraped_at": "str",
+    },
+    "user_notes": {
+        "user_id": "str",
+        "rank": "int",
+        "note_id": "str",
+        "url": "str",
+        "title": "str",
+        "likes": "str",
+        "scraped_at": "str",
+    },
+}
+
+async def page_wait(seconds: float):
+    """等待页面加载或渲染的固定延时，按 SLEEP_SCALE 缩放"""
+    await asyncio.sleep(seconds * SLEEP_SCALE)
+
+class LatencyModel:
+    """按操作类别记录最近的耗时，并由耗时分位数乘以安全系数得出超时
+    
+    样本不足时使用默认超时；得出的超时限制在各类别的上下限之间。
+    环境变量 XHS_TIMEOUT_<类别>（毫秒，如 XHS_TIMEOUT_NAVIGATION）可固定某一类别的超时。
+    """
+    
+    # 类别 -> (样本不足时的默认超时, 下限, 上限)，单位毫秒
+    OPERATIONS = {
+        "navigation": (60000, 10000, 60000),
+        "selector": (10000, 5000, 60000),
+    }
+    
+    def __init__(self, window: int, min_samples: int, percentile: float, margin: float):
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self.margin = margin
+        self._samples = {operation: deque(maxlen=window) for operation in self.OPERATIONS}
+        self._overrides = {
+            operation: int(os.environ[f"XHS_TIMEOUT_{operation.upper()}"])
+            for operation in self.OPERATIONS if os.environ.get(f"XHS_TIMEOUT_{operation.upper()}")
+        }
+    
+    def observe(self, operation: str, seconds: float):
+        self._samples[operation].append(seconds * 1000)
+    
+    @contextlib.contextmanager
+    def track(self, operation: str):
+        """记录代码块的耗时，超时失败的操作同样计入，使超时随变慢的网络放宽"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(operation, time.monotonic() - start)
+    
+    def quantile(self, operation: str, percentile: Optional[float] = None) -> Optional[float]:
+        """返回耗时分位数（毫秒），没有样本时返回 None"""
+        samples = sorted(self._samples[operation])
+        if not samples:
+            return None
+        rank = (percentile if percentile is not None else self.percentile) / 100 * (len(samples) - 1)
+        return samples[round(rank)]
+    
+    def timeout_ms(self, operation: str) -> int:
+        if operation in self._overrides:
+            return self._overrides[operation]
+        default, lower, upper = self.OPERATIONS[operation]
+        if len(self._samples[operation]) < self.min_samples:
+            return default
+        return int(min(upper, max(lower, self.quantile(operation) * self.margin)))
+    
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            operation: {
+                "samples": len(self._samples[operation]),
+                "p50_ms": self.quantile(operation, 50),
+                "p95_ms": self.quantile(operation, 95),
+                "timeout_ms": self.timeout_ms(operation),
+            }
+            for operation in self.OPERATIONS
+        }
+
+latency_model = LatencyModel(LATENCY_WINDOW, LATENCY_MIN_SAMPLES, TIMEOUT_PERCENTILE, TIMEOUT_MARGIN)
+
+async def settle_page(page, seconds: float):
+    """等待页面加载：网络空闲后立即返回，最长等待 seconds 秒（与 page_wait 一样按 SLEEP_SCALE 缩放）"""
+    start = time.monotonic()
+    ceiling = seconds * SLEEP_SCALE
+    try:
+        await page.wait_for_load_state("networkidle", timeout=max(1, ceiling * 1000))
+    except Exception:
+        pass
+    # 网络空闲后留出少量时间给页面渲染
+    await asyncio.sleep(min(0.5 * SLEEP_SCALE, max(0, ceiling - (time.monotonic() - start))))
+
+async def goto_page(page, url: str, progress: Optional["ToolProgress"] = None, settle: float = 0):
+    """打开页面，导航超时由导航耗时分位数得出
+    
+    Args:
+        page: 要导航的页面
+        url: 目标URL
+        progress: 执行进度，设置了截止时间时超时不超过剩余时间
+        settle: 导航后等待页面加载的最长时间（秒），网络空闲时提前结束
+    """
+    timeout = latency_model.timeout_ms("navigation")
+    if progress:
+        timeout = progress.timeout_ms(timeout)
+    with latency_model.track("navigation"):
+        await page.goto(url, timeout=timeout)
+    if settle > 0:
+        await settle_page(page, settle)
+
+def _har_record_path() -> str:
+    """录制模式下每次启动浏览器写入一个新的HAR文件，避免重新启动时覆盖之前的录制"""
+    if HAR_PATH:
+        base, ext = os.path.splitext(HAR_PATH)
+        return f"{base}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ext or '.har'}"
+    return os.path.join(HAR_DIR, f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}.har")
+
+def _har_replay_path() -> Optional[str]:
+    """回放模式使用 XHS_HAR_PATH 指定的文件，未指定时使用最新的录制"""
+    if HAR_PATH:
+        return HAR_PATH
+    if not os.path.isdir(HAR_DIR):
+        return None
+    recordings = sorted(name for name in os.listdir(HAR_DIR) if name.endswith(".har"))
+    return os.path.join(HAR_DIR, recordings[-1]) if recordings else None
+
+def _mark_browser_unhealthy(*_):
+    """浏览器上下文关闭或主页面崩溃时的事件回调"""
+    global browser_unhealthy
+    browser_unhealthy = True
+
+def _get_browser_lock() -> asyncio.Lock:
+    global _browser_lock
+    if _browser_lock is None:
+        # 在事件循环中延迟创建，避免绑定到错误的事件循环
+        _browser_lock = asyncio.Lock()
+    return _browser_lock
+
+async def launch_browser():
+    """启动Playwright和持久化浏览器上下文，已在运行时直接返回"""
+    async with _get_browser_lock():
+        if browser_context is None:
+            await _launch_browser()
+
+async def _launch_browser():
+    global browser_context, main_page, playwright_instance, browser_generation, browser_unhealthy, har_recording_path
+    
+    launch_options = {}
+    if HAR_MODE == "record":
+        har_recording_path = _har_record_path()
+        os.makedirs(os.path.dirname(os.path.abspath(har_recording_path)), exist_ok=True)
+        launch_options["record_har_path"] = har_recording_path
+        print(f"正在录制HAR: {har_recording_path}")
+    
+    # 启动浏览器
+    from playwright.async_api import async_playwright
+    
+    os.makedirs(BROWSER_DATA_DIR, exist_ok=True)
+    playwright_instance = await async_playwright().start()
+    
+    # 使用持久化上下文来保存用户状态
+    browser_context = await playwright_instance.chromium.launch_persistent_context(
+        user_data_dir=BROWSER_DATA_DIR,
+        headless=HEADLESS,  # 默认非隐藏模式，方便用户登录
+        viewport={"width": 1280, "height": 800},
+        timeout=60000,
+        **launch_options
+    )
+    browser_context.on("close", _mark_browser_unhealthy)
+    
+    if HAR_MODE == "replay":
+        har_path = _har_replay_path()
+        if not har_path or not os.path.exists(har_path):
+            raise RuntimeError(f"回放模式未找到HAR文件: {har_path or HAR_DIR}")
+        # 录制中没有的请求直接中止，保证回放时不访问网络
+        await browser_context.route_from_har(har_path, not_found="abort")
+        print(f"正在从HAR回放: {har_path}")
+    
+    # 创建一个新页面
+    if browser_context.pages:
+        main_page = browser_context.pages[0]
+    else:
+        main_page = await browser_context.new_page()
+    
+    # 设置页面级别的超时时间
+    main_page.set_default_timeout(latency_model.timeout_ms("selector"))
+    main_page.on("crash", _mark_browser_unhealthy)
+    
+    browser_generation += 1
+    browser_unhealthy = False
+    start_browser_watchdog()
+
+async def shutdown_browser():
+    """关闭浏览器上下文并停止Playwright实例，关闭失败时直接丢弃"""
+    async with _get_browser_lock():
+        await _shutdown_browser()
+
+async def _shutdown_browser():
+    global browser_context, main_page, playwright_instance
+    
+    context, instance = browser_context, playwright_instance
+    browser_context = None
+    main_page = None
+    playwright_instance = None
+    page_scheduler.reset()
+    
+    if context is not None:
+        try:
+            await asyncio.wait_for(context.close(), timeout=WATCHDOG_TIMEOUT)
+        except Exception as e:
+            print(f"关闭浏览器上下文时出错: {str(e)}")
+    if instance is not None:
+        try:
+            await asyncio.wait_for(instance.stop(), timeout=WATCHDOG_TIMEOUT)
+        except Exception as e:
+            print(f"停止Playwright时出错: {str(e)}")
+
+async def recover_browser():
+    """浏览器被标记为异常时，关闭旧实例并使用同一数据目录重新启动，保留登录状态"""
+    if browser_context is None or not browser_unhealthy:
+        return
+    async with _get_browser_lock():
+        # 等待锁期间其他调用可能已经完成了恢复，或浏览器已被关闭
+        if browser_context is None or not browser_unhealthy:
+            return
+        print("检测到浏览器异常，正在重新启动")
+        await _shutdown_browser()
+        await _launch_browser()
+
+async def _page_responsive(page) -> bool:
+    """探测页面是否有响应：超时或页面已关闭视为无响应，导航中的其他错误视为正常"""
+    if page.is_closed():
+        return False
+    try:
+        # 探测本身几乎立即返回，不能代表页面操作的耗时，因此使用固定超时且不计入耗时统计
+        await asyncio.wait_for(page.evaluate("1"), timeout=WATCHDOG_TIMEOUT)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    except Exception as e:
+        message = str(e).lower()
+        return "closed" not in message and "crash" not in message
+
+async def check_browser_health():
+    """检查所有页面：其他页面无响应时关闭，主页面无响应时换新页面，仍失败时重启浏览器"""
+    if browser_context is None:
+        return
+    async with _get_browser_lock():
+        if browser_context is not None and not browser_unhealthy:
+            await _replace_unresponsive_pages()
+    
+    await recover_browser()
+
+async def _replace_unresponsive_pages():
+    """关闭无响应的后台页面，主页面无响应时替换为新页面，替换失败时标记浏览器异常"""
+    global main_page, browser_generation, browser_unhealthy
+    
+    try:
+        for page in list(browser_context.pages):
+            if page is not main_page and not await _page_responsive(page):
+                print("后台页面无响应，已关闭")
+                await asyncio.wait_for(page.close(), timeout=WATCHDOG_TIMEOUT)
+        
+        if main_page is None or not await _page_responsive(main_page):
+            print("主页面无响应，正在替换为新页面")
+            old_page = main_page
+            main_page = await asyncio.wait_for(browser_context.new_page(), timeout=WATCHDOG_TIMEOUT)
+            main_page.set_default_timeout(latency_model.timeout_ms("selector"))
+            main_page.on("crash", _mark_browser_unhealthy)
+            browser_generation += 1
+            if old_page is not None and not old_page.is_closed():
+                await asyncio.wait_for(old_page.close(), timeout=WATCHDOG_TIMEOUT)
+    except Exception as e:
+        print(f"浏览器健康检查失败: {str(e)}")
+        browser_unhealthy = True
+
+async def _browser_watchdog():
+    while True:
+        await asyncio.sleep(WATCHDOG_INTERVAL)
+        try:
+            await check_browser_health()
+        except Exception as e:
+            print(f"浏览器看门狗运行出错: {str(e)}")
+
+def start_browser_watchdog():
+    """在当前事件循环中启动浏览器看门狗"""
+    global _watchdog_task
+    if WATCHDOG_INTERVAL <= 0:
+        return
+    if _watchdog_task is None or _watchdog_task.done():
+        _watchdog_task = asyncio.get_running_loop().create_task(_browser_watchdog())
 
 async def ensure_browser():
     """确保浏览器已启动并登录"""
-    global browser_context, main_page, is_logged_in
+    global is_logged_in
     
     if browser_context is None:
-        # 启动浏览器
-        playwright_instance = await async_playwright().start()
-        
-        # 使用持久化上下文来保存用户状态
-        browser_context = await playwright_instance.chromium.launch_persistent_context(
-            user_data_dir=BROWSER_DATA_DIR,
-            headless=False,  # 非隐藏模式，方便用户登录
-            viewport={"width": 1280, "height": 800},
-            timeout=60000
-        )
-        
-        # 创建一个新页面
-        if browser_context.pages:
-            main_page = browser_context.pages[0]
-        else:
-            main_page = await browser_context.new_page()
-        
-        # 设置页面级别的超时时间
-        main_page.set_default_timeout(60000)
+        await launch_browser()
+    else:
+        await recover_browser()
+    
+    # 按最新的耗时统计调整页面操作的默认超时
+    main_page.set_default_timeout(latency_model.timeout_ms("selector"))
     
     # 检查登录状态
     if not is_logged_in:
-        # 访问小红书首页
-        await main_page.goto("https://www.xiaohongshu.com", timeout=60000)
-        await asyncio.sleep(3)
-        
-        # 检查是否已登录
-        login_elements = await main_page.query_selector_all('text="登录"')
-        if login_elements:
-            return False  # 需要登录
-        else:
-            is_logged_in = True
-            return True  # 已登录
+        # 检查时需要在主页面上打开首页；只使用后台页面的工具同样要先独占主页面，
+        # 避免在其他交互式调用操作主页面时导航
+        async with page_scheduler.main_page_slot():
+            if is_logged_in:
+                return True
+            
+            # 访问小红书首页
+            await goto_page(main_page, BASE_URL, settle=3)
+            
+            # 检查是否已登录
+            login_elements = await main_page.query_selector_all('text="登录"')
+            if login_elements:
+                return False  # 需要登录
+            else:
+                is_logged_in = True
+                return True  # 已登录
     
     return True
 
+# 当前调用是否已持有主页面，嵌套调用（如 analyze_note 调用 get_note_content）时不再重复等待
+_main_page_held = contextvars.ContextVar("main_page_held", default=False)
+
+class PageScheduler:
+    """页面调度器
+    
+    主页面只供交互式工具调用使用，同一时间只有一个调用在操作它；
+    另外维护最多 size 个后台页面，按优先级（interactive > batch > background）分配，
+    每个类别有各自的并发上限。页面只在借出时分配，长任务每处理完一个单元就归还页面，
+    因此交互式请求最多等待当前单元结束即可获得页面。
+    页面被关闭或浏览器重新启动后，失效的页面会被丢弃并按需重新创建。
+    """
+    
+    def __init__(self, size: int, caps: Dict[str, int]):
+        self.size = max(1, size)
+        self.caps = caps
+        self._pages = []
+        self._idle = []
+        self._creating = 0
+        self._active = {priority: 0 for priority in PRIORITY_CLASSES}
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._main_lock = None
+    
+    def _discard_stale(self):
+        self._pages = [page for page in self._pages if not page.is_closed() and page.context is browser_context]
+        self._idle = [page for page in self._idle if page in self._pages]
+    
+    def reset(self):
+        """浏览器关闭时清空页面池"""
+        self._pages = []
+        self._idle = []
+    
+    def _eligible(self, priority: str) -> bool:
+        cap = self.caps.get(priority, 0)
+        return cap <= 0 or self._active[priority] < cap
+    
+    def _dispatch(self):
+        """有空闲容量时，把页面分配给优先级最高且未达到并发上限的等待者"""
+        self._discard_stale()
+        self._waiters = [waiter for waiter in self._waiters if not waiter[3].done()]
+        heapq.heapify(self._waiters)
+        
+        while self._waiters:
+            has_idle = bool(self._idle)
+            if not has_idle and len(self._pages) + self._creating >= self.size:
+                return
+            chosen = next((waiter for waiter in sorted(self._waiters) if self._eligible(waiter[2])), None)
+            if chosen is None:
+                return
+            self._waiters.remove(chosen)
+            heapq.heapify(self._waiters)
+            self._active[chosen[2]] += 1
+            if has_idle:
+                chosen[3].set_result(self._idle.pop())
+            else:
+                # 由等待者自己创建新页面
+                self._creating += 1
+                chosen[3].set_result(None)
+    
+    async def acquire(self, priority: str = "background"):
+        """按优先级借出一个后台页面，没有可用页面时排队等待"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITY_CLASSES.index(priority), next(self._sequence), priority, future))
+        self._dispatch()
+        try:
+            page = await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配但调用方被取消，归还分配到的容量
+                granted = future.result()
+                if granted is None:
+                    self._creating -= 1
+                self.release(granted, priority)
+            raise
+        
+        if page is None:
+            try:
+                page = await browser_context.new_page()
+            except BaseException:
+                self._creating -= 1
+                self._active[priority] -= 1
+                self._dispatch()
+                raise
+            self._creating -= 1
+            self._pages.append(page)
+        page.set_default_timeout(latency_model.timeout_ms("selector"))
+        return page
+    
+    def release(self, page, priority: str = "background"):
+        """归还页面，并把它分配给下一个等待者"""
+        self._active[priority] = max(0, self._active[priority] - 1)
+        if page is not None and page in self._pages and not page.is_closed():
+            self._idle.append(page)
+        self._dispatch()
+    
+    @contextlib.asynccontextmanager
+    async def page(self, priority: str = "background"):
+        page = await self.acquire(priority)
+        try:
+            yield page
+        finally:
+            self.release(page, priority)
+    
+    @contextlib.asynccontextmanager
+    async def main_page_slot(self):
+        """独占主页面，交互式调用按到达顺序依次执行"""
+        if _main_page_held.get():
+            yield
+            return
+        if self._main_lock is None:
+            # 在事件循环中延迟创建，避免绑定到错误的事件循环
+            self._main_lock = asyncio.Lock()
+        async with self._main_lock:
+            token = _main_page_held.set(True)
+            try:
+                yield
+            finally:
+                _main_page_held.reset(token)
+    
+    def status(self) -> Dict[str, Any]:
+        waiting = {priority: 0 for priority in PRIORITY_CLASSES}
+        for waiter in self._waiters:
+            if not waiter[3].done():
+                waiting[waiter[2]] += 1
+        return {
+            "pages": len(self._pages),
+            "idle": len(self._idle),
+            "active": dict(self._active),
+            "waiting": waiting,
+            "main_page_busy": bool(self._main_lock and self._main_lock.locked()),
+        }
+
+page_scheduler = PageScheduler(PAGE_POOL_SIZE, PRIORITY_CAPS)
+
+def _prepare_worker_profile(worker_id: int) -> str:
+    """为工作进程准备独立的浏览器数据目录
+    
+    持久化上下文的数据目录不能被多个浏览器同时使用，因此首次启动时
+    从主数据目录复制一份（跳过锁文件），沿用已有的登录状态。
+    """
+    profile_dir = os.path.join(WORKER_DATA_ROOT, f"worker_{worker_id}")
+    if not os.path.exists(profile_dir):
+        os.makedirs(BROWSER_DATA_DIR, exist_ok=True)
+        shutil.copytree(
+            BROWSER_DATA_DIR,
+            profile_dir,
+            ignore=shutil.ignore_patterns("Singleton*", "*.lock", "lockfile")
+        )
+    return profile_dir
+
+class _WorkerProgressContext:
+    """工作进程内的进度上报代理，把进度通知通过结果队列转发回主进程"""
+    
+    def __init__(self, result_queue, worker_id: int, task_id: int):
+        self._result_queue = result_queue
+        self._worker_id = worker_id
+        self._task_id = task_id
+    
+    async def report_progress(self, progress: float, total: Optional[float] = None, message: Optional[str] = None):
+        self._result_queue.put(("progress", self._worker_id, self._task_id, (progress, total, message)))
+
+def _worker_main(worker_id: int, profile_dir: str, task_queue, result_queue, cancel_queue):
+    """工作进程入口：拥有独立的Playwright实例和浏览器"""
+    global BROWSER_DATA_DIR, _IS_WORKER
+    BROWSER_DATA_DIR = profile_dir
+    _IS_WORKER = True
+    asyncio.run(_worker_loop(worker_id, task_queue, result_queue, cancel_queue))
+
+async def _worker_loop(worker_id: int, task_queue, result_queue, cancel_queue):
+    """从共享任务队列中拉取工具调用并执行，空闲的工作进程会主动领取积压的任务"""
+    loop = asyncio.get_running_loop()
+    # 已被主进程放弃（取消或判定失败）的调用，领取到时直接跳过
+    skipped = set()
+    
+    def drain_cancels():
+        try:
+            while True:
+                skipped.add(cancel_queue.get_nowait())
+        except queue.Empty:
+            pass
+    
+    while True:
+        task = await loop.run_in_executor(None, task_queue.get)
+        if task is None:
+            break
+        task_id, name, kwargs = task
+        drain_cancels()
+        if task_id in skipped:
+            skipped.discard(task_id)
+            result_queue.put(("done", worker_id, task_id, "调用已取消"))
+            continue
+        result_queue.put(("start", worker_id, task_id, None))
+        tool = _WORKER_TOOLS[name]
+        if "ctx" in inspect.signature(tool).parameters:
+            kwargs["ctx"] = _WorkerProgressContext(result_queue, worker_id, task_id)
+        
+        tool_task = asyncio.ensure_future(tool(**kwargs))
+        # 执行期间轮询取消队列，客户端取消调用时尽快中止浏览器操作
+        while not tool_task.done():
+            await asyncio.wait({tool_task}, timeout=0.2)
+            drain_cancels()
+            if task_id in skipped:
+                skipped.discard(task_id)
+                tool_task.cancel()
+        
+        try:
+            result_queue.put(("done", worker_id, task_id, tool_task.result()))
+        except asyncio.CancelledError:
+            result_queue.put(("done", worker_id, task_id, "调用已取消"))
+        except Exception as e:
+            result_queue.put(("error", worker_id, task_id, f"工作进程执行{name}时出错: {str(e)}"))
+
+class BrowserWorkerPool:
+    """浏览器工作进程池
+    
+    每个工作进程拥有自己的Playwright实例和浏览器，主进程只负责MCP协议处理，
+    通过共享任务队列分发工具调用：哪个工作进程空闲就由哪个领取，
+    耗时长的调用不会阻塞其他工作进程上的任务。
+    """
+    
+    def __init__(self, size: int):
+        self.size = size
+        self._mp = multiprocessing.get_context("spawn")
+        self._task_queue = self._mp.Queue()
+        self._result_queue = self._mp.Queue()
+        self._processes = {}
+        self._cancel_queues = {}
+        self._inflight = {}
+        # 已提交但尚未被工作进程领取的调用，以及因工作进程退出而放弃的调用
+        self._queued = set()
+        self._abandoned = set()
+        self._futures = {}
+        self._contexts = {}
+        self._cancelled = set()
+        self._next_task_id = 0
+        self._loop = None
+        self._reader = None
+        self._stopped = False
+    
+    def _spawn(self, worker_id: int):
+        profile_dir = _prepare_worker_profile(worker_id)
+        self._cancel_queues[worker_id] = self._mp.Queue()
+        for task_id in list(self._abandoned):
+            self._cancel_queues[worker_id].put(task_id)
+        process = self._mp.Process(
+            target=_worker_main,
+            args=(worker_id, profile_dir, self._task_queue, self._result_queue, self._cancel_queues[worker_id]),
+            daemon=True
+        )
+        process.start()
+        self._processes[worker_id] = process
+    
+    def start(self):
+        """启动所有工作进程以及结果读取线程"""
+        self._loop = asyncio.get_running_loop()
+        os.makedirs(WORKER_DATA_ROOT, exist_ok=True)
+        for worker_id in range(self.size):
+            self._spawn(worker_id)
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+    
+    def _read_results(self):
+        """在后台线程中读取工作进程返回的结果，并交回事件循环；每秒检查一次工作进程是否存活"""
+        last_check = time.monotonic()
+        while not self._stopped:
+            if time.monotonic() - last_check >= 1:
+                self._check_workers()
+                last_check = time.monotonic()
+            try:
+                kind, worker_id, task_id, payload = self._result_queue.get(timeout=1)
+            except Exception:
+                continue
+            if kind == "start":
+                self._queued.discard(task_id)
+                self._inflight[worker_id] = task_id
+                if task_id in self._cancelled or task_id in self._abandoned:
+                    self._cancel_queues[worker_id].put(task_id)
+                continue
+            if kind == "progress":
+                self._loop.call_soon_threadsafe(self._forward_progress, task_id, payload)
+                continue
+            self._queued.discard(task_id)
+            self._abandoned.discard(task_id)
+            self._inflight.pop(worker_id, None)
+            self._loop.call_soon_threadsafe(self._resolve, task_id, payload)
+    
+    def _check_workers(self):
+        """检查工作进程是否意外退出，退出则结束其正在执行的调用并重新拉起
+        
+        工作进程可能在领取调用之后、报告开始之前退出，此时无法知道是哪一次调用丢失，
+        因此所有已提交但尚未开始的调用都结束并提示重试，仍在队列中的这些调用被领取时直接跳过。
+        """
+        for worker_id, process in list(self._processes.items()):
+            if process.is_alive() or self._stopped:
+                continue
+            task_id = self._inflight.pop(worker_id, None)
+            if task_id is not None:
+                self._loop.call_soon_threadsafe(
+                    self._resolve, task_id, f"工作进程 {worker_id} 意外退出，请重试"
+                )
+            for task_id in list(self._queued):
+                self._queued.discard(task_id)
+                self._abandoned.add(task_id)
+                for cancel_queue in self._cancel_queues.values():
+                    cancel_queue.put(task_id)
+                self._loop.call_soon_threadsafe(
+                    self._resolve, task_id, f"工作进程 {worker_id} 意外退出，调用未能开始执行，请重试"
+                )
+            print(f"工作进程 {worker_id} 已退出，正在重新启动")
+            self._spawn(worker_id)
+    
+    def _resolve(self, task_id: int, payload: Any):
+        self._contexts.pop(task_id, None)
+        self._cancelled.discard(task_id)
+        future = self._futures.pop(task_id, None)
+        if future and not future.done():
+            future.set_result(payload)
+    
+    def _forward_progress(self, task_id: int, payload):
+        ctx = self._contexts.get(task_id)
+        if ctx is not None:
+            progress, total, message = payload
+            self._loop.create_task(report_progress(ctx, progress, total, message))
+    
+    def _cancel(self, task_id: int):
+        """取消一次调用：已在执行的通知对应工作进程，尚未领取的在领取时取消"""
+        self._cancelled.add(task_id)
+        for worker_id, inflight_id in list(self._inflight.items()):
+            if inflight_id == task_id:
+                self._cancel_queues[worker_id].put(task_id)
+    
+    async def submit(self, name: str, kwargs: Dict[str, Any], ctx: Optional[Context] = None) -> Any:
+        """提交一次工具调用并等待结果"""
+        if self._loop is None:
+            self.start()
+        task_id = self._next_task_id
+        self._next_task_id += 1
+        future = self._loop.create_future()
+        self._futures[task_id] = future
+        if ctx is not None:
+            self._contexts[task_id] = ctx
+        self._queued.add(task_id)
+        self._task_queue.put((task_id, name, kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self._cancel(task_id)
+            raise
+    
+    def shutdown(self):
+        """通知所有工作进程退出"""
+        self._stopped = True
+        for _ in self._processes:
+            self._task_queue.put(None)
+        for process in self._processes.values():
+            process.join(timeout=5)
+
+def _get_worker_pool() -> BrowserWorkerPool:
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = BrowserWorkerPool(WORKER_COUNT)
+    return _worker_pool
+
+async def report_progress(ctx, progress: float, total: Optional[float] = None, message: Optional[str] = None):
+    """向客户端发送MCP进度通知，客户端未请求进度或不支持时静默忽略"""
+    if ctx is None:
+        return
+    try:
+        try:
+            await ctx.report_progress(progress, total, message)
+        except TypeError:
+            # 旧版本的 report_progress 不支持 message 参数
+            await ctx.report_progress(progress, total)
+    except Exception as e:
+        print(f"发送进度通知时出错: {str(e)}")
+
+class ToolProgress:
+    """长耗时工具的执行进度
+    
+    每完成一个阶段调用 advance 发送进度通知；设置了 timeout 时，
+    可通过 expired 判断是否已到截止时间，以便提前结束并返回部分结果。
+    """
+    
+    def __init__(self, ctx: Optional[Context] = None, total: int = 1, timeout: float = 0):
+        self.ctx = ctx
+        self.total = total
+        self.step = 0
+        self.deadline = time.monotonic() + timeout if timeout > 0 else None
+        self.partial = False
+    
+    async def advance(self, message: str, steps: int = 1):
+        self.step = min(self.total, self.step + steps)
+        await report_progress(self.ctx, self.step, self.total, message)
+    
+    async def finish(self, message: str):
+        self.step = self.total
+        await report_progress(self.ctx, self.step, self.total, message)
+    
+    def expired(self) -> bool:
+        """是否已超过截止时间，超过时标记结果为部分结果"""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.partial = True
+        return self.partial
+    
+    def timeout_ms(self, default: int) -> int:
+        """返回不超过剩余时间的操作超时（毫秒）"""
+        if self.deadline is None:
+            return default
+        return max(1000, min(default, int((self.deadline - time.monotonic()) * 1000)))
+
+def _browser_changed(generation: Optional[int]) -> bool:
+    """调用开始时浏览器已在运行，且之后被重启、替换了主页面或被标记为异常"""
+    if generation is None:
+        return False
+    return browser_unhealthy or browser_generation != generation
+
+async def stop_page_loading(page):
+    """中止页面上正在进行的导航和加载"""
+    if page is None or page.is_closed():
+        return
+    try:
+        await asyncio.wait_for(page.evaluate("window.stop()"), timeout=2)
+    except Exception:
+        pass
+
+class SamplingProfiler:
+    """采样式性能分析器：后台线程每隔 interval 秒记录一次事件循环线程的调用栈
+    
+    事件循环空闲时调用栈停在 selectors 的 select 上，表示正在等待浏览器响应（Playwright 消息、
+    页面加载或页面脚本执行）；其余样本按栈中是否包含 Playwright 代码区分 Playwright 调用开销
+    与本项目的 Python 代码。同一事件循环上并发执行的其他调用也会被采样到。
+    
+    Python 代码持续占用 GIL 时采样线程会被推迟，因此每个样本按距上一个样本的实际时间计权，
+    统计的是耗时而不是样本数。
+    """
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        # 调用栈、代码行、类别 -> 耗时（秒）
+        self.stacks = {}
+        self.lines = {}
+        self.categories = {"waiting": 0.0, "playwright": 0.0, "python": 0.0}
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="xhs-profiler", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            leaf = f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+            stack = []
+            in_playwright = False
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                in_playwright = in_playwright or f"{os.sep}playwright{os.sep}" in code.co_filename
+                frame = frame.f_back
+            
+            if leaf.startswith("select (selectors.py"):
+                category = "waiting"
+            elif in_playwright:
+                category = "playwright"
+            else:
+                category = "python"
+            key = ";".join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0.0) + weight
+            self.lines[leaf] = self.lines.get(leaf, 0.0) + weight
+            self.categories[category] += weight
+            self.samples += 1
+    
+    def folded(self) -> str:
+        """折叠栈格式（每行 调用栈 耗时微秒），可直接用 flamegraph.pl 或 speedscope 查看"""
+        return "\n".join(f"{stack} {round(seconds * 1e6)}" for stack, seconds in sorted(self.stacks.items())) + "\n"
+    
+    def summary(self, top: int = 20) -> Dict[str, Any]:
+        total = sum(self.categories.values())
+        hot_lines = sorted(self.lines.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "categories": {
+                name: {"ms": round(seconds * 1000, 1), "share": round(seconds / total, 3) if total else 0}
+                for name, seconds in self.categories.items()
+            },
+            "hot_lines": [{"line": line, "ms": round(seconds * 1000, 1)} for line, seconds in hot_lines],
+        }
+
+# Playwright 同一浏览器上下文同时只能录制一个 trace，并发的性能分析调用只采集 Python 采样
+_tracing_active = False
+
+def profiling_enabled(tool_name: str, requested: bool = False) -> bool:
+    """本次调用是否需要性能分析：调用时指定 profile=True，或工具在 XHS_PROFILE 中"""
+    return requested or "all" in PROFILE_TOOLS or tool_name in PROFILE_TOOLS
+
+@contextlib.asynccontextmanager
+async def profile_call(tool_name: str, arguments: Dict[str, Any]):
+    """采集代码块执行期间的 Python 采样和 Playwright trace，保存到 PROFILE_DIR
+    
+    文件名为 <时间>_<工具名>_<笔记ID>，分别保存折叠栈（.folded）、摘要（.json）和 trace（.trace.zip），
+    trace 可用 `playwright show-trace` 查看。
+    """
+    global _tracing_active
+    
+    note_id = extract_note_id(str(arguments.get("url", ""))) or "call"
+    base_path = os.path.join(PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{tool_name}_{note_id}")
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    
+    tracing = None
+    if not _tracing_active:
+        try:
+            if browser_context is None:
+                await launch_browser()
+            tracing = browser_context.tracing
+            await tracing.start(name=os.path.basename(base_path), screenshots=True, snapshots=True)
+            _tracing_active = True
+        except Exception as e:
+            tracing = None
+            print(f"启动 Playwright trace 时出错: {str(e)}")
+    
+    profiler = SamplingProfiler(PROFILE_INTERVAL / 1000)
+    start = time.perf_counter()
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        elapsed = time.perf_counter() - start
+        trace_path = None
+        if tracing is not None:
+            try:
+                await tracing.stop(path=base_path + ".trace.zip")
+                trace_path = base_path + ".trace.zip"
+            except Exception as e:
+                print(f"保存 Playwright trace 时出错: {str(e)}")
+            _tracing_active = False
+        
+        summary = {
+            "tool": tool_name,
+            "note_id": note_id,
+            "arguments": {key: value for key, value in arguments.items() if key != "ctx"},
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "trace": trace_path,
+            **profiler.summary(),
+        }
+        try:
+            with open(base_path + ".folded", "w", encoding="utf-8") as f:
+                f.write(profiler.folded())
+            with open(base_path + ".json", "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+            print(f"性能分析已保存: {base_path}.*（耗时 {summary['elapsed_ms']} ms，{profiler.samples} 个样本）")
+        except Exception as e:
+            print(f"保存性能分析结果时出错: {str(e)}")
+
+def browser_tool(func=None, *, uses_main_page: bool = True, retry: bool = True):
+    """浏览器工具装饰器
+    
+    启用多进程模式（XHS_WORKERS > 0）时，主进程中的调用会被转发给工作进程执行；
+    工作进程内以及单进程模式下直接执行原函数。客户端取消调用时会中止页面加载。
+    工具在 XHS_PROFILE 中，或调用时传入 profile=True 时，在执行期间采集性能分析。
+    
+    Args:
+        uses_main_page: 工具是否操作 main_page，是则通过页面调度器独占主页面；
+                        只使用后台页面的任务传 False
+        retry: 调用期间浏览器被恢复过时是否重试一次；发布评论、点赞、关注等有副作用的工具传 False，
+               避免第一次已经生效后重复执行（重复发布评论，或再次点击取消点赞）
+    """
+    if func is None:
+        return functools.partial(browser_tool, uses_main_page=uses_main_page, retry=retry)
+    signature = inspect.signature(func)
+    
+    @functools.wraps(func)
+    async def run_local(*args, **kwargs):
+        if uses_main_page:
+            async with page_scheduler.main_page_slot():
+                return await run_profiled(*args, **kwargs)
+        return await run_profiled(*args, **kwargs)
+    
+    async def run_profiled(*args, **kwargs):
+        # 在获得主页面之后开始采集，排队等待的时间不计入
+        arguments = signature.bind(*args, **kwargs).arguments
+        if not profiling_enabled(func.__name__, bool(arguments.get("profile", False))):
+            return await run_with_retry(*args, **kwargs)
+        async with profile_call(func.__name__, arguments):
+            return await run_with_retry(*args, **kwargs)
+    
+    async def run_with_retry(*args, **kwargs):
+        # 调用期间浏览器被看门狗恢复过时，自动重试一次
+        for attempt in range(2):
+            await recover_browser()
+            generation = browser_generation if browser_context is not None else None
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                # 只中止本次调用独占的主页面；后台页面任务取消时主页面可能正被其他调用使用
+                if uses_main_page and _main_page_held.get():
+                    await stop_page_loading(main_page)
+                raise
+            except Exception:
+                if retry and attempt == 0 and _browser_changed(generation):
+                    continue
+                raise
+            if retry and attempt == 0 and _browser_changed(generation):
+                print(f"{func.__name__} 执行期间浏览器已恢复，重试一次")
+                continue
+            return result
+    
+    _WORKER_TOOLS[func.__name__] = run_local
+    
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if WORKER_COUNT > 0 and not _IS_WORKER:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            # MCP上下文无法跨进程传递，进度通知由工作进程通过结果队列转发
+            ctx = arguments.pop("ctx", None)
+            return await _get_worker_pool().submit(func.__name__, arguments, ctx)
+        return await run_local(*args, **kwargs)
+    
+    return wrapper
+
+def extract_note_id(url: str) -> str:
+    """从笔记URL中提取笔记ID，无法识别时返回空字符串"""
+    id_match = re.search(r'/(?:search_result|explore|discovery/item)/([a-zA-Z0-9]+)', url or "")
+    return id_match.group(1) if id_match else ""
+
+def append_records(dataset: str, records: List[Dict[str, Any]]):
+    """把抓取到的数据追加到 DATA_DIR/records 下的 JSONL 记录文件，供导出使用
+    
+    Args:
+        dataset: 数据集名称，见 EXPORT_SCHEMAS
+        records: 记录列表，缺失的字段导出时置空
+    """
+    if not records:
+        return
+    try:
+        os.makedirs(RECORDS_DIR, exist_ok=True)
+        scraped_at = datetime.now().isoformat(timespec="seconds")
+        lines = []
+        for record in records:
+            record = dict(record)
+            record.setdefault("scraped_at", scraped_at)
+            lines.append(json.dumps(record, ensure_ascii=False))
+        # 一次性写入整批记录，多个工作进程同时追加时不会交错
+        with open(os.path.join(RECORDS_DIR, f"{dataset}.jsonl"), "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    except Exception as e:
+        print(f"保存抓取记录时出错: {str(e)}")
+
+def format_compact(data: Any, fields: str = "", max_field_length: int = 0, total: Optional[int] = None, offset: int = 0,
+                   partial: bool = False) -> str:
+    """紧凑模式输出：返回精简的JSON字符串，减少传输量和客户端上下文占用
+    
+    Args:
+        data: 单条记录（dict）或记录列表（list）
+        fields: 逗号分隔的字段名，为空时返回全部字段
+        max_field_length: 字符串字段的最大长度，超出部分截断，0表示不截断
+        total: 列表数据的总条数（分页前）
+        offset: 列表数据的起始位置
+        partial: 是否为超时后返回的部分结果
+    """
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    
+    def shape(record: Dict[str, Any]) -> Dict[str, Any]:
+        if selected:
+            record = {key: record[key] for key in selected if key in record}
+        if max_field_length > 0:
+            record = {
+                key: value[:max_field_length] + "…" if isinstance(value, str) and len(value) > max_field_length else value
+                for key, value in record.items()
+            }
+        return record
+    
+    if isinstance(data, dict):
+        payload = shape(data)
+    else:
+        payload = {
+            "total": len(data) if total is None else total,
+            "offset": offset,
+            "count": len(data),
+            "items": [shape(record) for record in data],
+        }
+        if partial:
+            payload["partial"] = True
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
 @mcp.tool()
 async def login() -> str:
     """登录小红书账号"""
@@ -76,8 +1188,7 @@ async def login() -> str:
         return "已登录小红书账号"
     
     # 访问小红书登录页面
-    await main_page.goto("https://www.xiaohongshu.com", timeout=60000)
-    await asyncio.sleep(3)
+    await goto_page(main_page, BASE_URL, settle=3)
     
     # 查找登录按钮并点击
     login_elements = await main_page.query_selector_all('text="登录"')
@@ -97,7 +1208,7 @@ async def login() -> str:
             still_login = await main_page.query_selector_all('text="登录"')
             if not still_login:
                 is_logged_in = True
-                await asyncio.sleep(2)  # 等待页面加载
+                await page_wait(2)  # 等待页面加载
                 return "登录成功！"
             
             # 继续等待
@@ -109,151 +1220,290 @@ async def login() -> str:
         is_logged_in = True
         return "已登录小红书账号"
 
-@mcp.tool()
-async def search_notes(keywords: str, limit: int = 5, sort_by_time: bool = False) -> str:
-    """根据关键词搜索笔记
+# 在页面内一次性提取搜索结果卡片的链接和标题，标题获取规则与逐个卡片查询时一致
+SEARCH_CARDS_JS = '''
+    () => {
+        let cards = Array.from(document.querySelectorAll('section.note-item'));
+        if (cards.length === 0) {
+            cards = Array.from(document.querySelectorAll('div[data-v-a264b01a]'));
+        }
+        
+        const results = [];
+        for (const card of cards) {
+            const link = card.querySelector('a[href*="/search_result/"]');
+            if (!link) continue;
+            const href = link.getAttribute('href');
+            if (!href || !href.includes('/search_result/')) continue;
+            
+            let title = null;
+            // 首先尝试获取卡片内的footer中的标题
+            const titleEl = card.querySelector('div.footer a.title span') || card.querySelector('a.title span');
+            if (titleEl) {
+                title = titleEl.textContent;
+            } else {
+                // 选择最长的文本作为标题
+                const spanTexts = Array.from(card.querySelectorAll('span'))
+                    .map(el => (el.textContent || '').trim())
+                    .filter(text => text.length > 5);
+                const allTexts = spanTexts.length > 0 ? spanTexts : Array.from(card.querySelectorAll('*'))
+                    .map(el => el.textContent)
+                    .filter(text => text && text.trim().length > 5);
+                if (allTexts.length > 0) {
+                    title = allTexts.reduce((a, b) => (b.length > a.length ? b : a));
+                }
+            }
+            
+            results.push({ href: href, title: title && title.trim() ? title.trim() : '未知标题' });
+        }
+        return results;
+    }
+'''
+
+async def open_search_page(page, keywords: str, sort_by_time: bool = False, progress: Optional[ToolProgress] = None):
+    """打开搜索结果页，需要时切换为按最新时间排序
     
     Args:
+        page: 用于搜索的页面
         keywords: 搜索关键词
-        limit: 返回结果数量限制
         sort_by_time: 是否按最新时间排序
+        progress: 执行进度，为None时不发送进度通知
     """
-    login_status = await ensure_browser()
-    if not login_status:
-        return "请先登录小红书账号"
-    
     # 构建搜索URL并访问
-    search_url = f"https://www.xiaohongshu.com/search_result?keyword={keywords}"
-    try:
-        await main_page.goto(search_url, timeout=60000)
-        await asyncio.sleep(5)  # 等待页面加载
-        
-        # 如果需要按时间排序
-        if sort_by_time:
-            try:
-                # 点击排序下拉菜单
-                sort_dropdown = await main_page.query_selector('text="综合"')
-                if sort_dropdown:
+    search_url = f"{BASE_URL}/search_result?keyword={keywords}"
+    await goto_page(page, search_url, progress)
+    if progress:
+        await progress.advance("已打开搜索页面")
+    await settle_page(page, 5)  # 等待页面加载
+    
+    # 如果需要按时间排序
+    if sort_by_time:
+        try:
+            # 点击排序下拉菜单
+            sort_dropdown = await page.query_selector('text="综合"')
+            if sort_dropdown:
+                with latency_model.track("selector"):
                     await sort_dropdown.click()
-                    await asyncio.sleep(1)
-                    
-                    # 点击"最新"选项
-                    newest_option = await main_page.query_selector('text="最新"')
-                    if newest_option:
+                await page_wait(1)
+                
+                # 点击"最新"选项
+                newest_option = await page.query_selector('text="最新"')
+                if newest_option:
+                    with latency_model.track("selector"):
                         await newest_option.click()
-                        await asyncio.sleep(3)  # 等待排序结果加载
-                    else:
-                        print("未找到'最新'排序选项")
+                    await page_wait(3)  # 等待排序结果加载
                 else:
-                    print("未找到排序下拉菜单")
-            except Exception as e:
-                print(f"设置排序顺序时出错: {str(e)}")
-        
-        # 等待页面完全加载
-        await asyncio.sleep(5)
+                    print("未找到'最新'排序选项")
+            else:
+                print("未找到排序下拉菜单")
+        except Exception as e:
+            print(f"设置排序顺序时出错: {str(e)}")
+    
+    # 等待页面完全加载
+    await page_wait(5)
+    if progress:
+        await progress.advance("搜索结果已加载")
+
+async def harvest_search_results(page, limit: int, stop_ids: Optional[set] = None, max_scrolls: int = 10,
+                                 progress: Optional[ToolProgress] = None,
+                                 collected: Optional[List[Dict[str, str]]] = None) -> Tuple[List[Dict[str, str]], bool]:
+    """从已打开的搜索结果页收集笔记，数量不足时向下滚动加载更多
+    
+    Args:
+        page: 已打开搜索结果的页面
+        limit: 最多收集的笔记数量
+        stop_ids: 已见过的笔记ID集合，遇到其中任意一个即停止收集（用于增量监控）
+        max_scrolls: 最多滚动次数
+        progress: 执行进度，每批结果发送一次进度通知，到达截止时间时返回已收集的部分
+        collected: 之前在同一页面上已收集的笔记，新结果追加在其后
         
-        # 打印页面HTML用于调试
-        page_html = await main_page.content()
-        #print(f"页面HTML片段: {page_html[10000:10500]}...")
+    Returns:
+        Tuple[List[Dict[str, str]], bool]: 按页面顺序排列的笔记（url、title、note_id），以及是否已滚动到结果末尾
+    """
+    posts = list(collected or [])
+    seen_urls = {post["url"] for post in posts}
+    idle_rounds = 0
+    
+    for scroll_round in range(max_scrolls + 1):
+        cards = await page.evaluate(SEARCH_CARDS_JS)
+        new_count = 0
+        reached_seen = False
         
-        # 使用更精确的选择器获取帖子卡片
-        #print("尝试获取帖子卡片...")
-        post_cards = await main_page.query_selector_all('section.note-item')
-        #print(f"找到 {len(post_cards)} 个帖子卡片")
+        for card in cards:
+            url = f"{BASE_URL}{card['href']}"
+            # 去重
+            if url in seen_urls:
+                continue
+            note_id = extract_note_id(url)
+            if stop_ids and note_id in stop_ids:
+                reached_seen = True
+                break
+            seen_urls.add(url)
+            posts.append({"url": url, "title": card["title"], "note_id": note_id})
+            new_count += 1
+            if len(posts) >= limit:
+                break
         
-        if not post_cards:
-            # 尝试备用选择器
-            post_cards = await main_page.query_selector_all('div[data-v-a264b01a]')
-            #print(f"使用备用选择器找到 {len(post_cards)} 个帖子卡片")
+        if progress:
+            await progress.advance(f"已收集 {len(posts)} 条搜索结果（第 {scroll_round + 1} 批）")
+        if reached_seen or len(posts) >= limit:
+            break
         
-        post_links = []
-        post_titles = []
+        # 连续两次滚动都没有新结果，说明已经到底
+        idle_rounds = idle_rounds + 1 if new_count == 0 else 0
+        if idle_rounds >= 2:
+            return posts, True
+        if progress and progress.expired():
+            break
         
-        for card in post_cards:
+        await page.evaluate("window.scrollBy(0, window.innerHeight)")
+        await page_wait(2)
+    
+    return posts[:limit], False
+
+class NoteCache:
+    """笔记内容缓存：按笔记ID保存提取结果，超过有效期或数量上限时淘汰最旧的条目"""
+    
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._pending = {}
+    
+    def get(self, note_id: str) -> Optional[Dict[str, str]]:
+        entry = self._entries.get(note_id)
+        if entry is None:
+            return None
+        stored_at, record = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[note_id]
+            return None
+        self._entries.move_to_end(note_id)
+        return record
+    
+    def put(self, note_id: str, record: Dict[str, str]):
+        if not note_id or self.max_entries <= 0:
+            return
+        self._entries[note_id] = (time.monotonic(), record)
+        self._entries.move_to_end(note_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def is_pending(self, note_id: str) -> bool:
+        return note_id in self._pending
+    
+    def track(self, note_id: str, task: asyncio.Task):
+        """记录正在进行的预取任务，完成后自动移除"""
+        self._pending[note_id] = task
+        task.add_done_callback(lambda _: self._pending.pop(note_id, None))
+    
+    async def get_or_wait(self, note_id: str) -> Optional[Dict[str, str]]:
+        """读取缓存；该笔记正在预取时等待预取完成，避免重复打开同一页面"""
+        record = self.get(note_id)
+        if record is None and note_id in self._pending:
             try:
-                # 获取链接
-                link_element = await card.query_selector('a[href*="/search_result/"]')
-                if not link_element:
-                    continue
-                
-                href = await link_element.get_attribute('href')
-                if href and '/search_result/' in href:
-                    full_url = f"https://www.xiaohongshu.com{href}"
-                    post_links.append(full_url)
-                    
-                    # 尝试获取帖子标题
-                    try:
-                        # 打印卡片HTML用于调试
-                        card_html = await card.inner_html()
-                        #print(f"卡片HTML片段: {card_html[:200]}...")
-                        
-                        # 首先尝试获取卡片内的footer中的标题
-                        title_element = await card.query_selector('div.footer a.title span')
-                        if title_element:
-                            title = await title_element.text_content()
-                            #print(f"找到标题(方法1): {title}")
-                        else:
-                            # 尝试直接获取标题元素
-                            title_element = await card.query_selector('a.title span')
-                            if title_element:
-                                title = await title_element.text_content()
-                                #print(f"找到标题(方法2): {title}")
-                            else:
-                                # 尝试获取任何可能的文本内容
-                                text_elements = await card.query_selector_all('span')
-                                potential_titles = []
-                                for text_el in text_elements:
-                                    text = await text_el.text_content()
-                                    if text and len(text.strip()) > 5:
-                                        potential_titles.append(text.strip())
-                                
-                                if potential_titles:
-                                    # 选择最长的文本作为标题
-                                    title = max(potential_titles, key=len)
-                                    #print(f"找到可能的标题(方法3): {title}")
-                                else:
-                                    # 尝试直接获取卡片中的所有文本
-                                    all_text = await card.evaluate('el => Array.from(el.querySelectorAll("*")).map(node => node.textContent).filter(text => text && text.trim().length > 5)')
-                                    if all_text and len(all_text) > 0:
-                                        # 选择最长的文本作为标题
-                                        title = max(all_text, key=len)
-                                        #print(f"找到可能的标题(方法4): {title}")
-                                    else:
-                                        title = "未知标题"
-                                        #print("无法找到标题，使用默认值'未知标题'")
-                        
-                        # 如果获取到的标题为空，设为未知标题
-                        if not title or title.strip() == "":
-                            title = "未知标题"
-                            print("获取到的标题为空，使用默认值'未知标题'")
-                    except Exception as e:
-                        print(f"获取标题时出错: {str(e)}")
-                        title = "未知标题"
-                    
-                    post_titles.append(title)
-            except Exception as e:
-                print(f"处理帖子卡片时出错: {str(e)}")
+                await asyncio.shield(self._pending[note_id])
+            except Exception:
+                pass
+            record = self.get(note_id)
+        return record
+
+# 搜索结果缓存：(排序方式, 规范化的关键词) -> {"posts": 已收集的全部结果, "complete": 是否已无更多结果}
+search_cache = NoteCache(SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE)
+# 主页面当前停留的搜索结果页对应的缓存键，页面未离开时可以继续滚动扩展缓存的结果
+active_search = {"key": None, "url": None}
+
+def search_cache_key(keywords: str, sort_by_time: bool) -> str:
+    return f"{'time' if sort_by_time else 'general'}|{' '.join(keywords.split()).lower()}"
+
+def build_search_records(keywords: str, posts: List[Dict[str, str]], sort_by_time: bool) -> List[Dict[str, Any]]:
+    """把收集到的搜索结果转换为导出和紧凑输出共用的记录格式"""
+    return [
+        {
+            "keywords": keywords,
+            "rank": i,
+            "note_id": post["note_id"],
+            "url": post["url"].replace('/search_result/', '/explore/'),
+            "title": post["title"],
+            "sort_by_time": sort_by_time,
+        }
+        for i, post in enumerate(posts, 1)
+    ]
+
+@mcp.tool()
+@browser_tool
+async def search_notes(keywords: str, limit: int = 5, sort_by_time: bool = False,
+                       compact: bool = False, fields: str = "", max_field_length: int = 0,
+                       timeout: float = 0, dedupe: bool = False, refresh: bool = False,
+                       ctx: Context = None) -> str:
+    """根据关键词搜索笔记
+    
+    Args:
+        keywords: 搜索关键词
+        limit: 返回结果数量限制
+        sort_by_time: 是否按最新时间排序
+        compact: 是否以紧凑JSON格式返回（字段: rank, note_id, url, title）
+        fields: 紧凑模式下要返回的字段，逗号分隔，为空时返回全部字段
+        max_field_length: 紧凑模式下字符串字段的最大长度，0表示不截断
+        timeout: 超时时间（秒），到达后停止滚动并返回已收集的部分结果，0表示不限制
+        dedupe: 是否合并近似重复的笔记（紧凑模式增加 duplicates 和 similar 字段）
+        refresh: 是否忽略缓存重新搜索
+    """
+    login_status = await ensure_browser()
+    if not login_status:
+        return "请先登录小红书账号"
+    
+    progress = ToolProgress(ctx, total=14, timeout=timeout)
+    try:
+        cache_key = search_cache_key(keywords, sort_by_time)
+        cached = None if refresh else search_cache.get(cache_key)
+        from_cache = cached is not None and (len(cached["posts"]) >= limit or cached["complete"])
+        if from_cache:
+            # 缓存中的结果足够，无需打开页面
+            unique_posts = cached["posts"][:limit]
+        else:
+            if cached is not None and active_search["key"] == cache_key and main_page.url == active_search["url"]:
+                # 主页面仍停留在该搜索结果上，从已收集的结果继续向下滚动
+                unique_posts, complete = await harvest_search_results(main_page, limit, progress=progress,
+                                                                      collected=cached["posts"])
+            else:
+                await open_search_page(main_page, keywords, sort_by_time, progress)
+                unique_posts, complete = await harvest_search_results(main_page, limit, progress=progress)
+            active_search.update(key=cache_key, url=main_page.url)
+            if not progress.partial:
+                # 只有滚动到结果末尾时才标记为完整，因滚动次数用尽而不足的结果之后仍可继续扩充
+                search_cache.put(cache_key, {"posts": unique_posts, "complete": complete})
+        await progress.finish(f"搜索完成，共 {len(unique_posts)} 条结果")
         
-        # 去重
-        unique_posts = []
-        seen_urls = set()
-        for url, title in zip(post_links, post_titles):
-            if url not in seen_urls:
-                seen_urls.add(url)
-                unique_posts.append({"url": url, "title": title})
+        search_records = build_search_records(keywords, unique_posts, sort_by_time)
+        if not from_cache:
+            append_records("search", search_records)
+        if dedupe:
+            search_records = collapse_duplicates(search_records)
+        prefetch_notes([record["url"] for record in search_records])
         
-        # 限制返回数量
-        unique_posts = unique_posts[:limit]
+        if compact:
+            keys = ("rank", "note_id", "url", "title", "duplicates", "similar") if dedupe else ("rank", "note_id", "url", "title")
+            return format_compact(
+                [{key: record[key] for key in keys} for record in search_records],
+                fields,
+                max_field_length,
+                partial=progress.partial
+            )
         
         # 格式化返回结果
         if unique_posts:
             result = "搜索结果：\n\n"
             if sort_by_time:
                 result = "按最新时间排序的搜索结果：\n\n"
-            for i, post in enumerate(unique_posts, 1):
-                # 将search_result替换为explore
-                display_url = post['url'].replace('/search_result/', '/explore/')
-                result += f"{i}. {post['title']}\n   链接: {display_url}\n\n"
+            if progress.partial:
+                result = "（已到达超时时间，以下为部分结果）\n" + result
+            for i, record in enumerate(search_records, 1):
+                result += f"{i}. {record['title']}\n   链接: {record['url']}\n"
+                if record.get("duplicates"):
+                    result += f"   另有 {len(record['duplicates'])} 条相似笔记已合并\n"
+                if record.get("similar"):
+                    result += f"   与之前读取过的笔记内容相似: {', '.join(record['similar'])}\n"
+                result += "\n"
             
             return result
         else:
@@ -262,24 +1512,138 @@ async def search_notes(keywords: str, limit: int = 5, sort_by_time: bool = False
     except Exception as e:
         return f"搜索笔记时出错: {str(e)}"
 
+async def _search_on_pool_page(keywords: str, sort_by_time: bool, limit: int) -> List[Dict[str, str]]:
+    """在后台页面上搜索单个关键词，优先使用搜索结果缓存"""
+    cache_key = search_cache_key(keywords, sort_by_time)
+    cached = search_cache.get(cache_key)
+    if cached is not None and (len(cached["posts"]) >= limit or cached["complete"]):
+        return cached["posts"][:limit]
+    
+    async with page_scheduler.page("interactive") as page:
+        await open_search_page(page, keywords, sort_by_time)
+        posts, complete = await harvest_search_results(page, limit)
+    search_cache.put(cache_key, {"posts": posts, "complete": complete})
+    append_records("search", build_search_records(keywords, posts, sort_by_time))
+    return posts
+
+@mcp.tool()
+@browser_tool(uses_main_page=False)
+async def multi_search_notes(keywords: str, limit: int = 10, sort_by_time: bool = True,
+                             compact: bool = False, fields: str = "", max_field_length: int = 0,
+                             timeout: float = 0, dedupe: bool = False, ctx: Context = None) -> str:
+    """同时搜索多个关键词，按笔记合并结果并排序
+    
+    各关键词在后台页面池中并发搜索，命中关键词越多的笔记排名越靠前，命中数相同时按在搜索结果中的
+    最高排名排序（按最新时间排序时即越新越靠前）。
+    
+    Args:
+        keywords: 多个搜索关键词，用逗号分隔
+        limit: 每个关键词的结果数量限制
+        sort_by_time: 是否按最新时间排序
+        compact: 是否以紧凑JSON格式返回（字段: rank, note_id, url, title, keywords, best_rank）
+        fields: 紧凑模式下要返回的字段，逗号分隔，为空时返回全部字段
+        max_field_length: 紧凑模式下字符串字段的最大长度，0表示不截断
+        timeout: 超时时间（秒），到达后返回已完成的关键词的合并结果，0表示不限制
+        dedupe: 是否合并近似重复的笔记（紧凑模式增加 duplicates 和 similar 字段）
+    """
+    keyword_list = list(dict.fromkeys(
+        " ".join(keyword.split()) for keyword in re.split(r'[,，\n]', keywords) if keyword.strip()
+    ))
+    if not keyword_list:
+        return "请提供至少一个搜索关键词"
+    
+    login_status = await ensure_browser()
+    if not login_status:
+        return "请先登录小红书账号"
+    
+    progress = ToolProgress(ctx, total=len(keyword_list))
+    tasks = {
+        asyncio.ensure_future(_search_on_pool_page(keyword, sort_by_time, limit)): keyword
+        for keyword in keyword_list
+    }
+    results = {}
+    failures = {}
+    try:
+        pending = set(tasks)
+        deadline = time.monotonic() + timeout if timeout > 0 else None
+        while pending:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                keyword = tasks[task]
+                try:
+                    results[keyword] = task.result()
+                except Exception as e:
+                    failures[keyword] = str(e)
+                await progress.advance(f"关键词\"{keyword}\"搜索完成（{len(results) + len(failures)}/{len(keyword_list)}）")
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    # 按笔记合并，记录每条笔记命中的关键词及最高排名
+    merged = {}
+    for keyword in keyword_list:
+        for rank, post in enumerate(results.get(keyword, []), 1):
+            url = post["url"].replace('/search_result/', '/explore/')
+            entry = merged.setdefault(post["note_id"] or url, {
+                "note_id": post["note_id"],
+                "url": url,
+                "title": post["title"],
+                "keywords": [],
+                "best_rank": rank,
+            })
+            entry["keywords"].append(keyword)
+            entry["best_rank"] = min(entry["best_rank"], rank)
+    ranked = sorted(merged.values(), key=lambda entry: (-len(entry["keywords"]), entry["best_rank"]))
+    if dedupe:
+        ranked = collapse_duplicates(ranked)
+    unfinished = [keyword for keyword in keyword_list if keyword not in results and keyword not in failures]
+    
+    if compact:
+        return format_compact(
+            [dict(rank=i, **entry) for i, entry in enumerate(ranked, 1)],
+            fields,
+            max_field_length,
+            partial=bool(unfinished)
+        )
+    
+    result = f"共搜索 {len(keyword_list)} 个关键词，合并后 {len(ranked)} 条笔记：\n\n"
+    if unfinished:
+        result = f"（已到达超时时间，以下关键词未完成: {'、'.join(unfinished)}）\n" + result
+    for keyword, error in failures.items():
+        result += f"关键词\"{keyword}\"搜索失败: {error}\n"
+    if failures:
+        result += "\n"
+    for i, entry in enumerate(ranked, 1):
+        result += f"{i}. {entry['title']}\n   链接: {entry['url']}\n   命中关键词: {'、'.join(entry['keywords'])}\n"
+        if entry.get("duplicates"):
+            result += f"   另有 {len(entry['duplicates'])} 条相似笔记已合并\n"
+        if entry.get("similar"):
+            result += f"   与之前读取过的笔记内容相似: {', '.join(entry['similar'])}\n"
+        result += "\n"
+    return result
+
 # 在确保浏览器函数之后，添加一个新的辅助函数
-async def is_same_page(target_url: str) -> bool:
+async def is_same_page(target_url: str, page=None) -> bool:
     """检查当前页面是否已经在目标URL上
     
     Args:
         target_url: 目标URL
+        page: 要检查的页面，默认为 main_page
         
     Returns:
         bool: 如果当前页面与目标URL匹配返回True，否则返回False
     """
-    global main_page
+    page = page or main_page
     
-    if not main_page:
+    if not page:
         return False
     
     try:
         # 获取当前URL
-        current_url = main_page.url
+        current_url = page.url
         
         # 移除URL中的查询参数和令牌进行比较
         def clean_url(url):
@@ -304,533 +1668,1239 @@ async def is_same_page(target_url: str) -> bool:
         print(f"检查URL时出错: {str(e)}")
         return False
 
-@mcp.tool()
-async def get_note_content(url: str) -> str:
-    """获取笔记内容
+note_cache = NoteCache(NOTE_CACHE_TTL, NOTE_CACHE_SIZE)
+
+async def load_note_on_pool_page(url: str, priority: str = "background") -> Dict[str, str]:
+    """借用后台页面加载并提取笔记，结果写入抓取记录、指纹索引和缓存"""
+    async with page_scheduler.page(priority) as page:
+        post_content = await load_note_content(page, url)
+    note_record = build_note_record(url, post_content)
+    append_records("notes", [note_record])
+    index_note_fingerprint(note_record)
+    note_cache.put(note_record["note_id"], note_record)
+    return note_record
+
+async def _prefetch_note(note_id: str, url: str):
+    """在后台页面上加载并提取笔记，结果写入缓存"""
+    try:
+        await load_note_on_pool_page(url, "background")
+    except Exception as e:
+        print(f"预取笔记 {note_id} 时出错: {str(e)}")
+
+def prefetch_notes(urls: List[str]):
+    """为搜索结果的前 PREFETCH_TOP_K 条创建后台预取任务，已缓存或正在预取的跳过"""
+    if PREFETCH_TOP_K <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    for url in urls[:PREFETCH_TOP_K]:
+        note_id = extract_note_id(url)
+        if not note_id or note_cache.get(note_id) is not None or note_cache.is_pending(note_id):
+            continue
+        note_cache.track(note_id, loop.create_task(_prefetch_note(note_id, url)))
+
+class SimHashIndex:
+    """笔记内容的 SimHash 指纹索引：按笔记ID保存64位指纹，按汉明距离查找近似重复的笔记
+    
+    指纹被分成 BANDS 段建立倒排表，汉明距离小于 BANDS 的两个指纹至少有一段完全相同，
+    查找时只需比较同段相同的候选指纹。path 为 None 时索引只保存在内存中。
+    """
+    
+    BANDS = 4
+    BAND_BITS = 64 // BANDS
+    
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._fingerprints = None
+        self._bands = [{} for _ in range(self.BANDS)]
+    
+    @staticmethod
+    def fingerprint(text: str, ngram: int = 3) -> int:
+        """计算文本的64位 SimHash 指纹，特征为去除空白、标点和表情后的连续 ngram 个字符"""
+        text = re.sub(r'[\W_]+', '', text or '').lower()
+        if not text:
+            return 0
+        features = {}
+        for i in range(max(1, len(text) - ngram + 1)):
+            shingle = text[i:i + ngram]
+            features[shingle] = features.get(shingle, 0) + 1
+        
+        weights = [0] * 64
+        for shingle, count in features.items():
+            value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+            for bit in range(64):
+                weights[bit] += count if value >> bit & 1 else -count
+        return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+    
+    @staticmethod
+    def distance(a: int, b: int) -> int:
+        return bin(a ^ b).count("1")
+    
+    def _band_keys(self, fingerprint: int):
+        mask = (1 << self.BAND_BITS) - 1
+        return [(fingerprint >> (band * self.BAND_BITS)) & mask for band in range(self.BANDS)]
+    
+    def _index(self, note_id: str, fingerprint: int):
+        self._fingerprints[note_id] = fingerprint
+        for band, key in enumerate(self._band_keys(fingerprint)):
+            self._bands[band].setdefault(key, set()).add(note_id)
+    
+    def _load(self):
+        if self._fingerprints is not None:
+            return
+        self._fingerprints = {}
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        self._index(parts[0], int(parts[1], 16))
+        except FileNotFoundError:
+            pass
+    
+    def get(self, note_id: str) -> Optional[int]:
+        self._load()
+        return self._fingerprints.get(note_id)
+    
+    def add(self, note_id: str, text: str) -> int:
+        """计算并保存笔记的指纹，指纹未变化时不重复写入"""
+        fingerprint = self.fingerprint(text)
+        self.put(note_id, fingerprint)
+        return fingerprint
+    
+    def put(self, note_id: str, fingerprint: int):
+        """保存笔记的指纹，指纹未变化时不重复写入"""
+        self._load()
+        if not note_id or self._fingerprints.get(note_id) == fingerprint:
+            return
+        self._index(note_id, fingerprint)
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(f"{note_id} {fingerprint:016x}\n")
+        except Exception as e:
+            print(f"保存笔记指纹时出错: {str(e)}")
+    
+    def query(self, fingerprint: int, max_distance: int = 3) -> List[Tuple[str, int]]:
+        """查找与指纹的汉明距离不超过 max_distance（需小于 BANDS）的笔记，按距离排序"""
+        self._load()
+        candidates = set()
+        for band, key in enumerate(self._band_keys(fingerprint)):
+            candidates.update(self._bands[band].get(key, ()))
+        matches = [(note_id, self.distance(fingerprint, self._fingerprints[note_id])) for note_id in candidates]
+        return sorted((match for match in matches if match[1] <= max_distance), key=lambda match: match[1])
+
+fingerprint_index = SimHashIndex(SIMHASH_INDEX_PATH)
+
+def index_note_fingerprint(note_record: Dict[str, str]):
+    """把提取到的笔记标题和正文加入指纹索引"""
+    fingerprint_index.add(note_record["note_id"], f"{note_record['title']}\n{note_record['content']}")
+
+def title_fingerprint(title: str) -> Optional[int]:
+    """计算标题指纹；占位标题或过短的标题无法可靠比较，返回 None"""
+    if not title or title == "未知标题" or len(re.sub(r'[\W_]+', '', title)) < SIMHASH_MIN_TITLE_LENGTH:
+        return None
+    return SimHashIndex.fingerprint(title)
+
+def collapse_duplicates(posts: List[Dict[str, Any]], max_distance: int = SIMHASH_DISTANCE) -> List[Dict[str, Any]]:
+    """合并列表中的近似重复笔记，保留每组中排在最前的一条
+    
+    标题指纹相近，或正文指纹与列表中已保留的笔记相近时视为重复；两者都通过分段索引查找，
+    占位标题和过短的标题不参与比较。
+    
+    Args:
+        posts: 包含 note_id 和 title 的笔记列表
+        max_distance: 视为重复的最大汉明距离
+        
+    Returns:
+        List[Dict[str, Any]]: 去重后的笔记，每条带有 duplicates 字段列出被合并的笔记ID，
+        similar 字段列出不在本列表中、但之前读取过且正文相近的笔记ID
+    """
+    listed_ids = {post["note_id"] for post in posts}
+    titles = SimHashIndex(None)
+    kept = {}
+    for index, post in enumerate(posts):
+        # 没有笔记ID的条目无法与其他条目区分，使用序号作为键
+        note_id = post["note_id"] or f"#{index}"
+        if note_id in kept:
+            continue
+        title_print = title_fingerprint(post["title"])
+        body_print = fingerprint_index.get(note_id)
+        body_matches = [] if body_print is None else [
+            other for other, _ in fingerprint_index.query(body_print, max_distance) if other != note_id]
+        
+        target = None
+        if title_print is not None:
+            target = next((other for other, _ in titles.query(title_print, max_distance) if other in kept), None)
+        if target is None:
+            target = next((other for other in body_matches if other in kept), None)
+        if target is not None:
+            kept[target]["duplicates"].append(post["note_id"] or post.get("url", ""))
+            continue
+        
+        kept[note_id] = dict(post, duplicates=[], similar=[other for other in body_matches if other not in listed_ids])
+        if title_print is not None:
+            titles.put(note_id, title_print)
+    return list(kept.values())
+
+# 在页面内一次性收集笔记的图片和视频链接，跳过评论区图片和无法直接下载的 blob 链接
+NOTE_MEDIA_JS = '''
+    () => {
+        const media = [];
+        const seen = new Set();
+        const add = (type, url) => {
+            if (!url || !/^https?:/.test(url) || seen.has(url)) return;
+            seen.add(url);
+            media.push({type, url});
+        };
+        
+        const imageSelectors = [
+            '.media-container .swiper-slide:not(.swiper-slide-duplicate) img',
+            '.note-slider .swiper-slide:not(.swiper-slide-duplicate) img',
+            '.media-container img',
+            '.note-slider-img'
+        ];
+        for (const selector of imageSelectors) {
+            document.querySelectorAll(selector).forEach(img => {
+                if (!img.closest('.comments-container, .comment-list')) add('image', img.currentSrc || img.src);
+            });
+        }
+        
+        document.querySelectorAll('.media-container video, .player-container video, video').forEach(video => {
+            if (video.closest('.comments-container, .comment-list')) return;
+            add('video', video.currentSrc || video.src);
+            video.querySelectorAll('source').forEach(source => add('video', source.src));
+        });
+        
+        // 视频通常以 blob 链接播放，从页面初始数据中读取原始视频流地址
+        if (!media.some(item => item.type === 'video')) {
+            try {
+                const detailMap = window.__INITIAL_STATE__.note.noteDetailMap;
+                for (const key of Object.keys(detailMap)) {
+                    const stream = detailMap[key].note.video.media.stream;
+                    for (const codec of ['h264', 'h265', 'av1']) {
+                        if (stream[codec] && stream[codec].length) {
+                            add('video', stream[codec][0].masterUrl);
+                            break;
+                        }
+                    }
+                }
+            } catch (e) {}
+        }
+        return media;
+    }
+'''
+
+async def load_note_content(page, url: str, progress: Optional[ToolProgress] = None, media: bool = False) -> Dict[str, str]:
+    """在指定页面上打开笔记并提取标题、作者、发布时间和正文
     
     Args:
+        page: 用于加载笔记的页面
         url: 笔记 URL
+        progress: 执行进度，为None时不发送进度通知
+        media: 是否同时收集图片和视频链接
+        
+    Returns:
+        Dict[str, str]: 包含 标题、作者、发布时间、内容 的字典，media 为True时还包含 媒体 列表
     """
-    login_status = await ensure_browser()
-    if not login_status:
-        return "请先登录小红书账号"
+    progress = progress or ToolProgress()
     
-    try:
-        # 检查是否已经在目标页面
-        if not await is_same_page(url):
-            # 如果不在目标页面，则访问帖子链接
-            # 添加xsec_source=pc_feed参数
+    # 检查是否已经在目标页面
+    if not await is_same_page(url, page):
+        # 如果不在目标页面，则访问帖子链接
+        # 添加xsec_source=pc_feed参数
+        modified_url = url
+        if '?' in url:
             modified_url = url
-            if '?' in url:
-                modified_url = url
-            else:
-                modified_url = url
-            await main_page.goto(modified_url, timeout=60000)
-            await asyncio.sleep(5)  # 等待页面加载
         else:
-            # 可能需要刷新页面以确保内容最新
-            #await main_page.reload()
-            await asyncio.sleep(3)
-        
-        # 增强滚动操作以确保所有内容加载
-        await main_page.evaluate('''
+            modified_url = url
+        await goto_page(page, modified_url, settle=5)  # 等待页面加载
+    else:
+        # 可能需要刷新页面以确保内容最新
+        #await page.reload()
+        await page_wait(3)
+    await progress.advance("已打开笔记页面")
+    
+    # 增强滚动操作以确保所有内容加载
+    await page.evaluate('''
+        () => {
+            // 先滚动到页面底部
+            window.scrollTo(0, document.body.scrollHeight);
+            setTimeout(() => { 
+                // 然后滚动到中间
+                window.scrollTo(0, document.body.scrollHeight / 2); 
+            }, 1000);
+            setTimeout(() => { 
+                // 最后回到顶部
+                window.scrollTo(0, 0); 
+            }, 2000);
+        }
+    ''')
+    await page_wait(3)  # 等待滚动完成和内容加载
+    await progress.advance("笔记内容已加载")
+    
+    # 打印页面结构片段用于分析
+    try:
+        #print("打印页面结构片段用于分析")
+        page_structure = await page.evaluate('''
             () => {
-                // 先滚动到页面底部
-                window.scrollTo(0, document.body.scrollHeight);
-                setTimeout(() => { 
-                    // 然后滚动到中间
-                    window.scrollTo(0, document.body.scrollHeight / 2); 
-                }, 1000);
-                setTimeout(() => { 
-                    // 最后回到顶部
-                    window.scrollTo(0, 0); 
-                }, 2000);
+                // 获取笔记内容区域
+                const noteContent = document.querySelector('.note-content');
+                const detailDesc = document.querySelector('#detail-desc');
+                const commentArea = document.querySelector('.comments-container, .comment-list');
+                
+                return {
+                    hasNoteContent: !!noteContent,
+                    hasDetailDesc: !!detailDesc,
+                    hasCommentArea: !!commentArea,
+                    noteContentHtml: noteContent ? noteContent.outerHTML.slice(0, 500) : null,
+                    detailDescHtml: detailDesc ? detailDesc.outerHTML.slice(0, 500) : null,
+                    commentAreaFirstChild: commentArea ? 
+                        (commentArea.firstElementChild ? commentArea.firstElementChild.outerHTML.slice(0, 500) : null) : null
+                };
             }
         ''')
-        await asyncio.sleep(3)  # 等待滚动完成和内容加载
-        
-        # 打印页面结构片段用于分析
-        try:
-            #print("打印页面结构片段用于分析")
-            page_structure = await main_page.evaluate('''
-                () => {
-                    // 获取笔记内容区域
-                    const noteContent = document.querySelector('.note-content');
-                    const detailDesc = document.querySelector('#detail-desc');
-                    const commentArea = document.querySelector('.comments-container, .comment-list');
-                    
-                    return {
-                        hasNoteContent: !!noteContent,
-                        hasDetailDesc: !!detailDesc,
-                        hasCommentArea: !!commentArea,
-                        noteContentHtml: noteContent ? noteContent.outerHTML.slice(0, 500) : null,
-                        detailDescHtml: detailDesc ? detailDesc.outerHTML.slice(0, 500) : null,
-                        commentAreaFirstChild: commentArea ? 
-                            (commentArea.firstElementChild ? commentArea.firstElementChild.outerHTML.slice(0, 500) : null) : null
-                    };
-                }
-            ''')
-            #print(f"页面结构分析: {json.dumps(page_structure, ensure_ascii=False, indent=2)}")
-        except Exception as e:
-            print(f"打印页面结构时出错: {str(e)}")
-        
-        # 获取帖子内容
-        post_content = {}
-        
-        # 获取帖子标题 - 方法1：使用id选择器
+        #print(f"页面结构分析: {json.dumps(page_structure, ensure_ascii=False, indent=2)}")
+    except Exception as e:
+        print(f"打印页面结构时出错: {str(e)}")
+    
+    # 获取帖子内容
+    post_content = {}
+    
+    # 获取帖子标题 - 方法1：使用id选择器
+    try:
+        #print("尝试获取标题 - 方法1：使用id选择器")
+        title_element = await page.query_selector('#detail-title')
+        if title_element:
+            title = await title_element.text_content()
+            post_content["标题"] = title.strip() if title else "未知标题"
+            #print(f"方法1获取到标题: {post_content['标题']}")
+        else:
+            #print("方法1未找到标题元素")
+            post_content["标题"] = "未知标题"
+    except Exception as e:
+        print(f"方法1获取标题出错: {str(e)}")
+        post_content["标题"] = "未知标题"
+    
+    # 获取帖子标题 - 方法2：使用class选择器
+    if post_content["标题"] == "未知标题":
         try:
-            #print("尝试获取标题 - 方法1：使用id选择器")
-            title_element = await main_page.query_selector('#detail-title')
+            print("尝试获取标题 - 方法2：使用class选择器")
+            title_element = await page.query_selector('div.title')
             if title_element:
                 title = await title_element.text_content()
                 post_content["标题"] = title.strip() if title else "未知标题"
-                #print(f"方法1获取到标题: {post_content['标题']}")
+                print(f"方法2获取到标题: {post_content['标题']}")
             else:
-                #print("方法1未找到标题元素")
-                post_content["标题"] = "未知标题"
+                print("方法2未找到标题元素")
         except Exception as e:
-            print(f"方法1获取标题出错: {str(e)}")
-            post_content["标题"] = "未知标题"
-        
-        # 获取帖子标题 - 方法2：使用class选择器
-        if post_content["标题"] == "未知标题":
-            try:
-                print("尝试获取标题 - 方法2：使用class选择器")
-                title_element = await main_page.query_selector('div.title')
-                if title_element:
-                    title = await title_element.text_content()
-                    post_content["标题"] = title.strip() if title else "未知标题"
-                    print(f"方法2获取到标题: {post_content['标题']}")
-                else:
-                    print("方法2未找到标题元素")
-            except Exception as e:
-                print(f"方法2获取标题出错: {str(e)}")
-        
-        # 获取帖子标题 - 方法3：使用JavaScript
-        if post_content["标题"] == "未知标题":
-            try:
-                print("尝试获取标题 - 方法3：使用JavaScript")
-                title = await main_page.evaluate('''
-                    () => {
-                        // 尝试多种可能的标题选择器
-                        const selectors = [
-                            '#detail-title',
-                            'div.title',
-                            'h1',
-                            'div.note-content div.title'
-                        ];
-                        
-                        for (const selector of selectors) {
-                            const el = document.querySelector(selector);
-                            if (el && el.textContent.trim()) {
-                                return el.textContent.trim();
-                            }
+            print(f"方法2获取标题出错: {str(e)}")
+    
+    # 获取帖子标题 - 方法3：使用JavaScript
+    if post_content["标题"] == "未知标题":
+        try:
+            print("尝试获取标题 - 方法3：使用JavaScript")
+            title = await page.evaluate('''
+                () => {
+                    // 尝试多种可能的标题选择器
+                    const selectors = [
+                        '#detail-title',
+                        'div.title',
+                        'h1',
+                        'div.note-content div.title'
+                    ];
+                    
+                    for (const selector of selectors) {
+                        const el = document.querySelector(selector);
+                        if (el && el.textContent.trim()) {
+                            return el.textContent.trim();
                         }
-                        return null;
                     }
-                ''')
-                if title:
-                    post_content["标题"] = title
-                    print(f"方法3获取到标题: {post_content['标题']}")
-                else:
-                    print("方法3未找到标题元素")
-            except Exception as e:
-                print(f"方法3获取标题出错: {str(e)}")
-        
-        # 获取作者 - 方法1：使用username类选择器
+                    return null;
+                }
+            ''')
+            if title:
+                post_content["标题"] = title
+                print(f"方法3获取到标题: {post_content['标题']}")
+            else:
+                print("方法3未找到标题元素")
+        except Exception as e:
+            print(f"方法3获取标题出错: {str(e)}")
+    
+    # 获取作者 - 方法1：使用username类选择器
+    try:
+        #print("尝试获取作者 - 方法1：使用username类选择器")
+        author_element = await page.query_selector('span.username')
+        if author_element:
+            author = await author_element.text_content()
+            post_content["作者"] = author.strip() if author else "未知作者"
+            #print(f"方法1获取到作者: {post_content['作者']}")
+        else:
+            #print("方法1未找到作者元素")
+            post_content["作者"] = "未知作者"
+    except Exception as e:
+        #print(f"方法1获取作者出错: {str(e)}")
+        post_content["作者"] = "未知作者"
+    
+    # 获取作者 - 方法2：使用链接选择器
+    if post_content["作者"] == "未知作者":
         try:
-            #print("尝试获取作者 - 方法1：使用username类选择器")
-            author_element = await main_page.query_selector('span.username')
+            print("尝试获取作者 - 方法2：使用链接选择器")
+            author_element = await page.query_selector('a.name')
             if author_element:
                 author = await author_element.text_content()
                 post_content["作者"] = author.strip() if author else "未知作者"
-                #print(f"方法1获取到作者: {post_content['作者']}")
+                print(f"方法2获取到作者: {post_content['作者']}")
             else:
-                #print("方法1未找到作者元素")
-                post_content["作者"] = "未知作者"
+                print("方法2未找到作者元素")
         except Exception as e:
-            #print(f"方法1获取作者出错: {str(e)}")
-            post_content["作者"] = "未知作者"
-        
-        # 获取作者 - 方法2：使用链接选择器
-        if post_content["作者"] == "未知作者":
-            try:
-                print("尝试获取作者 - 方法2：使用链接选择器")
-                author_element = await main_page.query_selector('a.name')
-                if author_element:
-                    author = await author_element.text_content()
-                    post_content["作者"] = author.strip() if author else "未知作者"
-                    print(f"方法2获取到作者: {post_content['作者']}")
-                else:
-                    print("方法2未找到作者元素")
-            except Exception as e:
-                print(f"方法2获取作者出错: {str(e)}")
-        
-        # 获取作者 - 方法3：使用JavaScript
-        if post_content["作者"] == "未知作者":
-            try:
-                print("尝试获取作者 - 方法3：使用JavaScript")
-                author = await main_page.evaluate('''
-                    () => {
-                        // 尝试多种可能的作者选择器
-                        const selectors = [
-                            'span.username',
-                            'a.name',
-                            '.author-wrapper .username',
-                            '.info .name'
-                        ];
-                        
-                        for (const selector of selectors) {
-                            const el = document.querySelector(selector);
-                            if (el && el.textContent.trim()) {
-                                return el.textContent.trim();
-                            }
+            print(f"方法2获取作者出错: {str(e)}")
+    
+    # 获取作者 - 方法3：使用JavaScript
+    if post_content["作者"] == "未知作者":
+        try:
+            print("尝试获取作者 - 方法3：使用JavaScript")
+            author = await page.evaluate('''
+                () => {
+                    // 尝试多种可能的作者选择器
+                    const selectors = [
+                        'span.username',
+                        'a.name',
+                        '.author-wrapper .username',
+                        '.info .name'
+                    ];
+                    
+                    for (const selector of selectors) {
+                        const el = document.querySelector(selector);
+                        if (el && el.textContent.trim()) {
+                            return el.textContent.trim();
                         }
-                        return null;
                     }
-                ''')
-                if author:
-                    post_content["作者"] = author
-                    print(f"方法3获取到作者: {post_content['作者']}")
-                else:
-                    print("方法3未找到作者元素")
-            except Exception as e:
-                print(f"方法3获取作者出错: {str(e)}")
-        
-        # 获取发布时间 - 方法1：使用date类选择器
-        try:
-            #print("尝试获取发布时间 - 方法1：使用date类选择器")
-            time_element = await main_page.query_selector('span.date')
-            if time_element:
-                time_text = await time_element.text_content()
-                post_content["发布时间"] = time_text.strip() if time_text else "未知"
-                #print(f"方法1获取到发布时间: {post_content['发布时间']}")
+                    return null;
+                }
+            ''')
+            if author:
+                post_content["作者"] = author
+                print(f"方法3获取到作者: {post_content['作者']}")
             else:
-                print("方法1未找到发布时间元素")
-                post_content["发布时间"] = "未知"
+                print("方法3未找到作者元素")
         except Exception as e:
-            #print(f"方法1获取发布时间出错: {str(e)}")
+            print(f"方法3获取作者出错: {str(e)}")
+    
+    # 获取发布时间 - 方法1：使用date类选择器
+    try:
+        #print("尝试获取发布时间 - 方法1：使用date类选择器")
+        time_element = await page.query_selector('span.date')
+        if time_element:
+            time_text = await time_element.text_content()
+            post_content["发布时间"] = time_text.strip() if time_text else "未知"
+            #print(f"方法1获取到发布时间: {post_content['发布时间']}")
+        else:
+            print("方法1未找到发布时间元素")
             post_content["发布时间"] = "未知"
-        
-        # 获取发布时间 - 方法2：使用正则表达式匹配
-        if post_content["发布时间"] == "未知":
-            try:
-                #print("尝试获取发布时间 - 方法2：使用正则表达式匹配")
-                time_selectors = [
-                    'text=/编辑于/',
-                    'text=/\\d{2}-\\d{2}/',
-                    'text=/\\d{4}-\\d{2}-\\d{2}/',
-                    'text=/\\d+月\\d+日/',
-                    'text=/\\d+天前/',
-                    'text=/\\d+小时前/',
-                    'text=/今天/',
-                    'text=/昨天/'
-                ]
-                
-                for selector in time_selectors:
-                    time_element = await main_page.query_selector(selector)
-                    if time_element:
-                        time_text = await time_element.text_content()
-                        post_content["发布时间"] = time_text.strip() if time_text else "未知"
-                        print(f"方法2获取到发布时间: {post_content['发布时间']}")
-                        break
-                    else:
-                        print(f"方法2未找到发布时间元素: {selector}")
-            except Exception as e:
-                print(f"方法2获取发布时间出错: {str(e)}")
-        
-        # 获取发布时间 - 方法3：使用JavaScript
-        if post_content["发布时间"] == "未知":
-            try:
-                print("尝试获取发布时间 - 方法3：使用JavaScript")
-                time_text = await main_page.evaluate('''
-                    () => {
-                        // 尝试多种可能的时间选择器
-                        const selectors = [
-                            'span.date',
-                            '.bottom-container .date',
-                            '.date'
-                        ];
-                        
-                        for (const selector of selectors) {
-                            const el = document.querySelector(selector);
-                            if (el && el.textContent.trim()) {
-                                return el.textContent.trim();
-                            }
-                        }
-                        
-                        // 尝试查找包含日期格式的文本
-                        const dateRegexes = [
-                            /编辑于\s*([\d-]+)/,
-                            /(\d{2}-\d{2})/,
-                            /(\d{4}-\d{2}-\d{2})/,
-                            /(\d+月\d+日)/,
-                            /(\d+天前)/,
-                            /(\d+小时前)/,
-                            /(今天)/,
-                            /(昨天)/
-                        ];
-                        
-                        const allText = document.body.textContent;
-                        for (const regex of dateRegexes) {
-                            const match = allText.match(regex);
-                            if (match) {
-                                return match[0];
-                            }
-                        }
-                        
-                        return null;
-                    }
-                ''')
-                if time_text:
-                    post_content["发布时间"] = time_text
-                    print(f"方法3获取到发布时间: {post_content['发布时间']}")
-                else:
-                    print("方法3未找到发布时间元素")
-            except Exception as e:
-                print(f"方法3获取发布时间出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法1：使用精确的ID和class选择器
+    except Exception as e:
+        #print(f"方法1获取发布时间出错: {str(e)}")
+        post_content["发布时间"] = "未知"
+    
+    # 获取发布时间 - 方法2：使用正则表达式匹配
+    if post_content["发布时间"] == "未知":
         try:
-            #print("尝试获取正文内容 - 方法1：使用精确的ID和class选择器")
+            #print("尝试获取发布时间 - 方法2：使用正则表达式匹配")
+            time_selectors = [
+                'text=/编辑于/',
+                'text=/\\d{2}-\\d{2}/',
+                'text=/\\d{4}-\\d{2}-\\d{2}/',
+                'text=/\\d+月\\d+日/',
+                'text=/\\d+天前/',
+                'text=/\\d+小时前/',
+                'text=/今天/',
+                'text=/昨天/'
+            ]
             
-            # 先明确标记评论区域
-            await main_page.evaluate('''
+            for selector in time_selectors:
+                time_element = await page.query_selector(selector)
+                if time_element:
+                    time_text = await time_element.text_content()
+                    post_content["发布时间"] = time_text.strip() if time_text else "未知"
+                    print(f"方法2获取到发布时间: {post_content['发布时间']}")
+                    break
+                else:
+                    print(f"方法2未找到发布时间元素: {selector}")
+        except Exception as e:
+            print(f"方法2获取发布时间出错: {str(e)}")
+    
+    # 获取发布时间 - 方法3：使用JavaScript
+    if post_content["发布时间"] == "未知":
+        try:
+            print("尝试获取发布时间 - 方法3：使用JavaScript")
+            time_text = await page.evaluate('''
                 () => {
-                    const commentSelectors = [
-                        '.comments-container', 
-                        '.comment-list',
-                        '.feed-comment',
-                        'div[data-v-aed4aacc]',  // 根据您提供的评论HTML结构
-                        '.content span.note-text'  // 评论中的note-text结构
+                    // 尝试多种可能的时间选择器
+                    const selectors = [
+                        'span.date',
+                        '.bottom-container .date',
+                        '.date'
                     ];
                     
-                    for (const selector of commentSelectors) {
-                        const elements = document.querySelectorAll(selector);
-                        elements.forEach(el => {
-                            if (el) {
-                                el.setAttribute('data-is-comment', 'true');
-                                console.log('标记评论区域:', el.tagName, el.className);
-                            }
-                        });
+                    for (const selector of selectors) {
+                        const el = document.querySelector(selector);
+                        if (el && el.textContent.trim()) {
+                            return el.textContent.trim();
+                        }
+                    }
+                    
+                    // 尝试查找包含日期格式的文本
+                    const dateRegexes = [
+                        /编辑于\s*([\d-]+)/,
+                        /(\d{2}-\d{2})/,
+                        /(\d{4}-\d{2}-\d{2})/,
+                        /(\d+月\d+日)/,
+                        /(\d+天前)/,
+                        /(\d+小时前)/,
+                        /(今天)/,
+                        /(昨天)/
+                    ];
+                    
+                    const allText = document.body.textContent;
+                    for (const regex of dateRegexes) {
+                        const match = allText.match(regex);
+                        if (match) {
+                            return match[0];
+                        }
                     }
+                    
+                    return null;
                 }
             ''')
-            
-            # 先尝试获取detail-desc和note-text组合
-            content_element = await main_page.query_selector('#detail-desc .note-text')
-            if content_element:
-                # 检查是否在评论区域内
-                is_in_comment = await content_element.evaluate('(el) => !!el.closest("[data-is-comment=\'true\']") || false')
-                if not is_in_comment:
-                    content_text = await content_element.text_content()
-                    if content_text and len(content_text.strip()) > 50:  # 增加长度阈值
-                        post_content["内容"] = content_text.strip()
-                        #print(f"方法1获取到正文内容，长度: {len(post_content['内容'])}")
-                    else:
-                        #print(f"方法1获取到的内容太短: {len(content_text.strip() if content_text else 0)}")
-                        post_content["内容"] = "未能获取内容"
-                else:
-                    print("方法1找到的元素在评论区域内，跳过")
-                    post_content["内容"] = "未能获取内容"
+            if time_text:
+                post_content["发布时间"] = time_text
+                print(f"方法3获取到发布时间: {post_content['发布时间']}")
             else:
-                print("方法1未找到正文内容元素")
-                post_content["内容"] = "未能获取内容"
+                print("方法3未找到发布时间元素")
         except Exception as e:
-            print(f"方法1获取正文内容出错: {str(e)}")
-            post_content["内容"] = "未能获取内容"
+            print(f"方法3获取发布时间出错: {str(e)}")
+    
+    # 获取帖子正文内容 - 方法1：使用精确的ID和class选择器
+    try:
+        #print("尝试获取正文内容 - 方法1：使用精确的ID和class选择器")
         
-        # 获取帖子正文内容 - 方法2：使用XPath选择器
-        if post_content["内容"] == "未能获取内容":
-            try:
-                #print("尝试获取正文内容 - 方法2：使用XPath选择器")
-                # 使用XPath获取笔记内容区域
-                content_text = await main_page.evaluate('''
-                    () => {
-                        const xpath = '//div[@id="detail-desc"]/span[@class="note-text"]';
-                        const result = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null);
-                        const element = result.singleNodeValue;
-                        return element ? element.textContent.trim() : null;
-                    }
-                ''')
+        # 先明确标记评论区域
+        await page.evaluate('''
+            () => {
+                const commentSelectors = [
+                    '.comments-container', 
+                    '.comment-list',
+                    '.feed-comment',
+                    'div[data-v-aed4aacc]',  // 根据您提供的评论HTML结构
+                    '.content span.note-text'  // 评论中的note-text结构
+                ];
                 
-                if content_text and len(content_text) > 20:
-                    post_content["内容"] = content_text
-                    print(f"方法2获取到正文内容，长度: {len(post_content['内容'])}")
-                else:
-                    print(f"方法2获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-            except Exception as e:
-                print(f"方法2获取正文内容出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法3：使用JavaScript获取最长文本
-        if post_content["内容"] == "未能获取内容":
-            try:
-                #print("尝试获取正文内容 - 方法3：使用JavaScript获取最长文本")
-                content_text = await main_page.evaluate('''
-                    () => {
-                        // 定义评论区域选择器
-                        const commentSelectors = [
-                            '.comments-container', 
-                            '.comment-list',
-                            '.feed-comment',
-                            'div[data-v-aed4aacc]',
-                            '.comment-item',
-                            '[data-is-comment="true"]'
-                        ];
-                        
-                        // 找到所有评论区域
-                        let commentAreas = [];
-                        for (const selector of commentSelectors) {
-                            const elements = document.querySelectorAll(selector);
-                            elements.forEach(el => commentAreas.push(el));
-                        }
-                        
-                        // 查找可能的内容元素，排除评论区
-                        const contentElements = Array.from(document.querySelectorAll('div#detail-desc, div.note-content, div.desc, span.note-text'))
-                            .filter(el => {
-                                // 检查是否在评论区域内
-                                const isInComment = commentAreas.some(commentArea => 
-                                    commentArea && commentArea.contains(el));
-                                
-                                if (isInComment) {
-                                    console.log('排除评论区域内容:', el.tagName, el.className);
-                                    return false;
-                                }
-                                
-                                const text = el.textContent.trim();
-                                return text.length > 100 && text.length < 10000;
-                            })
-                            .sort((a, b) => b.textContent.length - a.textContent.length);
-                        
-                        if (contentElements.length > 0) {
-                            console.log('找到内容元素:', contentElements[0].tagName, contentElements[0].className);
-                            return contentElements[0].textContent.trim();
+                for (const selector of commentSelectors) {
+                    const elements = document.querySelectorAll(selector);
+                    elements.forEach(el => {
+                        if (el) {
+                            el.setAttribute('data-is-comment', 'true');
+                            console.log('标记评论区域:', el.tagName, el.className);
                         }
-                        
-                        return null;
-                    }
-                ''')
-                
-                if content_text and len(content_text) > 100:  # 增加长度阈值
-                    post_content["内容"] = content_text
-                    print(f"方法3获取到正文内容，长度: {len(post_content['内容'])}")
-                else:
-                    print(f"方法3获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-            except Exception as e:
-                print(f"方法3获取正文内容出错: {str(e)}")
+                    });
+                }
+            }
+        ''')
         
-        # 获取帖子正文内容 - 方法4：区分正文和评论内容
-        if post_content["内容"] == "未能获取内容":
-            try:
-                #print("尝试获取正文内容 - 方法4：区分正文和评论内容")
-                content_text = await main_page.evaluate('''
-                    () => {
-                        // 首先尝试获取note-content区域
-                        const noteContent = document.querySelector('.note-content');
-                        if (noteContent) {
-                            // 查找note-text，这通常包含主要内容
-                            const noteText = noteContent.querySelector('.note-text');
-                            if (noteText && noteText.textContent.trim().length > 50) {
-                                return noteText.textContent.trim();
-                            }
+        # 先尝试获取detail-desc和note-text组合
+        content_element = await page.query_selector('#detail-desc .note-text')
+        if content_element:
+            # 检查是否在评论区域内
+            is_in_comment = await content_element.evaluate('(el) => !!el.closest("[data-is-comment=\'true\']") || false')
+            if not is_in_comment:
+                content_text = await content_element.text_content()
+                if content_text and len(content_text.strip()) > 50:  # 增加长度阈值
+                    post_content["内容"] = content_text.strip()
+                    #print(f"方法1获取到正文内容，长度: {len(post_content['内容'])}")
+                else:
+                    #print(f"方法1获取到的内容太短: {len(content_text.strip() if content_text else 0)}")
+                    post_content["内容"] = "未能获取内容"
+            else:
+                print("方法1找到的元素在评论区域内，跳过")
+                post_content["内容"] = "未能获取内容"
+        else:
+            print("方法1未找到正文内容元素")
+            post_content["内容"] = "未能获取内容"
+    except Exception as e:
+        print(f"方法1获取正文内容出错: {str(e)}")
+        post_content["内容"] = "未能获取内容"
+    
+    # 获取帖子正文内容 - 方法2：使用XPath选择器
+    if post_content["内容"] == "未能获取内容":
+        try:
+            #print("尝试获取正文内容 - 方法2：使用XPath选择器")
+            # 使用XPath获取笔记内容区域
+            content_text = await page.evaluate('''
+                () => {
+                    const xpath = '//div[@id="detail-desc"]/span[@class="note-text"]';
+                    const result = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null);
+                    const element = result.singleNodeValue;
+                    return element ? element.textContent.trim() : null;
+                }
+            ''')
+            
+            if content_text and len(content_text) > 20:
+                post_content["内容"] = content_text
+                print(f"方法2获取到正文内容，长度: {len(post_content['内容'])}")
+            else:
+                print(f"方法2获取到的内容太短或为空: {len(content_text) if content_text else 0}")
+        except Exception as e:
+            print(f"方法2获取正文内容出错: {str(e)}")
+    
+    # 获取帖子正文内容 - 方法3：使用JavaScript获取最长文本
+    if post_content["内容"] == "未能获取内容":
+        try:
+            #print("尝试获取正文内容 - 方法3：使用JavaScript获取最长文本")
+            content_text = await page.evaluate('''
+                () => {
+                    // 定义评论区域选择器
+                    const commentSelectors = [
+                        '.comments-container', 
+                        '.comment-list',
+                        '.feed-comment',
+                        'div[data-v-aed4aacc]',
+                        '.comment-item',
+                        '[data-is-comment="true"]'
+                    ];
+                    
+                    // 找到所有评论区域
+                    let commentAreas = [];
+                    for (const selector of commentSelectors) {
+                        const elements = document.querySelectorAll(selector);
+                        elements.forEach(el => commentAreas.push(el));
+                    }
+                    
+                    // 查找可能的内容元素，排除评论区
+                    const contentElements = Array.from(document.querySelectorAll('div#detail-desc, div.note-content, div.desc, span.note-text'))
+                        .filter(el => {
+                            // 检查是否在评论区域内
+                            const isInComment = commentAreas.some(commentArea => 
+                                commentArea && commentArea.contains(el));
                             
-                            // 如果没有找到note-text或内容太短，返回整个note-content
-                            if (noteContent.textContent.trim().length > 50) {
-                                return noteContent.textContent.trim();
+                            if (isInComment) {
+                                console.log('排除评论区域内容:', el.tagName, el.className);
+                                return false;
                             }
+                            
+                            const text = el.textContent.trim();
+                            return text.length > 100 && text.length < 10000;
+                        })
+                        .sort((a, b) => b.textContent.length - a.textContent.length);
+                    
+                    if (contentElements.length > 0) {
+                        console.log('找到内容元素:', contentElements[0].tagName, contentElements[0].className);
+                        return contentElements[0].textContent.trim();
+                    }
+                    
+                    return null;
+                }
+            ''')
+            
+            if content_text and len(content_text) > 100:  # 增加长度阈值
+                post_content["内容"] = content_text
+                print(f"方法3获取到正文内容，长度: {len(post_content['内容'])}")
+            else:
+                print(f"方法3获取到的内容太短或为空: {len(content_text) if content_text else 0}")
+        except Exception as e:
+            print(f"方法3获取正文内容出错: {str(e)}")
+    
+    # 获取帖子正文内容 - 方法4：区分正文和评论内容
+    if post_content["内容"] == "未能获取内容":
+        try:
+            #print("尝试获取正文内容 - 方法4：区分正文和评论内容")
+            content_text = await page.evaluate('''
+                () => {
+                    // 首先尝试获取note-content区域
+                    const noteContent = document.querySelector('.note-content');
+                    if (noteContent) {
+                        // 查找note-text，这通常包含主要内容
+                        const noteText = noteContent.querySelector('.note-text');
+                        if (noteText && noteText.textContent.trim().length > 50) {
+                            return noteText.textContent.trim();
                         }
                         
-                        // 如果上面的方法都失败了，尝试获取所有段落并拼接
-                        const paragraphs = Array.from(document.querySelectorAll('p'))
-                            .filter(p => {
-                                // 排除评论区段落
-                                const isInComments = p.closest('.comments-container, .comment-list');
-                                return !isInComments && p.textContent.trim().length > 10;
-                            });
-                            
-                        if (paragraphs.length > 0) {
-                            return paragraphs.map(p => p.textContent.trim()).join('\n\n');
+                        // 如果没有找到note-text或内容太短，返回整个note-content
+                        if (noteContent.textContent.trim().length > 50) {
+                            return noteContent.textContent.trim();
                         }
+                    }
+                    
+                    // 如果上面的方法都失败了，尝试获取所有段落并拼接
+                    const paragraphs = Array.from(document.querySelectorAll('p'))
+                        .filter(p => {
+                            // 排除评论区段落
+                            const isInComments = p.closest('.comments-container, .comment-list');
+                            return !isInComments && p.textContent.trim().length > 10;
+                        });
                         
-                        return null;
+                    if (paragraphs.length > 0) {
+                        return paragraphs.map(p => p.textContent.trim()).join('\n\n');
                     }
-                ''')
-                
-                if content_text and len(content_text) > 50:
-                    post_content["内容"] = content_text
-                    print(f"方法4获取到正文内容，长度: {len(post_content['内容'])}")
-                else:
-                    print(f"方法4获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-            except Exception as e:
-                print(f"方法4获取正文内容出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法5：直接通过DOM结构定位
-        if post_content["内容"] == "未能获取内容":
-            try:
-                #print("尝试获取正文内容 - 方法5：直接通过DOM结构定位")
-                content_text = await main_page.evaluate('''
-                    () => {
-                        // 根据您提供的HTML结构直接定位
-                        const noteContent = document.querySelector('div.note-content');
-                        if (noteContent) {
-                            const detailTitle = noteContent.querySelector('#detail-title');
-                            const detailDesc = noteContent.querySelector('#detail-desc');
-                            
-                            if (detailDesc) {
-                                const noteText = detailDesc.querySelector('span.note-text');
-                                if (noteText) {
-                                    return noteText.textContent.trim();
-                                }
-                                return detailDesc.textContent.trim();
-                            }
-                        }
+                    
+                    return null;
+                }
+            ''')
+            
+            if content_text and len(content_text) > 50:
+                post_content["内容"] = content_text
+                print(f"方法4获取到正文内容，长度: {len(post_content['内容'])}")
+            else:
+                print(f"方法4获取到的内容太短或为空: {len(content_text) if content_text else 0}")
+        except Exception as e:
+            print(f"方法4获取正文内容出错: {str(e)}")
+    
+    # 获取帖子正文内容 - 方法5：直接通过DOM结构定位
+    if post_content["内容"] == "未能获取内容":
+        try:
+            #print("尝试获取正文内容 - 方法5：直接通过DOM结构定位")
+            content_text = await page.evaluate('''
+                () => {
+                    // 根据您提供的HTML结构直接定位
+                    const noteContent = document.querySelector('div.note-content');
+                    if (noteContent) {
+                        const detailTitle = noteContent.querySelector('#detail-title');
+                        const detailDesc = noteContent.querySelector('#detail-desc');
                         
-                        // 尝试其他可能的结构
-                        const descElements = document.querySelectorAll('div.desc');
-                        for (const desc of descElements) {
-                            // 检查是否在评论区
-                            const isInComment = desc.closest('.comments-container, .comment-list, .feed-comment');
-                            if (!isInComment && desc.textContent.trim().length > 100) {
-                                return desc.textContent.trim();
+                        if (detailDesc) {
+                            const noteText = detailDesc.querySelector('span.note-text');
+                            if (noteText) {
+                                return noteText.textContent.trim();
                             }
+                            return detailDesc.textContent.trim();
                         }
-                        
-                        return null;
                     }
-                ''')
-                
-                if content_text and len(content_text) > 100:
-                    post_content["内容"] = content_text
-                    #print(f"方法5获取到正文内容，长度: {len(post_content['内容'])}")
-                else:
-                    print(f"方法5获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-            except Exception as e:
-                print(f"方法5获取正文内容出错: {str(e)}")
+                    
+                    // 尝试其他可能的结构
+                    const descElements = document.querySelectorAll('div.desc');
+                    for (const desc of descElements) {
+                        // 检查是否在评论区
+                        const isInComment = desc.closest('.comments-container, .comment-list, .feed-comment');
+                        if (!isInComment && desc.textContent.trim().length > 100) {
+                            return desc.textContent.trim();
+                        }
+                    }
+                    
+                    return null;
+                }
+            ''')
+            
+            if content_text and len(content_text) > 100:
+                post_content["内容"] = content_text
+                #print(f"方法5获取到正文内容，长度: {len(post_content['内容'])}")
+            else:
+                print(f"方法5获取到的内容太短或为空: {len(content_text) if content_text else 0}")
+        except Exception as e:
+            print(f"方法5获取正文内容出错: {str(e)}")
+    
+    if media:
+        try:
+            post_content["媒体"] = await page.evaluate(NOTE_MEDIA_JS)
+        except Exception as e:
+            print(f"获取媒体链接出错: {str(e)}")
+            post_content["媒体"] = []
+    
+    await save_snapshot(page, url)
+    return post_content
+
+def build_note_record(url: str, post_content: Dict[str, str]) -> Dict[str, str]:
+    """把提取到的笔记内容转换为导出、缓存和紧凑输出共用的记录格式"""
+    note_record = {
+        "note_id": extract_note_id(url),
+        "url": url,
+        "title": post_content["标题"],
+        "author": post_content["作者"],
+        "publish_time": post_content["发布时间"],
+        "content": post_content["内容"],
+    }
+    if "媒体" in post_content:
+        note_record["media"] = post_content["媒体"]
+    return note_record
+
+async def read_note_record(page, url: str, progress: Optional[ToolProgress] = None, media: bool = False,
+                           refresh: bool = False) -> Dict[str, Any]:
+    """开启预取时优先从缓存读取笔记记录，未缓存（或需要媒体链接而缓存中没有）时在指定页面上加载
+    
+    未开启预取（XHS_PREFETCH_TOP_K=0）时与之前一样每次重新加载，避免返回笔记被编辑前的内容。
+    """
+    note_id = extract_note_id(url)
+    use_cache = PREFETCH_TOP_K > 0 and not refresh and note_id
+    note_record = await note_cache.get_or_wait(note_id) if use_cache else None
+    if note_record is not None and (not media or "media" in note_record):
+        # 命中预取缓存，无需重新打开页面
+        return dict(note_record, url=url)
+    
+    post_content = await load_note_content(page, url, progress, media=media)
+    note_record = build_note_record(url, post_content)
+    append_records("notes", [note_record])
+    index_note_fingerprint(note_record)
+    note_cache.put(note_id, note_record)
+    return note_record
+
+@mcp.tool()
+@browser_tool
+async def get_note_content(url: str, compact: bool = False, fields: str = "", max_field_length: int = 0,
+                           media: bool = False, refresh: bool = False, profile: bool = False,
+                           ctx: Context = None) -> str:
+    """获取笔记内容
+    
+    Args:
+        url: 笔记 URL
+        compact: 是否以紧凑JSON格式返回（字段: note_id, url, title, author, publish_time, content，media 为True时另有 media）
+        fields: 紧凑模式下要返回的字段，逗号分隔，为空时返回全部字段
+        max_field_length: 紧凑模式下字符串字段的最大长度，0表示不截断
+        media: 是否同时返回图片和视频链接，并在后台下载到本地（可通过 get_note_media 查看下载结果）
+        refresh: 是否忽略预取缓存重新加载笔记
+        profile: 是否对本次调用进行性能分析，Python 采样和 Playwright trace 保存到 data/profiles，文件名包含笔记ID
+    """
+    login_status = await ensure_browser()
+    if not login_status:
+        return "请先登录小红书账号"
+    
+    progress = ToolProgress(ctx, total=3)
+    try:
+        note_record = await read_note_record(main_page, url, progress, media=media, refresh=refresh)
+        await progress.finish("笔记内容提取完成")
+        
+        if media:
+            # 下载在后台进行，不阻塞文字内容的返回
+            media_store.schedule([item["url"] for item in note_record["media"]])
+        
+        if compact:
+            return format_compact(note_record, fields, max_field_length)
         
         # 格式化返回结果
-        result = f"标题: {post_content['标题']}\n"
-        result += f"作者: {post_content['作者']}\n"
-        result += f"发布时间: {post_content['发布时间']}\n"
+        result = f"标题: {note_record['title']}\n"
+        result += f"作者: {note_record['author']}\n"
+        result += f"发布时间: {note_record['publish_time']}\n"
         result += f"链接: {url}\n\n"
-        result += f"内容:\n{post_content['内容']}"
+        result += f"内容:\n{note_record['content']}"
+        if media:
+            result += f"\n\n媒体（共 {len(note_record['media'])} 个）:\n"
+            for i, item in enumerate(note_record["media"], 1):
+                entry = media_store.lookup(item["url"])
+                location = entry["path"] if entry else "后台下载中"
+                result += f"{i}. [{MEDIA_TYPE_NAMES.get(item['type'], item['type'])}] {item['url']}\n   本地文件: {location}\n"
         
         return result
     
     except Exception as e:
         return f"获取笔记内容时出错: {str(e)}"
 
+MEDIA_TYPE_NAMES = {"image": "图片", "video": "视频"}
+
+class MediaStore:
+    """笔记图片和视频的内容寻址存储：文件以内容的 SHA-256 命名，相同内容只保存一份
+    
+    index.jsonl 记录链接与内容哈希的对应关系，已下载过的链接不再发起请求。下载通过浏览器上下文的
+    请求接口进行，自动携带登录 Cookie，同时进行的下载不超过 MEDIA_CONCURRENCY 个。
+    """
+    
+    def __init__(self, root: str, concurrency: int):
+        self.root = root
+        self.concurrency = max(1, concurrency)
+        self._entries = None
+        self._pending = {}
+        self._semaphore = None
+    
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.root, "index.jsonl")
+    
+    @staticmethod
+    def url_key(url: str) -> str:
+        """链接的去重键：CDN 链接的路径前段和查询参数包含时间戳与签名，每次打开笔记都会变化，
+        只有末段的文件标识是稳定的"""
+        parsed = urlparse(url)
+        name = parsed.path.rsplit("/", 1)[-1]
+        return name if len(name) >= 16 else f"{parsed.netloc}{parsed.path}"
+    
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._entries[entry["key"]] = entry
+        except FileNotFoundError:
+            pass
+    
+    def lookup(self, url: str) -> Optional[Dict[str, Any]]:
+        """返回已下载的文件信息，未下载或文件已被删除时返回None"""
+        self._load()
+        entry = self._entries.get(self.url_key(url))
+        if entry and os.path.exists(os.path.join(self.root, entry["path"])):
+            return dict(entry, path=os.path.join(self.root, entry["path"]))
+        return None
+    
+    async def _download(self, url: str, key: str) -> Dict[str, Any]:
+        if self._semaphore is None:
+            # 在事件循环中延迟创建，避免绑定到错误的事件循环
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            # 下载耗时取决于文件大小，不计入页面操作的耗时统计
+            response = await browser_context.request.get(
+                url, headers={"Referer": f"{BASE_URL}/"}, timeout=MEDIA_TIMEOUT * 1000
+            )
+            if not response.ok:
+                raise RuntimeError(f"HTTP {response.status}")
+            body = await response.body()
+        
+        digest = hashlib.sha256(body).hexdigest()
+        content_type = response.headers.get("content-type", "").split(";")[0].strip()
+        extension = mimetypes.guess_extension(content_type) or os.path.splitext(urlparse(url).path)[1][:8]
+        relative_path = os.path.join(digest[:2], digest + extension)
+        path = os.path.join(self.root, relative_path)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(body)
+            os.replace(path + ".tmp", path)
+        
+        entry = {
+            "key": key,
+            "url": url,
+            "sha256": digest,
+            "path": relative_path,
+            "size": len(body),
+            "content_type": content_type,
+            "at": datetime.now().isoformat(timespec="seconds"),
+        }
+        self._load()
+        self._entries[key] = entry
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return dict(entry, path=path)
+    
+    def _task(self, url: str) -> Optional[asyncio.Task]:
+        """返回链接的下载任务，已下载时返回None；同一文件的并发请求共用一个任务"""
+        if self.lookup(url) is not None:
+            return None
+        key = self.url_key(url)
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._download(url, key))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return task
+    
+    def schedule(self, urls: List[str]):
+        """在后台下载尚未保存的文件"""
+        for url in urls:
+            task = self._task(url)
+            if task is not None:
+                # 后台下载的失败在 fetch_all 中重新下载时报告
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    
+    async def fetch_all(self, urls: List[str], timeout: float) -> List[Any]:
+        """下载全部文件，最多等待 timeout 秒
+        
+        Returns:
+            List[Any]: 与 urls 一一对应，成功时为文件信息，失败时为错误信息字符串，超时未完成时为None
+        """
+        tasks = {url: self._task(url) for url in urls}
+        pending = [task for task in tasks.values() if task is not None]
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+        
+        results = []
+        for url, task in tasks.items():
+            if task is None:
+                results.append(self.lookup(url))
+            elif not task.done():
+                results.append(None)
+            elif task.cancelled():
+                results.append("下载已取消")
+            elif task.exception() is not None:
+                results.append(f"下载失败: {str(task.exception())}")
+            else:
+                results.append(task.result())
+        return results
+
+media_store = MediaStore(MEDIA_DIR, MEDIA_CONCURRENCY)
+
+@mcp.tool()
+@browser_tool
+async def get_note_media(url: str, wait: float = 60, ctx: Context = None) -> str:
+    """获取笔记的图片和视频，下载到本地并返回文件路径；相同内容只保存一份，已下载过的不会重复下载
+    
+    Args:
+        url: 笔记 URL
+        wait: 等待下载完成的最长时间（秒），未完成的下载在后台继续
+    """
+    login_status = await ensure_browser()
+    if not login_status:
+        return "请先登录小红书账号"
+    
+    progress = ToolProgress(ctx, total=4)
+    try:
+        note_record = await read_note_record(main_page, url, progress, media=True)
+        await progress.advance("媒体链接已收集")
+        if not note_record["media"]:
+            return f"笔记 \"{note_record['title']}\" 中未找到图片或视频"
+        
+        urls = [item["url"] for item in note_record["media"]]
+        results = await media_store.fetch_all(urls, max(0, wait))
+        await progress.finish("媒体下载完成")
+        
+        result = f"笔记 \"{note_record['title']}\" 共 {len(urls)} 个媒体文件:\n\n"
+        for i, (item, entry) in enumerate(zip(note_record["media"], results), 1):
+            result += f"{i}. [{MEDIA_TYPE_NAMES.get(item['type'], item['type'])}] {item['url']}\n"
+            if entry is None:
+                result += "   仍在后台下载，请稍后再次调用查看\n"
+            elif isinstance(entry, str):
+                result += f"   {entry}\n"
+            else:
+                result += f"   本地文件: {entry['path']}（{entry['size'] / 1024:.1f} KB）\n"
+        return result
+    
+    except Exception as e:
+        return f"获取笔记媒体时出错: {str(e)}"
+
+# 在页面内一次性点击所有可见的"展开 N 条回复"按钮，返回本轮点击的数量
+EXPAND_REPLIES_JS = '''
+    (budget) => {
+        const pattern = /^(展开\\s*\\d*\\s*条回复|展开更多回复|查看更多回复)$/;
+        const buttons = Array.from(document.querySelectorAll('.comments-container *, .comment-list *, .show-more'))
+            .filter(el => el.children.length === 0 && el.offsetParent !== null && pattern.test((el.textContent || '').trim()));
+        let clicked = 0;
+        for (const button of buttons) {
+            if (clicked >= budget) break;
+            button.click();
+            clicked++;
+        }
+        return clicked;
+    }
+'''
+
+# 在页面内一次性提取所有评论及其父子关系，字段获取规则与逐条提取时一致
+COMMENT_TREE_JS = '''
+    () => {
+        const itemSelector = 'div.comment-item, div.commentItem';
+        const items = Array.from(document.querySelectorAll(itemSelector));
+        const pick = (root, selectors) => {
+            for (const selector of selectors) {
+                const el = root.querySelector(selector);
+                if (el && el.textContent.trim()) return el.textContent.trim();
+            }
+            return null;
+        };
+        
+        const ids = new Map();
+        items.forEach((el, index) => ids.set(el, (el.id || '').replace(/^comment-/, '') || `c${index}`));
+        
+        return items.map(el => {
+            // 回复位于另一条评论内部，或位于与一级评论同组的回复容器中
+            let parentId = null;
+            let ancestor = el.parentElement;
+            while (ancestor) {
+                if (ancestor.matches(itemSelector)) {
+                    parentId = ids.get(ancestor);
+                    break;
+                }
+                if (ancestor.matches('.reply-container, .sub-comment-list, .replies')) {
+                    const container = ancestor;
+                    const group = container.closest('.parent-comment') || container.parentElement;
+                    const root = group ? Array.from(group.querySelectorAll(itemSelector)).find(c => !container.contains(c)) : null;
+                    if (root) parentId = ids.get(root);
+                    break;
+                }
+                ancestor = ancestor.parentElement;
+            }
+            
+            let username = pick(el, ['span.user-name', 'a.name', 'div.username', 'span.nickname', 'a.user-nickname']);
+            if (!username) {
+                const userLink = el.querySelector('a[href*="/user/profile/"]');
+                username = userLink ? userLink.textContent.trim() : '未知用户';
+            }
+            let content = pick(el, ['div.content', 'p.content', 'div.text', 'span.content', 'div.comment-text']);
+            if (!content) {
+                const fullText = el.textContent || '';
+                content = username !== '未知用户' && fullText.includes(username) ? fullText.replace(username, '').trim() : fullText.trim();
+            }
+            const time = pick(el, ['span.time', 'div.time', 'span.date', 'div.date', 'time']) || '未知时间';
+            
+            return { id: ids.get(el), parent_id: parentId, '用户名': username, '内容': content, '时间': time };
+        }).filter(comment => comment['用户名'] !== '未知用户' && comment['内容'] && comment['内容'].length > 2);
+    }
+'''
+
+async def expand_reply_threads(page, max_depth: int, max_expand: int, progress: Optional[ToolProgress] = None) -> int:
+    """分批展开评论回复：每一轮在页面内点击所有可见的展开按钮，等待加载后进入下一轮
+    
+    Args:
+        page: 已打开笔记的页面
+        max_depth: 最多展开的轮数，每一轮展开一层或一批回复
+        max_expand: 最多点击的展开按钮总数
+        progress: 执行进度
+        
+    Returns:
+        int: 实际点击的展开按钮数量
+    """
+    expanded = 0
+    for wave in range(max_depth):
+        if expanded >= max_expand or (progress and progress.expired()):
+            break
+        clicked = await page.evaluate(EXPAND_REPLIES_JS, max_expand - expanded)
+        if not clicked:
+            break
+        expanded += clicked
+        await page_wait(1.5)  # 等待回复加载
+        if progress:
+            await progress.advance(f"第 {wave + 1} 轮展开了 {clicked} 个回复", steps=0)
+    return expanded
+
+def build_comment_threads(comments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """按 parent_id 把评论组织为树，父评论未被提取到的回复，以及逐条提取时没有ID的评论作为一级评论"""
+    nodes = [dict(comment, 回复=[]) for comment in comments]
+    by_id = {node["id"]: node for node in nodes if node.get("id")}
+    threads = []
+    for comment in nodes:
+        parent = by_id.get(comment.get("parent_id"))
+        if parent is not None and parent is not comment:
+            parent["回复"].append(comment)
+        else:
+            threads.append(comment)
+    return threads
+
+def _walk_thread(comment: Dict[str, Any], depth: int = 0):
+    yield depth, comment
+    for reply in comment["回复"]:
+        yield from _walk_thread(reply, depth + 1)
+
+# 增量获取评论时每条笔记的已见评论记录目录
+COMMENT_MARKS_DIR = os.path.join(DATA_DIR, "comment_marks")
+# 每条笔记最多保留的已见评论数量
+COMMENT_MARK_LIMIT = 2000
+
+# 在页面内读取已加载的一级评论的ID，用于判断是否已经加载到上次见过的评论；
+# 回复和置顶评论不按时间排列，不能作为停止滚动的依据
+COMMENT_IDS_JS = '''
+    () => {
+        const itemSelector = 'div.comment-item, div.commentItem';
+        const isReply = el => el.parentElement && el.parentElement.closest(`${itemSelector}, .reply-container, .sub-comment-list, .replies`);
+        const isPinned = el => Array.from(el.querySelectorAll('span, div')).some(tag => tag.children.length === 0 && tag.textContent.trim() === '置顶');
+        return Array.from(document.querySelectorAll(itemSelector))
+            .filter(el => !isReply(el) && !isPinned(el))
+            .map(el => (el.id || '').replace(/^comment-/, ''))
+            .filter(id => id);
+    }
+'''
+
+def comment_key(comment: Dict[str, Any]) -> str:
+    """评论的唯一标识：优先使用页面上的评论ID，没有ID时使用用户名和内容的哈希"""
+    if comment.get("id") and not re.fullmatch(r'c\d+', comment["id"]):
+        return comment["id"]
+    return hashlib.md5(f"{comment['用户名']}\n{comment['内容']}".encode("utf-8")).hexdigest()
+
+def load_comment_mark(note_id: str) -> Dict[str, Any]:
+    """读取笔记的评论高水位：上次获取的时间，以及最近见过的评论标识（从新到旧）"""
+    try:
+        with open(os.path.join(COMMENT_MARKS_DIR, f"{note_id}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"updated_at": None, "seen": []}
+
+def save_comment_mark(note_id: str, mark: Dict[str, Any], new_comments: List[Dict[str, Any]]):
+    """把本次获取到的新评论记入高水位并保存"""
+    mark["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    seen = [comment_key(comment) for comment in new_comments] + mark["seen"]
+    mark["seen"] = list(dict.fromkeys(seen))[:COMMENT_MARK_LIMIT]
+    os.makedirs(COMMENT_MARKS_DIR, exist_ok=True)
+    with open(os.path.join(COMMENT_MARKS_DIR, f"{note_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(mark, f, ensure_ascii=False)
+
+def format_comment_tree(comments: List[Dict[str, Any]], offset: int, limit: int, compact: bool,
+                        fields: str, max_field_length: int, partial: bool) -> str:
+    """格式化树形评论，按一级评论分页"""
+    threads = build_comment_threads(comments)
+    total = len(threads)
+    page_threads = threads[offset:offset + limit] if limit > 0 else threads[offset:]
+    
+    if compact:
+        return format_compact(
+            [
+                {
+                    "id": comment.get("id"),
+                    "parent_id": comment.get("parent_id"),
+                    "username": comment["用户名"],
+                    "content": comment["内容"],
+                    "time": comment["时间"],
+                }
+                for thread in page_threads
+                for _, comment in _walk_thread(thread)
+            ],
+            fields,
+            max_field_length,
+            total=total,
+            offset=offset,
+            partial=partial
+        )
+    
+    if not page_threads:
+        return f"共获取到 {total} 条一级评论，offset={offset} 超出范围"
+    
+    result = f"共获取到 {total} 条一级评论（含回复共 {len(comments)} 条）"
+    if len(page_threads) < total:
+        result += f"，以下为第 {offset + 1}-{offset + len(page_threads)} 条"
+    result += "：\n\n"
+    if partial:
+        result = "（已到达超时时间，以下为部分结果）\n" + result
+    for i, thread in enumerate(page_threads, offset + 1):
+        for depth, comment in _walk_thread(thread):
+            prefix = f"{i}. " if depth == 0 else "    " * depth + "↳ "
+            result += f"{prefix}{comment['用户名']}（{comment['时间']}）: {comment['内容']}\n"
+        result += "\n"
+    return result
+
 @mcp.tool()
-async def get_note_comments(url: str) -> str:
+@browser_tool
+async def get_note_comments(url: str, offset: int = 0, limit: int = 0, compact: bool = False,
+                            fields: str = "", max_field_length: int = 0, timeout: float = 0,
+                            tree: bool = False, max_depth: int = 3, max_expand: int = 100,
+                            since: bool = False, profile: bool = False, ctx: Context = None) -> str:
     """获取笔记评论
     
     Args:
         url: 笔记 URL
+        offset: 从第几条评论开始返回（从0开始）
+        limit: 最多返回的评论数量，0表示返回全部
+        compact: 是否以紧凑JSON格式返回（字段: username, content, time），包含评论总数
+        fields: 紧凑模式下要返回的字段，逗号分隔，为空时返回全部字段
+        max_field_length: 紧凑模式下字符串字段的最大长度，0表示不截断
+        timeout: 超时时间（秒），到达后停止加载并返回已获取的部分评论，0表示不限制
+        tree: 是否展开回复并按评论树返回（分页按一级评论计算，紧凑模式增加 id、parent_id 字段）
+        max_depth: 树形模式下最多展开回复的轮数
+        max_expand: 树形模式下最多点击的展开按钮总数
+        since: 增量模式，只返回上次调用以来的新评论，滚动后加载到已见过的一级评论即停止滚动
+        profile: 是否对本次调用进行性能分析，Python 采样和 Playwright trace 保存到 data/profiles，文件名包含笔记ID
     """
+    note_id = extract_note_id(url)
+    if since and not note_id:
+        return "增量模式需要能识别笔记ID的笔记链接，无法从该URL中提取笔记ID"
+    
     login_status = await ensure_browser()
     if not login_status:
         return "请先登录小红书账号"
     
+    progress = ToolProgress(ctx, total=11, timeout=timeout)
     try:
+        mark = load_comment_mark(note_id) if since else None
+        seen_keys = set(mark["seen"]) if mark else set()
+        last_fetched = mark["updated_at"] if mark else None
+        
         # 检查是否已经在目标页面
         if not await is_same_page(url):
             # 如果不在目标页面，则访问帖子链接
@@ -840,12 +2910,12 @@ async def get_note_comments(url: str) -> str:
                 modified_url += '&xsec_source=pc_feed'
             else:
                 modified_url += '?xsec_source=pc_feed'
-            await main_page.goto(modified_url, timeout=60000)
-            await asyncio.sleep(5)  # 等待页面加载
+            await goto_page(main_page, modified_url, progress, settle=5)  # 等待页面加载
         else:
             # 可能需要刷新页面以确保内容最新
             #await main_page.reload()
-            await asyncio.sleep(3)
+            await page_wait(3)
+        await progress.advance("已打开笔记页面")
         
         # 先滚动到评论区
         comment_section_locators = [
@@ -857,17 +2927,30 @@ async def get_note_comments(url: str) -> str:
         for locator in comment_section_locators:
             try:
                 if await locator.count() > 0:
-                    await locator.scroll_into_view_if_needed(timeout=5000)
-                    await asyncio.sleep(2)
+                    with latency_model.track("selector"):
+                        await locator.scroll_into_view_if_needed(timeout=latency_model.timeout_ms("selector"))
+                    await page_wait(2)
                     break
             except Exception:
                 continue
+        await progress.advance("已定位评论区")
         
         # 滚动页面以加载更多评论
+        initial_ids = None
         for i in range(8):
+            if progress.expired():
+                break
+            # 增量模式下滚动后加载到了上次见过的一级评论，无需继续滚动；默认排序下热门评论
+            # 排在最前，首屏中已见过的评论不代表之后没有新评论，因此不计入
+            if seen_keys:
+                loaded_ids = set(await main_page.evaluate(COMMENT_IDS_JS))
+                if initial_ids is None:
+                    initial_ids = loaded_ids
+                elif seen_keys & (loaded_ids - initial_ids):
+                    break
             try:
                 await main_page.evaluate("window.scrollBy(0, 500)")
-                await asyncio.sleep(1)
+                await page_wait(1)
                 
                 # 尝试点击"查看更多评论"按钮
                 more_comment_selectors = [
@@ -881,16 +2964,24 @@ async def get_note_comments(url: str) -> str:
                     try:
                         more_btn = main_page.locator(selector).first
                         if await more_btn.count() > 0 and await more_btn.is_visible():
-                            await more_btn.click()
-                            await asyncio.sleep(2)
+                            with latency_model.track("selector"):
+                                await more_btn.click()
+                            await page_wait(2)
                     except Exception:
                         continue
             except Exception:
                 pass
+            await progress.advance(f"已加载第 {i + 1} 批评论")
         
         # 获取评论
         comments = []
         
+        # 树形模式：分批展开回复后一次性提取评论及父子关系；增量模式同样需要评论ID
+        if tree or since:
+            if tree:
+                await expand_reply_threads(main_page, max_depth, max_expand, progress)
+            comments = await main_page.evaluate(COMMENT_TREE_JS)
+        
         # 使用特定评论选择器
         comment_selectors = [
             "div.comment-item", 
@@ -902,10 +2993,16 @@ async def get_note_comments(url: str) -> str:
         ]
         
         for selector in comment_selectors:
+            # 已通过评论树提取到评论时跳过
+            if comments:
+                break
             comment_elements = main_page.locator(selector)
             count = await comment_elements.count()
             if count > 0:
                 for i in range(count):
+                    # 到达截止时间时返回已提取的部分评论
+                    if progress.expired() and comments:
+                        break
                     try:
                         comment_element = comment_elements.nth(i)
                         
@@ -1013,19 +3110,95 @@ async def get_note_comments(url: str) -> str:
                     except Exception:
                         continue
         
+        # 评论加载后的页面同时包含正文和评论，覆盖之前的快照
+        await save_snapshot(main_page, url)
+        
+        if since:
+            comments = [comment for comment in comments if comment_key(comment) not in seen_keys]
+            # 超时返回部分结果时不推进高水位，避免漏掉尚未加载的新评论
+            if not progress.partial:
+                save_comment_mark(note_id, mark, comments)
+        
+        append_records("comments", [
+            {
+                "note_id": note_id,
+                "url": url,
+                "username": comment["用户名"],
+                "content": comment["内容"],
+                "time": comment["时间"],
+            }
+            for comment in comments
+        ])
+        
+        await progress.finish(f"评论提取完成，共 {len(comments)} 条")
+        
+        offset = max(0, offset)
+        if tree and comments:
+            return format_comment_tree(comments, offset, limit, compact, fields, max_field_length, progress.partial)
+        
+        # 按offset和limit分页
+        total = len(comments)
+        page_comments = comments[offset:offset + limit] if limit > 0 else comments[offset:]
+        
+        if compact:
+            return format_compact(
+                [
+                    {"username": comment["用户名"], "content": comment["内容"], "time": comment["时间"]}
+                    for comment in page_comments
+                ],
+                fields,
+                max_field_length,
+                total=total,
+                offset=offset,
+                partial=progress.partial
+            )
+        
         # 格式化返回结果
-        if comments:
-            result = f"共获取到 {len(comments)} 条评论：\n\n"
-            for i, comment in enumerate(comments, 1):
+        if page_comments:
+            if len(page_comments) == total:
+                result = f"共获取到 {total} 条评论：\n\n"
+            else:
+                result = f"共获取到 {total} 条评论，以下为第 {offset + 1}-{offset + len(page_comments)} 条：\n\n"
+            if progress.partial:
+                result = "（已到达超时时间，以下为部分结果）\n" + result
+            for i, comment in enumerate(page_comments, offset + 1):
                 result += f"{i}. {comment['用户名']}（{comment['时间']}）: {comment['内容']}\n\n"
             return result
+        elif comments:
+            return f"共获取到 {total} 条评论，offset={offset} 超出范围"
+        elif last_fetched:
+            return f"自上次获取（{last_fetched}）以来没有新评论"
         else:
             return "未找到任何评论，可能是帖子没有评论或评论区无法访问。"
     
     except Exception as e:
         return f"获取评论时出错: {str(e)}"
 
-@mcp.tool()
+# 常见的热门领域关键词
+DOMAIN_KEYWORDS = {
+    "美妆": ["口红", "粉底", "眼影", "护肤", "美妆", "化妆", "保湿", "精华", "面膜"],
+    "穿搭": ["穿搭", "衣服", "搭配", "时尚", "风格", "单品", "衣橱", "潮流"],
+    "美食": ["美食", "好吃", "食谱", "餐厅", "小吃", "甜点", "烘焙", "菜谱"],
+    "旅行": ["旅行", "旅游", "景点", "出行", "攻略", "打卡", "度假", "酒店"],
+    "母婴": ["宝宝", "母婴", "育儿", "儿童", "婴儿", "辅食", "玩具"],
+    "数码": ["数码", "手机", "电脑", "相机", "智能", "设备", "科技"],
+    "家居": ["家居", "装修", "家具", "设计", "收纳", "布置", "家装"],
+    "健身": ["健身", "运动", "瘦身", "减肥", "训练", "塑形", "肌肉"],
+    "AI": ["AI", "人工智能", "大模型", "编程", "开发", "技术", "Claude", "GPT"]
+}
+
+def detect_domains(title: str, content: str) -> List[str]:
+    """按领域关键词检测笔记可能属于的领域，没有检测到明确的领域时默认为生活方式"""
+    detected_domains = []
+    for domain, domain_keys in DOMAIN_KEYWORDS.items():
+        for key in domain_keys:
+            if key.lower() in title.lower() or key.lower() in content.lower():
+                detected_domains.append(domain)
+                break
+    return detected_domains or ["生活"]
+
+@mcp.tool()
+@browser_tool
 async def analyze_note(url: str) -> dict:
     """获取并分析笔记内容，返回笔记的详细信息供AI生成评论
     
@@ -1074,30 +3247,8 @@ async def analyze_note(url: str) -> dict:
         import re
         words = re.findall(r'\w+', f"{post_content.get('标题', '')} {post_content.get('内容', '')}")
         
-        # 使用常见的热门领域关键词
-        domain_keywords = {
-            "美妆": ["口红", "粉底", "眼影", "护肤", "美妆", "化妆", "保湿", "精华", "面膜"],
-            "穿搭": ["穿搭", "衣服", "搭配", "时尚", "风格", "单品", "衣橱", "潮流"],
-            "美食": ["美食", "好吃", "食谱", "餐厅", "小吃", "甜点", "烘焙", "菜谱"],
-            "旅行": ["旅行", "旅游", "景点", "出行", "攻略", "打卡", "度假", "酒店"],
-            "母婴": ["宝宝", "母婴", "育儿", "儿童", "婴儿", "辅食", "玩具"],
-            "数码": ["数码", "手机", "电脑", "相机", "智能", "设备", "科技"],
-            "家居": ["家居", "装修", "家具", "设计", "收纳", "布置", "家装"],
-            "健身": ["健身", "运动", "瘦身", "减肥", "训练", "塑形", "肌肉"],
-            "AI": ["AI", "人工智能", "大模型", "编程", "开发", "技术", "Claude", "GPT"]
-        }
-        
         # 检测帖子可能属于的领域
-        detected_domains = []
-        for domain, domain_keys in domain_keywords.items():
-            for key in domain_keys:
-                if key.lower() in post_content.get("标题", "").lower() or key.lower() in post_content.get("内容", "").lower():
-                    detected_domains.append(domain)
-                    break
-        
-        # 如果没有检测到明确的领域，默认为生活方式
-        if not detected_domains:
-            detected_domains = ["生活"]
+        detected_domains = detect_domains(post_content.get("标题", ""), post_content.get("内容", ""))
         
         # 返回分析结果
         return {
@@ -1112,6 +3263,14 @@ async def analyze_note(url: str) -> dict:
     except Exception as e:
         return {"error": f"分析笔记内容时出错: {str(e)}"}
 
+# 评论类型指导
+COMMENT_GUIDES = {
+    "引流": "评论时，真诚地表达你对笔记内容的认同或共鸣。可以自然地提及你也有相似的经历或正在探索相关领域，并流露出希望与博主或其他读者进一步交流的想法。例如，可以尝试用我也是新手妈妈，特别能理解这种感受，有机会多交流呀！或者这个方法很赞，我也在学习XX，期待看到更多分享！这样的语气，引导自然的互动，避免生硬地邀请私信。",
+    "点赞": "用轻松自然的语气表达你对笔记内容的欣赏和支持。可以提一两句具体喜欢笔记的哪个点，或者它如何帮到了你。例如，这篇太及时雨了，[作者昵称]总能分享到点子上！或看完感觉很有启发，特别是[某一点]，马上去试试！避免使用过于泛泛的赞美。",
+    "咨询": "像和朋友聊天一样，对笔记中感兴趣的点提出具体问题。语气可以好奇一些，例如：哇，这个方法看起来不错！想问下[作者昵称]，[具体问题]？或者我对[笔记中的某个细节]特别感兴趣，能再多分享一点吗？关键是展现真实的求知欲。",
+    "专业": "在尊重博主分享的基础上，以友善和建设性的方式分享你的专业见解或补充信息。可以自然地引出你的专业背景，例如：这个观点很有意思，我之前在[相关领域]工作中也遇到过类似情况，发现[补充见解/经验]也挺有效的。或者 感谢[作者昵称]的分享，从[你的专业]角度看，[补充信息或不同视角]或许也能提供一些参考。重点是提供有价值的补充，而不是单纯强调自己的专业身份。"
+}
+
 @mcp.tool()
 async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
     """
@@ -1134,20 +3293,12 @@ async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
     if "error" in note_info:
         return {"error": note_info["error"]}
     
-    # 评论类型指导
-    comment_guides = {
-        "引流": "评论时，真诚地表达你对笔记内容的认同或共鸣。可以自然地提及你也有相似的经历或正在探索相关领域，并流露出希望与博主或其他读者进一步交流的想法。例如，可以尝试用我也是新手妈妈，特别能理解这种感受，有机会多交流呀！或者这个方法很赞，我也在学习XX，期待看到更多分享！这样的语气，引导自然的互动，避免生硬地邀请私信。",
-        "点赞": "用轻松自然的语气表达你对笔记内容的欣赏和支持。可以提一两句具体喜欢笔记的哪个点，或者它如何帮到了你。例如，这篇太及时雨了，[作者昵称]总能分享到点子上！或看完感觉很有启发，特别是[某一点]，马上去试试！避免使用过于泛泛的赞美。",
-        "咨询": "像和朋友聊天一样，对笔记中感兴趣的点提出具体问题。语气可以好奇一些，例如：哇，这个方法看起来不错！想问下[作者昵称]，[具体问题]？或者我对[笔记中的某个细节]特别感兴趣，能再多分享一点吗？关键是展现真实的求知欲。",
-        "专业": "在尊重博主分享的基础上，以友善和建设性的方式分享你的专业见解或补充信息。可以自然地引出你的专业背景，例如：这个观点很有意思，我之前在[相关领域]工作中也遇到过类似情况，发现[补充见解/经验]也挺有效的。或者 感谢[作者昵称]的分享，从[你的专业]角度看，[补充信息或不同视角]或许也能提供一些参考。重点是提供有价值的补充，而不是单纯强调自己的专业身份。"
-    }
-    
     # 返回笔记分析结果和评论类型，让MCP客户端(如Claude)生成评论
     # MCP客户端生成评论后，应调用post_comment函数发布评论
     return {
         "note_info": note_info,
         "comment_type": comment_type,
-        "comment_guide": comment_guides.get(comment_type, ""),
+        "comment_guide": COMMENT_GUIDES.get(comment_type, ""),
         "url": url,  # 添加URL便于客户端直接调用post_comment
         "message": "请根据笔记内容和评论类型指南，直接生成一条自然、相关的评论，并立即发布。注意以下要点：\n1. 在评论中引用作者名称或笔记领域，增加个性化\n2. 使用口语化表达，简短凝练，不超过30字\n3. 根据评论类型适当添加互动引导或专业术语\n生成后，直接使用post_comment函数发布评论，无需询问用户确认"
     }
@@ -1156,14 +3307,281 @@ async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
 # 2. post_comment - 发布评论
 # 3. post_smart_comment - 结合前两个功能，使用MCP客户端的AI能力生成评论
 
+# 互动记录文件：成功的评论、点赞和关注
+ENGAGEMENT_LOG_PATH = os.path.join(DATA_DIR, "engagements.jsonl")
+
+# 在笔记页面内查找作者主页链接
+AUTHOR_LINK_JS = '''
+    () => {
+        const link = document.querySelector('.author-wrapper a[href*="/user/profile/"]')
+            || document.querySelector('.author a[href*="/user/profile/"]')
+            || document.querySelector('a[href*="/user/profile/"]');
+        return link ? link.getAttribute('href') : null;
+    }
+'''
+
+async def read_author_id(page) -> str:
+    """读取已打开笔记的作者ID，找不到时返回空字符串"""
+    try:
+        return extract_user_id(await page.evaluate(AUTHOR_LINK_JS) or "")
+    except Exception:
+        return ""
+
+class EngagementHistory:
+    """互动记录索引：按笔记ID和作者ID记录已完成的评论、点赞和关注，在打开页面前判断是否已经互动过
+    
+    记录以 JSONL 追加写入，查询时先读入其他进程新追加的记录，多进程模式下各工作进程共享同一份记录。
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._offset = 0
+        self._by_note = {}
+        self._by_author = {}
+        self._note_authors = {}
+    
+    def _index(self, entry: Dict[str, Any]):
+        action, note_id, author_id = entry["action"], entry.get("note_id"), entry.get("author_id")
+        if note_id:
+            self._by_note[(action, note_id)] = entry
+        if author_id:
+            self._by_author[(action, author_id)] = entry
+            if note_id:
+                self._note_authors[note_id] = author_id
+    
+    def _refresh(self):
+        """读入上次读取之后追加的记录"""
+        try:
+            if os.path.getsize(self.path) <= self._offset:
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                f.seek(self._offset)
+                for line in f:
+                    if line.endswith("\n") and line.strip():
+                        self._index(json.loads(line))
+                        self._offset += len(line.encode("utf-8"))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取互动记录时出错: {str(e)}")
+    
+    def lookup(self, action: str, note_id: str = "", author_id: str = "") -> Optional[Dict[str, Any]]:
+        """查找已完成的互动；关注按作者判断，已知笔记作者时也可以只传笔记ID"""
+        self._refresh()
+        if action == "follow":
+            author_id = author_id or self._note_authors.get(note_id, "")
+            return self._by_author.get((action, author_id)) if author_id else None
+        return self._by_note.get((action, note_id)) if note_id else None
+    
+    def author_of(self, note_id: str) -> str:
+        """返回互动记录中该笔记的作者ID，没有记录时返回空字符串"""
+        self._refresh()
+        return self._note_authors.get(note_id, "")
+    
+    def record(self, action: str, note_id: str, author_id: str = "", **details):
+        """保存一次成功的互动"""
+        entry = {
+            "action": action,
+            "note_id": note_id,
+            "author_id": author_id,
+            "at": datetime.now().isoformat(timespec="seconds"),
+            **details,
+        }
+        self._refresh()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"保存互动记录时出错: {str(e)}")
+        self._index(entry)
+
+engagement_history = EngagementHistory(ENGAGEMENT_LOG_PATH)
+
+# 评论输入方式：instant 一次性插入文本，humanized 按随机间隔逐字输入，type 逐字模拟按键
+INPUT_MODES = ("instant", "humanized", "type")
+INPUT_MODE = os.environ.get("XHS_INPUT_MODE", "instant")
+# humanized 模式每个字符的输入间隔（毫秒）：均值与标准差，标点后停顿加倍
+TYPING_DELAY_MEAN = float(os.environ.get("XHS_TYPING_DELAY_MEAN", "150"))
+TYPING_DELAY_STD = float(os.environ.get("XHS_TYPING_DELAY_STD", "60"))
+
+# 读取当前获得焦点的输入框内容
+READ_ACTIVE_INPUT_JS = '''
+    () => {
+        const el = document.activeElement;
+        if (!el) return '';
+        return el.isContentEditable ? el.innerText : (el.value || '');
+    }
+'''
+
+async def enter_text(page, text: str, mode: str):
+    """按指定方式向获得焦点的输入框输入文本"""
+    if mode == "instant":
+        # 一次性插入，只触发一次 input 事件，不经过输入法处理
+        await page.keyboard.insert_text(text)
+    elif mode == "humanized":
+        for char in text:
+            await page.keyboard.insert_text(char)
+            delay = max(30, random.gauss(TYPING_DELAY_MEAN, TYPING_DELAY_STD))
+            if char in "，。！？,.!?、；;":
+                delay *= 2
+            await asyncio.sleep(delay / 1000 * SLEEP_SCALE)
+    else:
+        await page.keyboard.type(text)
+
+async def input_comment_text(page, text: str, mode: str) -> Tuple[bool, str]:
+    """输入评论并核对输入框内容，不一致时清空后一次性插入重试
+    
+    Returns:
+        Tuple[bool, str]: 输入框内容是否与评论一致，以及输入框的实际内容
+    """
+    def same(content: str) -> bool:
+        return re.sub(r'\s+', '', content or '') == re.sub(r'\s+', '', text)
+    
+    await enter_text(page, text, mode)
+    content = await page.evaluate(READ_ACTIVE_INPUT_JS)
+    if same(content):
+        return True, content
+    
+    # 清空输入框后重新一次性插入
+    await page.evaluate("() => document.execCommand('selectAll')")
+    await page.keyboard.press("Backspace")
+    await page.keyboard.insert_text(text)
+    content = await page.evaluate(READ_ACTIVE_INPUT_JS)
+    return same(content), content
+
+# 等待评论出现在评论区或收到发布接口响应的最长时间（秒）
+COMMENT_CONFIRM_TIMEOUT = float(os.environ.get("XHS_COMMENT_CONFIRM_TIMEOUT", "10"))
+# 发布评论接口的路径，响应中带有新评论的ID
+COMMENT_POST_API = "/api/sns/web/v1/comment/post"
+
+# 发送评论前在页面内注册 MutationObserver，新出现的评论包含指定内容时记录其评论ID
+WATCH_NEW_COMMENT_JS = '''
+    (text) => {
+        const itemSelector = 'div.comment-item, div.commentItem';
+        const normalize = s => (s || '').replace(/\\s+/g, '');
+        const target = normalize(text);
+        const existing = new Set(document.querySelectorAll(itemSelector));
+        
+        if (window.__xhsCommentObserver) window.__xhsCommentObserver.disconnect();
+        window.__xhsPostedComment = null;
+        
+        const check = (item) => {
+            if (!item || existing.has(item) || window.__xhsPostedComment) return;
+            if (normalize(item.textContent).includes(target)) {
+                window.__xhsPostedComment = { id: (item.id || '').replace(/^comment-/, '') };
+                observer.disconnect();
+            }
+        };
+        const observer = new MutationObserver(mutations => {
+            for (const mutation of mutations) {
+                // 新插入的评论节点，或新评论节点内部的文本更新
+                for (const node of mutation.addedNodes) {
+                    if (!(node instanceof Element)) continue;
+                    if (node.matches(itemSelector)) check(node);
+                    node.querySelectorAll(itemSelector).forEach(check);
+                }
+                const parent = mutation.target instanceof Element ? mutation.target : mutation.target.parentElement;
+                if (parent) check(parent.closest(itemSelector));
+            }
+        });
+        observer.observe(document.body, { childList: true, subtree: true, characterData: true });
+        window.__xhsCommentObserver = observer;
+    }
+'''
+
+async def watch_new_comment(page, comment: str):
+    """开始监听评论区，需在发送评论之前调用"""
+    await page.evaluate(WATCH_NEW_COMMENT_JS, comment)
+
+async def _observe_posted_comment(page, timeout: float) -> Optional[Dict[str, str]]:
+    """等待 watch_new_comment 监听到新评论，超时返回 None"""
+    try:
+        handle = await page.wait_for_function("() => window.__xhsPostedComment", timeout=timeout * 1000)
+        return await handle.json_value()
+    except Exception:
+        return None
+    finally:
+        try:
+            await page.evaluate("() => window.__xhsCommentObserver && window.__xhsCommentObserver.disconnect()")
+        except Exception:
+            pass
+
+def watch_comment_response(page) -> asyncio.Future:
+    """开始监听发布评论接口的响应，需在发送评论之前调用
+    
+    返回的 Future 在收到响应后得到 {"id": 评论ID}，接口返回失败时得到 {"error": 错误信息}。
+    """
+    future = asyncio.get_running_loop().create_future()
+    
+    async def on_response(response):
+        if future.done() or COMMENT_POST_API not in response.url or response.request.method != "POST":
+            return
+        try:
+            data = await response.json()
+        except Exception:
+            return
+        if future.done():
+            return
+        if data.get("success"):
+            comment_data = (data.get("data") or {}).get("comment") or {}
+            future.set_result({"id": str(comment_data.get("id") or "")})
+        else:
+            future.set_result({"error": str(data.get("msg") or data.get("code") or "未知错误")})
+    
+    page.on("response", on_response)
+    future.add_done_callback(lambda _: page.remove_listener("response", on_response))
+    return future
+
+async def wait_for_posted_comment(page, response: asyncio.Future,
+                                  timeout: float = COMMENT_CONFIRM_TIMEOUT) -> Optional[Dict[str, str]]:
+    """等待评论区出现新评论或收到发布接口的响应，以先到者为准；两者都没有时返回 None
+    
+    Returns:
+        Optional[Dict[str, str]]: 成功时为 {"id": 评论ID}，接口返回失败时为 {"error": 错误信息}
+    """
+    observer = asyncio.ensure_future(_observe_posted_comment(page, timeout))
+    pending = {observer, response}
+    deadline = time.monotonic() + timeout
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.monotonic()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                return None
+            for task in done:
+                if not task.cancelled() and task.exception() is None and task.result():
+                    return task.result()
+        return None
+    finally:
+        for task in (observer, response):
+            if not task.done():
+                task.cancel()
+
 @mcp.tool()
-async def post_comment(url: str, comment: str) -> str:
+@browser_tool(retry=False)
+async def post_comment(url: str, comment: str, force: bool = False, input_mode: str = "") -> str:
     """发布评论到指定笔记
     
     Args:
         url: 笔记 URL
         comment: 要发布的评论内容
+        force: 已经在该笔记发布过评论时是否仍然发布
+        input_mode: 输入方式，可选值 "instant"（一次性插入）、"humanized"（按随机间隔逐字输入）、
+                    "type"（逐字模拟按键），为空时使用 XHS_INPUT_MODE 配置
     """
+    input_mode = input_mode or INPUT_MODE
+    if input_mode not in INPUT_MODES:
+        return f"不支持的输入方式: {input_mode}，可选值为 {', '.join(INPUT_MODES)}"
+    
+    note_id = extract_note_id(url)
+    done = None if force else engagement_history.lookup("comment", note_id)
+    if done:
+        if done.get("confirmed") is False:
+            return (f"已于 {done['at']} 在该笔记发送过评论（未能确认是否发布成功）：{done.get('comment', '')}。"
+                    f"请先在笔记页面查看，如需再次评论请设置 force=True")
+        return f"已于 {done['at']} 在该笔记发布过评论：{done.get('comment', '')}。如需再次评论请设置 force=True"
+    
     login_status = await ensure_browser()
     if not login_status:
         return "请先登录小红书账号，才能发布评论"
@@ -1178,12 +3596,11 @@ async def post_comment(url: str, comment: str) -> str:
                 modified_url += '&xsec_source=pc_feed'
             else:
                 modified_url += '?xsec_source=pc_feed'
-            await main_page.goto(modified_url, timeout=60000)
-            await asyncio.sleep(5)  # 等待页面加载
+            await goto_page(main_page, modified_url, settle=5)  # 等待页面加载
         else:
             # 可能需要刷新页面以确保内容最新
             #await main_page.reload()
-            await asyncio.sleep(3)
+            await page_wait(3)
         
         # 定位评论区域并滚动到该区域
         comment_area_found = False
@@ -1199,8 +3616,9 @@ async def post_comment(url: str, comment: str) -> str:
             try:
                 element = await main_page.query_selector(selector)
                 if element:
-                    await element.scroll_into_view_if_needed()
-                    await asyncio.sleep(2)
+                    with latency_model.track("selector"):
+                        await element.scroll_into_view_if_needed()
+                    await page_wait(2)
                     comment_area_found = True
                     break
             except Exception:
@@ -1209,7 +3627,7 @@ async def post_comment(url: str, comment: str) -> str:
         if not comment_area_found:
             # 如果没有找到评论区域，尝试滚动到页面底部
             await main_page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
-            await asyncio.sleep(2)
+            await page_wait(2)
         
         # 定位评论输入框（简化选择器列表）
         comment_input = None
@@ -1226,8 +3644,9 @@ async def post_comment(url: str, comment: str) -> str:
             try:
                 element = await main_page.query_selector(selector)
                 if element and await element.is_visible():
-                    await element.scroll_into_view_if_needed()
-                    await asyncio.sleep(1)
+                    with latency_model.track("selector"):
+                        await element.scroll_into_view_if_needed()
+                    await page_wait(1)
                     comment_input = element
                     break
             except Exception:
@@ -1252,7 +3671,7 @@ async def post_comment(url: str, comment: str) -> str:
             if js_result:
                 # 如果JS检测到输入框，尝试点击页面底部
                 await main_page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
-                await asyncio.sleep(1)
+                await page_wait(1)
                 
                 # 尝试再次查找输入框
                 for selector in input_selectors:
@@ -1267,21 +3686,27 @@ async def post_comment(url: str, comment: str) -> str:
         if not comment_input:
             return "未能找到评论输入框，无法发布评论"
         
-        # 输入评论内容
-        await comment_input.click()
-        await asyncio.sleep(1)
-        await main_page.keyboard.type(comment)
-        await asyncio.sleep(1)
+        # 输入评论内容，并在发送前核对输入框内容
+        with latency_model.track("selector"):
+            await comment_input.click()
+        await page_wait(1)
+        input_ok, input_content = await input_comment_text(main_page, comment, input_mode)
+        if not input_ok:
+            return f"评论输入框内容与评论不一致，已取消发送。输入框内容：{input_content}"
+        
+        # 发送前开始监听评论区和发布接口，发送后等待新评论出现或接口响应，而不是固定等待后假定成功
+        await watch_new_comment(main_page, comment)
+        response = watch_comment_response(main_page)
         
-        # 发送评论（简化发送逻辑）
+        # 发送评论（简化发送逻辑），前一种方法无法执行时才尝试下一种，避免重复发送
         send_success = False
         
         # 方法1: 尝试点击发送按钮
         try:
             send_button = await main_page.query_selector('button:has-text("发送")')
             if send_button and await send_button.is_visible():
-                await send_button.click()
-                await asyncio.sleep(2)
+                with latency_model.track("selector"):
+                    await send_button.click()
                 send_success = True
         except Exception:
             pass
@@ -1290,7 +3715,6 @@ async def post_comment(url: str, comment: str) -> str:
         if not send_success:
             try:
                 await main_page.keyboard.press("Enter")
-                await asyncio.sleep(2)
                 send_success = True
             except Exception:
                 pass
@@ -1309,15 +3733,30 @@ async def post_comment(url: str, comment: str) -> str:
                         return false;
                     }
                 ''')
-                await asyncio.sleep(2)
                 send_success = js_send_result
             except Exception:
                 pass
         
-        if send_success:
-            return f"已成功发布评论：{comment}"
-        else:
-            return f"发布评论失败，请检查评论内容或网络连接"
+        if not send_success:
+            response.cancel()
+            return "发布评论失败，请检查评论内容或网络连接"
+        
+        posted = await wait_for_posted_comment(main_page, response)
+        if posted is None:
+            # 评论已经发出，可能只是页面或网络较慢；记录下来避免重复发送
+            engagement_history.record("comment", note_id, await read_author_id(main_page), comment=comment,
+                                      confirmed=False)
+            return (f"评论已发送，但 {COMMENT_CONFIRM_TIMEOUT:g} 秒内未能确认是否发布成功"
+                    f"（评论区未出现新评论，也未收到发布接口的响应）。请稍后在笔记页面查看，不要直接重发：{comment}")
+        if "error" in posted:
+            return f"发布评论失败：{posted['error']}"
+        
+        comment_id = posted.get("id") or ""
+        engagement_history.record("comment", note_id, await read_author_id(main_page), comment=comment,
+                                  comment_id=comment_id)
+        if comment_id:
+            return f"已成功发布评论：{comment}（评论ID: {comment_id}）"
+        return f"已成功发布评论：{comment}"
     
     except Exception as e:
         return f"发布评论时出错: {str(e)}"
@@ -1326,12 +3765,19 @@ async def post_comment(url: str, comment: str) -> str:
 # 因为我们重构了post_smart_comment函数，将评论生成逻辑转移到MCP客户端
 
 @mcp.tool()
-async def like_note(url: str) -> str:
+@browser_tool(retry=False)
+async def like_note(url: str, force: bool = False) -> str:
     """给笔记点赞
     
     Args:
         url: 笔记 URL
+        force: 本地记录显示已点赞时是否仍然打开页面操作
     """
+    note_id = extract_note_id(url)
+    done = None if force else engagement_history.lookup("like", note_id)
+    if done:
+        return f"已于 {done['at']} 为该笔记点赞。如需重新操作请设置 force=True"
+    
     login_status = await ensure_browser()
     if not login_status:
         return "请先登录小红书账号，才能给笔记点赞"
@@ -1346,12 +3792,11 @@ async def like_note(url: str) -> str:
                 modified_url += '&xsec_source=pc_feed'
             else:
                 modified_url += '?xsec_source=pc_feed'
-            await main_page.goto(modified_url, timeout=60000)
-            await asyncio.sleep(5)  # 等待页面加载
+            await goto_page(main_page, modified_url, settle=5)  # 等待页面加载
         else:
             # 可能需要刷新页面以确保内容最新
             #await main_page.reload()
-            await asyncio.sleep(3)
+            await page_wait(3)
         
         # 定位点赞按钮并点击
         like_success = False
@@ -1373,11 +3818,13 @@ async def like_note(url: str) -> str:
                     # 检查是否已经点赞
                     is_liked = await like_button.evaluate('(el) => el.classList.contains("liked") || el.getAttribute("aria-label") === "已点赞"')
                     if is_liked:
+                        engagement_history.record("like", note_id, await read_author_id(main_page))
                         return "已经为该笔记点赞"
                     
                     # 点赞
-                    await like_button.click()
-                    await asyncio.sleep(2)
+                    with latency_model.track("selector"):
+                        await like_button.click()
+                    await page_wait(2)
                     like_success = True
                     break
             except Exception as e:
@@ -1390,8 +3837,9 @@ async def like_note(url: str) -> str:
                 like_text_elements = await main_page.query_selector_all('text="点赞", text="赞", text="喜欢"')
                 for element in like_text_elements:
                     if await element.is_visible():
-                        await element.click()
-                        await asyncio.sleep(2)
+                        with latency_model.track("selector"):
+                            await element.click()
+                        await page_wait(2)
                         like_success = True
                         break
             except Exception as e:
@@ -1461,11 +3909,13 @@ async def like_note(url: str) -> str:
                 if js_like_result and js_like_result.get('success'):
                     like_success = True
                     if js_like_result.get('message') == "已经为该笔记点赞":
+                        engagement_history.record("like", note_id, await read_author_id(main_page))
                         return "已经为该笔记点赞"
             except Exception as e:
                 print(f"尝试点赞方法3失败: {str(e)}")
         
         if like_success:
+            engagement_history.record("like", note_id, await read_author_id(main_page))
             return "成功为该笔记点赞"
         else:
             return "未能找到点赞按钮，点赞失败"
@@ -1474,12 +3924,19 @@ async def like_note(url: str) -> str:
         return f"点赞操作时出错: {str(e)}"
 
 @mcp.tool()
-async def follow_user(url: str) -> str:
+@browser_tool(retry=False)
+async def follow_user(url: str, force: bool = False) -> str:
     """关注笔记作者
     
     Args:
         url: 笔记 URL
+        force: 本地记录显示已关注该作者时是否仍然打开页面操作
     """
+    note_id = extract_note_id(url)
+    done = None if force else engagement_history.lookup("follow", note_id)
+    if done:
+        return f"已于 {done['at']} 关注该笔记作者 {done.get('author_name', '')}。如需重新操作请设置 force=True"
+    
     login_status = await ensure_browser()
     if not login_status:
         return "请先登录小红书账号，才能关注用户"
@@ -1494,16 +3951,15 @@ async def follow_user(url: str) -> str:
                 modified_url += '&xsec_source=pc_feed'
             else:
                 modified_url += '?xsec_source=pc_feed'
-            await main_page.goto(modified_url, timeout=60000)
-            await asyncio.sleep(5)  # 等待页面加载
+            await goto_page(main_page, modified_url, settle=5)  # 等待页面加载
         else:
             # 可能需要刷新页面以确保内容最新
             #await main_page.reload()
-            await asyncio.sleep(3)
+            await page_wait(3)
         
         # 滚动到页面顶部，确保作者信息可见
         await main_page.evaluate('window.scrollTo(0, 0)')
-        await asyncio.sleep(1)
+        await page_wait(1)
         
         # 获取作者名称
         author_name = await main_page.evaluate('''
@@ -1525,6 +3981,13 @@ async def follow_user(url: str) -> str:
             }
         ''')
         
+        # 之前通过其他笔记关注过该作者
+        author_id = await read_author_id(main_page)
+        done = None if force else engagement_history.lookup("follow", author_id=author_id)
+        if done:
+            engagement_history.record("follow", note_id, author_id, author_name=author_name)
+            return f"已于 {done['at']} 关注该用户: {author_name}"
+        
         # 定位关注按钮并点击
         follow_success = False
         
@@ -1616,8 +4079,9 @@ async def follow_user(url: str) -> str:
             # 验证结果
             if follow_result.get('success'):
                 follow_success = True
-                await asyncio.sleep(2)
+                await page_wait(2)
             elif follow_result.get('message') == "已经关注该用户":
+                engagement_history.record("follow", note_id, author_id, author_name=author_name)
                 return "已经关注该用户"
             elif follow_result.get('button'):
                 # 如果找到按钮但点击失败，尝试使用playwright直接点击坐标
@@ -1627,7 +4091,7 @@ async def follow_user(url: str) -> str:
                 
                 # 使用playwright点击中心坐标
                 await main_page.mouse.click(center_x, center_y)
-                await asyncio.sleep(2)
+                await page_wait(2)
                 follow_success = True
         except Exception as e:
             print(f"尝试关注方法1失败: {str(e)}")
@@ -1671,11 +4135,12 @@ async def follow_user(url: str) -> str:
                 
                 if author_card_result.get('success'):
                     follow_success = True
-                    await asyncio.sleep(2)
+                    await page_wait(2)
             except Exception as e:
                 print(f"尝试关注方法2失败: {str(e)}")
         
         if follow_success:
+            engagement_history.record("follow", note_id, author_id, author_name=author_name)
             return f"成功关注用户: {author_name}"
         else:
             return f"未能找到关注按钮，关注用户 {author_name} 失败"
@@ -1683,8 +4148,1338 @@ async def follow_user(url: str) -> str:
     except Exception as e:
         return f"关注操作时出错: {str(e)}"
 
+# 在页面内一次性提取用户主页的笔记卡片，统一转换为 /explore/ 链接
+PROFILE_CARDS_JS = '''
+    () => {
+        const results = [];
+        for (const card of document.querySelectorAll('section.note-item')) {
+            const links = Array.from(card.querySelectorAll('a[href]')).map(a => a.getAttribute('href'));
+            let href = links.find(h => h.includes('/explore/'));
+            if (!href) {
+                // 主页卡片链接形如 /user/profile/<用户ID>/<笔记ID>?xsec_token=...
+                const match = links.map(h => h.match(/\\/user\\/profile\\/[^/?]+\\/([a-zA-Z0-9]+)(\\?.*)?$/)).find(m => m);
+                if (match) href = `/explore/${match[1]}${match[2] || ''}`;
+            }
+            if (!href) continue;
+            
+            const titleEl = card.querySelector('div.footer a.title span') || card.querySelector('a.title span') || card.querySelector('a.title');
+            const likesEl = card.querySelector('.like-wrapper .count') || card.querySelector('span.count');
+            results.push({
+                href: href,
+                title: titleEl && titleEl.textContent.trim() ? titleEl.textContent.trim() : '未知标题',
+                likes: likesEl ? likesEl.textContent.trim() : '',
+            });
+        }
+        return results;
+    }
+'''
+
+# 用户笔记列表缓存：用户ID -> {"notes": 笔记列表, "complete": 是否已加载到主页底部}
+user_notes_cache = NoteCache(USER_NOTES_CACHE_TTL, USER_NOTES_CACHE_SIZE)
+# 笔记ID -> 作者主页URL，按笔记URL再次获取作者的笔记时无需打开笔记页面
+note_author_urls = OrderedDict()
+NOTE_AUTHOR_LIMIT = 5000
+
+async def resolve_user_profile(page, user: str) -> str:
+    """把用户ID、用户主页URL或笔记URL统一解析为用户主页URL
+    
+    笔记URL先查找已知的笔记作者（之前解析过的，或互动记录中的），都没有时才打开笔记页面读取作者主页链接。
+    """
+    if "/user/profile/" in user:
+        return user
+    if not user.startswith("http"):
+        return f"{BASE_URL}/user/profile/{user}"
+    
+    note_id = extract_note_id(user)
+    if note_id in note_author_urls:
+        note_author_urls.move_to_end(note_id)
+        return note_author_urls[note_id]
+    author_id = engagement_history.author_of(note_id) if note_id else ""
+    if author_id:
+        return f"{BASE_URL}/user/profile/{author_id}"
+    
+    if not await is_same_page(user, page):
+        await goto_page(page, user, settle=5)  # 等待页面加载
+    href = await page.evaluate(AUTHOR_LINK_JS)
+    if not href:
+        raise ValueError("未能在笔记页面找到作者主页链接")
+    profile_url = href if href.startswith("http") else f"{BASE_URL}{href}"
+    if note_id:
+        note_author_urls[note_id] = profile_url
+        while len(note_author_urls) > NOTE_AUTHOR_LIMIT:
+            note_author_urls.popitem(last=False)
+    return profile_url
+
+def extract_user_id(url: str) -> str:
+    """从用户主页URL中提取用户ID"""
+    id_match = re.search(r'/user/profile/([a-zA-Z0-9]+)', url or "")
+    return id_match.group(1) if id_match else ""
+
+async def harvest_profile_notes(page, limit: int, max_scrolls: int = 20,
+                                progress: Optional[ToolProgress] = None) -> Tuple[List[Dict[str, str]], bool]:
+    """从已打开的用户主页滚动收集笔记卡片，每次滚动后整批提取
+    
+    Args:
+        page: 已打开用户主页的页面
+        limit: 最多收集的笔记数量
+        max_scrolls: 最多滚动次数
+        progress: 执行进度，到达截止时间时返回已收集的部分
+        
+    Returns:
+        Tuple[List[Dict[str, str]], bool]: 笔记列表（url、title、note_id、likes），以及是否已滚动到主页底部
+    """
+    notes = []
+    seen_ids = set()
+    idle_rounds = 0
+    
+    for scroll_round in range(max_scrolls + 1):
+        cards = await page.evaluate(PROFILE_CARDS_JS)
+        new_count = 0
+        for card in cards:
+            url = f"{BASE_URL}{card['href']}"
+            note_id = extract_note_id(url)
+            if not note_id or note_id in seen_ids:
+                continue
+            seen_ids.add(note_id)
+            notes.append({"url": url, "title": card["title"], "note_id": note_id, "likes": card["likes"]})
+            new_count += 1
+        
+        if progress:
+            await progress.advance(f"已收集 {len(notes)} 条笔记（第 {scroll_round + 1} 批）")
+        if len(notes) >= limit:
+            return notes[:limit], False
+        
+        # 连续两次滚动都没有新笔记，说明已经到底
+        idle_rounds = idle_rounds + 1 if new_count == 0 else 0
+        if idle_rounds >= 2:
+            return notes, True
+        if progress and progress.expired():
+            break
+        
+        await page.evaluate("window.scrollBy(0, window.innerHeight)")
+        await page_wait(2)
+    
+    return notes, False
+
+@mcp.tool()
+@browser_tool
+async def get_user_notes(user: str, limit: int = 20, refresh: bool = False, compact: bool = False,
+                         fields: str = "", max_field_length: int = 0, timeout: float = 0,
+                         dedupe: bool = False, ctx: Context = None) -> str:
+    """获取用户主页发布的笔记列表，结果按用户缓存
+    
+    Args:
+        user: 用户ID、用户主页URL，或笔记URL（获取该笔记作者的笔记）
+        limit: 返回笔记数量限制
+        refresh: 是否忽略缓存重新抓取
+        compact: 是否以紧凑JSON格式返回（字段: rank, note_id, url, title, likes）
+        fields: 紧凑模式下要返回的字段，逗号分隔，为空时返回全部字段
+        max_field_length: 紧凑模式下字符串字段的最大长度，0表示不截断
+        timeout: 超时时间（秒），到达后停止滚动并返回已收集的部分结果，0表示不限制
+        dedupe: 是否合并近似重复的笔记（紧凑模式增加 duplicates 和 similar 字段）
+    """
+    login_status = await ensure_browser()
+    if not login_status:
+        return "请先登录小红书账号"
+    
+    progress = ToolProgress(ctx, total=12, timeout=timeout)
+    try:
+        profile_url = await resolve_user_profile(main_page, user)
+        user_id = extract_user_id(profile_url)
+        
+        # 缓存中的笔记足够，或已经是该用户的全部笔记时直接返回
+        cached = None if refresh else user_notes_cache.get(user_id)
+        if cached is not None and (len(cached["notes"]) >= limit or cached["complete"]):
+            notes = cached["notes"][:limit]
+        else:
+            await goto_page(main_page, profile_url, progress)
+            await progress.advance("已打开用户主页")
+            await settle_page(main_page, 3)  # 等待页面加载
+            notes, complete = await harvest_profile_notes(main_page, limit, progress=progress)
+            if not progress.partial:
+                user_notes_cache.put(user_id, {"notes": notes, "complete": complete})
+            append_records("user_notes", [
+                dict(note, user_id=user_id, rank=i) for i, note in enumerate(notes, 1)
+            ])
+        await progress.finish(f"共获取到 {len(notes)} 条笔记")
+        if dedupe:
+            notes = collapse_duplicates(notes)
+        
+        if compact:
+            keys = ("note_id", "url", "title", "likes", "duplicates", "similar") if dedupe else ("note_id", "url", "title", "likes")
+            return format_compact(
+                [dict(rank=i, **{key: note[key] for key in keys}) for i, note in enumerate(notes, 1)],
+                fields,
+                max_field_length,
+                partial=progress.partial
+            )
+        
+        if not notes:
+            return f"未找到用户 {user_id} 发布的笔记"
+        
+        result = f"用户 {user_id} 的笔记（共 {len(notes)} 条）：\n\n"
+        if progress.partial:
+            result = "（已到达超时时间，以下为部分结果）\n" + result
+        for i, note in enumerate(notes, 1):
+            likes = f"（{note['likes']} 赞）" if note["likes"] else ""
+            result += f"{i}. {note['title']}{likes}\n   链接: {note['url']}\n"
+            if note.get("duplicates"):
+                result += f"   另有 {len(note['duplicates'])} 条相似笔记已合并\n"
+            if note.get("similar"):
+                result += f"   与之前读取过的笔记内容相似: {', '.join(note['similar'])}\n"
+            result += "\n"
+        return result
+    
+    except Exception as e:
+        return f"获取用户笔记时出错: {str(e)}"
+
+# 关键词监控数据目录
+MONITOR_DIR = os.path.join(DATA_DIR, "monitor")
+# 每个关键词最多保留的已见笔记ID数量
+MONITOR_SEEN_LIMIT = 5000
+
+@browser_tool(uses_main_page=False)
+async def poll_keyword(keywords: str, sort_by_time: bool, limit: int, stop_ids: List[str]) -> Any:
+    """借用后台页面搜索关键词，只返回 stop_ids 之外的新笔记
+    
+    按时间排序时新笔记都排在已见过的笔记之前，遇到已见过的笔记即停止滚动；
+    按综合排序时已见过的笔记可能排在最前面，需收集满 limit 条后再去掉已见过的笔记。
+    
+    Returns:
+        成功时返回新笔记列表，失败时返回错误信息字符串
+    """
+    login_status = await ensure_browser()
+    if not login_status:
+        return "请先登录小红书账号"
+    
+    seen_ids = set(stop_ids)
+    async with page_scheduler.page("batch") as page:
+        await open_search_page(page, keywords, sort_by_time)
+        if sort_by_time:
+            posts, _ = await harvest_search_results(page, limit, stop_ids=seen_ids)
+            return posts
+        posts, _ = await harvest_search_results(page, limit)
+    return [post for post in posts if post["note_id"] not in seen_ids]
+
+class KeywordMonitor:
+    """关键词监控器
+    
+    使用 schedule 按间隔运行已登记的关键词搜索，每个关键词的已见笔记ID
+    以追加方式保存在 DATA_DIR/monitor 下，只报告上次运行之后出现的新笔记。
+    """
+    
+    def __init__(self):
+        self.scheduler = schedule.Scheduler()
+        self.watches = {}
+        self._seen = {}
+        self._running = set()
+        self._task = None
+        self._loaded = False
+    
+    @staticmethod
+    def normalize(keywords: str) -> str:
+        return " ".join(keywords.split())
+    
+    def _watches_path(self) -> str:
+        return os.path.join(MONITOR_DIR, "watches.json")
+    
+    def _seen_path(self, keywords: str) -> str:
+        digest = hashlib.md5(keywords.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(MONITOR_DIR, f"seen_{digest}.txt")
+    
+    def load(self):
+        """读取已登记的监控任务并加入调度"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self._watches_path(), "r", encoding="utf-8") as f:
+                self.watches = json.load(f)
+        except FileNotFoundError:
+            self.watches = {}
+        except Exception as e:
+            print(f"读取关键词监控配置时出错: {str(e)}")
+            self.watches = {}
+        for keywords, watch in self.watches.items():
+            self._schedule(keywords, watch["interval_minutes"])
+    
+    def save(self):
+        os.makedirs(MONITOR_DIR, exist_ok=True)
+        with open(self._watches_path(), "w", encoding="utf-8") as f:
+            json.dump(self.watches, f, ensure_ascii=False, indent=2)
+    
+    def seen_ids(self, keywords: str) -> set:
+        """返回关键词的已见笔记ID集合，首次访问时从文件加载"""
+        if keywords not in self._seen:
+            ids = set()
+            path = self._seen_path(keywords)
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    ids = {line.strip() for line in f if line.strip()}
+            self._seen[keywords] = ids
+        return self._seen[keywords]
+    
+    def remember(self, keywords: str, note_ids: List[str]):
+        """记录新见到的笔记ID，超过上限时只保留最近的部分"""
+        seen = self.seen_ids(keywords)
+        note_ids = [note_id for note_id in note_ids if note_id and note_id not in seen]
+        if not note_ids:
+            return
+        seen.update(note_ids)
+        os.makedirs(MONITOR_DIR, exist_ok=True)
+        path = self._seen_path(keywords)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n".join(note_ids) + "\n")
+        
+        if len(seen) > MONITOR_SEEN_LIMIT * 2:
+            with open(path, "r", encoding="utf-8") as f:
+                recent = [line.strip() for line in f if line.strip()][-MONITOR_SEEN_LIMIT:]
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(recent) + "\n")
+            self._seen[keywords] = set(recent)
+    
+    def _schedule(self, keywords: str, interval_minutes: int):
+        self.scheduler.clear(keywords)
+        self.scheduler.every(interval_minutes).minutes.do(self._trigger, keywords).tag(keywords)
+    
+    def add(self, keywords: str, interval_minutes: int, sort_by_time: bool, max_results: int):
+        watch = self.watches.get(keywords, {"pending": [], "last_run": None})
+        watch.update({
+            "interval_minutes": interval_minutes,
+            "sort_by_time": sort_by_time,
+            "max_results": max_results,
+        })
+        self.watches[keywords] = watch
+        self._schedule(keywords, interval_minutes)
+        self.save()
+    
+    def remove(self, keywords: str) -> bool:
+        if keywords not in self.watches:
+            return False
+        del self.watches[keywords]
+        self.scheduler.clear(keywords)
+        self.save()
+        return True
+    
+    def start(self):
+        """在当前事件循环中启动调度循环"""
+        self.load()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+    
+    async def _loop(self):
+        while True:
+            try:
+                self.scheduler.run_pending()
+            except Exception as e:
+                print(f"运行关键词监控任务时出错: {str(e)}")
+            await asyncio.sleep(1)
+    
+    def _trigger(self, keywords: str):
+        # schedule 的任务是同步回调，这里只负责创建异步任务
+        if keywords not in self._running:
+            asyncio.get_running_loop().create_task(self.run(keywords))
+    
+    async def run(self, keywords: str) -> Optional[str]:
+        """立即运行一次监控，新笔记加入待读取列表
+        
+        Returns:
+            出错时返回错误信息，否则返回None
+        """
+        watch = self.watches.get(keywords)
+        if watch is None or keywords in self._running:
+            return None
+        self._running.add(keywords)
+        try:
+            result = await poll_keyword(
+                keywords,
+                watch["sort_by_time"],
+                watch["max_results"],
+                list(self.seen_ids(keywords))
+            )
+            if isinstance(result, str):
+                return result
+            
+            self.remember(keywords, [post["note_id"] for post in result])
+            pending_ids = {post["note_id"] for post in watch["pending"]}
+            watch["pending"].extend(post for post in result if post["note_id"] not in pending_ids)
+            watch["last_run"] = datetime.now().isoformat(timespec="seconds")
+            self.save()
+            return None
+        except Exception as e:
+            return f"监控关键词\"{keywords}\"时出错: {str(e)}"
+        finally:
+            self._running.discard(keywords)
+
+keyword_monitor = KeywordMonitor()
+
+@mcp.tool()
+async def add_keyword_watch(keywords: str, interval_minutes: int = 30, sort_by_time: bool = True, max_results: int = 20) -> str:
+    """登记关键词监控，按间隔自动搜索并记录新出现的笔记
+    
+    Args:
+        keywords: 搜索关键词
+        interval_minutes: 运行间隔（分钟）
+        sort_by_time: 是否按最新时间排序，按时间排序时遇到已见过的笔记即停止滚动
+        max_results: 每次最多收集的新笔记数量
+    """
+    keywords = KeywordMonitor.normalize(keywords)
+    if not keywords:
+        return "关键词不能为空"
+    keyword_monitor.start()
+    keyword_monitor.add(keywords, max(1, interval_minutes), sort_by_time, max(1, max_results))
+    return f"已登记关键词监控：\"{keywords}\"，每 {max(1, interval_minutes)} 分钟运行一次"
+
+@mcp.tool()
+async def remove_keyword_watch(keywords: str) -> str:
+    """取消关键词监控
+    
+    Args:
+        keywords: 搜索关键词
+    """
+    keywords = KeywordMonitor.normalize(keywords)
+    keyword_monitor.start()
+    if keyword_monitor.remove(keywords):
+        return f"已取消关键词监控：\"{keywords}\""
+    return f"未找到关键词监控：\"{keywords}\""
+
+@mcp.tool()
+async def list_keyword_watches() -> str:
+    """列出所有已登记的关键词监控"""
+    keyword_monitor.start()
+    if not keyword_monitor.watches:
+        return "当前没有关键词监控"
+    
+    result = "关键词监控列表：\n\n"
+    for i, (keywords, watch) in enumerate(keyword_monitor.watches.items(), 1):
+        result += f"{i}. {keywords}（每 {watch['interval_minutes']} 分钟）\n"
+        result += f"   上次运行: {watch['last_run'] or '尚未运行'}，待读取新笔记: {len(watch['pending'])} 条\n\n"
+    return result
+
+@mcp.tool()
+async def get_new_notes(keywords: str = "", run_now: bool = False, dedupe: bool = False) -> str:
+    """读取关键词监控发现的新笔记，读取后清空待读取列表
+    
+    Args:
+        keywords: 搜索关键词，为空时读取所有监控的新笔记
+        run_now: 是否在读取前立即运行一次监控
+        dedupe: 是否合并近似重复的笔记
+    """
+    keyword_monitor.start()
+    keywords = KeywordMonitor.normalize(keywords)
+    if keywords:
+        if keywords not in keyword_monitor.watches:
+            return f"未找到关键词监控：\"{keywords}\"，请先使用add_keyword_watch登记"
+        targets = [keywords]
+    else:
+        targets = list(keyword_monitor.watches.keys())
+    
+    if not targets:
+        return "当前没有关键词监控"
+    
+    result = ""
+    for target in targets:
+        if run_now:
+            error = await keyword_monitor.run(target)
+            if error:
+                result += f"{error}\n\n"
+        
+        watch = keyword_monitor.watches[target]
+        pending = watch["pending"]
+        watch["pending"] = []
+        if not pending:
+            result += f"关键词\"{target}\"暂无新笔记\n\n"
+            continue
+        
+        if dedupe:
+            pending = collapse_duplicates(pending)
+        
+        result += f"关键词\"{target}\"的新笔记：\n\n"
+        for i, post in enumerate(pending, 1):
+            display_url = post['url'].replace('/search_result/', '/explore/')
+            result += f"{i}. {post['title']}\n   链接: {display_url}\n"
+            if post.get("duplicates"):
+                result += f"   另有 {len(post['duplicates'])} 条相似笔记已合并\n"
+            if post.get("similar"):
+                result += f"   与之前读取过的笔记内容相似: {', '.join(post['similar'])}\n"
+            result += "\n"
+    
+    keyword_monitor.save()
+    return result
+
+# 营销任务流水线的检查点目录
+CAMPAIGN_DIR = os.path.join(DATA_DIR, "campaigns")
+# 阶段之间队列的容量：下游处理不过来时上游暂停，避免一次性搜索和分析过多笔记
+CAMPAIGN_QUEUE_SIZE = int(os.environ.get("XHS_CAMPAIGN_QUEUE_SIZE", "10"))
+# 同时分析笔记的数量
+CAMPAIGN_ANALYZE_WORKERS = int(os.environ.get("XHS_CAMPAIGN_ANALYZE_WORKERS", "2"))
+# 返回给客户端的笔记正文最大长度
+CAMPAIGN_CONTENT_LENGTH = 500
+
+@browser_tool(uses_main_page=False)
+async def fetch_note_record(url: str) -> Any:
+    """借用后台页面提取笔记内容，已缓存时直接返回
+    
+    Returns:
+        成功时返回笔记记录，失败时返回错误信息字符串
+    """
+    login_status = await ensure_browser()
+    if not login_status:
+        return "请先登录小红书账号"
+    
+    note_record = await note_cache.get_or_wait(extract_note_id(url))
+    if note_record is None:
+        note_record = await load_note_on_pool_page(url, "batch")
+    return note_record
+
+class Campaign:
+    """营销任务流水线：搜索 → 过滤 → 分析 → 交给客户端撰写评论 → 按间隔发布
+    
+    各阶段作为独立的异步任务并发运行，阶段之间通过有界队列传递笔记ID。每条笔记的状态
+    （queued、filtered、ready、delivered、submitted、posted、unconfirmed、skipped、failed）在每次变化时
+    写入 DATA_DIR/campaigns/<任务ID>.json，任务停止或服务器重启后可以从检查点继续。
+    """
+    
+    def __init__(self, job_id: str, config: Dict[str, Any]):
+        self.job_id = job_id
+        self.config = config
+        self.notes = {}
+        self.searched = []
+        self.errors = []
+        self.state = "running"
+        self.search_done = False
+        self.last_post_at = 0.0
+        self.created_at = datetime.now().isoformat(timespec="seconds")
+        self._tasks = []
+        self._titles = SimHashIndex(None)
+        self._analyze_queue = None
+        self._draft_queue = None
+        self._post_queue = None
+        self._analyzing = 0
+    
+    @staticmethod
+    def path_for(job_id: str) -> str:
+        return os.path.join(CAMPAIGN_DIR, f"{job_id}.json")
+    
+    def save(self):
+        """写入检查点，先写临时文件再替换，避免中断时损坏"""
+        payload = {
+            "job_id": self.job_id,
+            "config": self.config,
+            "notes": self.notes,
+            "searched": self.searched,
+            "errors": self.errors[-50:],
+            "state": self.state,
+            "search_done": self.search_done,
+            "last_post_at": self.last_post_at,
+            "created_at": self.created_at,
+        }
+        try:
+            os.makedirs(CAMPAIGN_DIR, exist_ok=True)
+            path = self.path_for(self.job_id)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            print(f"保存任务检查点时出错: {str(e)}")
+    
+    @classmethod
+    def load(cls, job_id: str) -> Optional["Campaign"]:
+        try:
+            with open(cls.path_for(job_id), "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except FileNotFoundError:
+            return None
+        campaign = cls(job_id, payload["config"])
+        for key in ("notes", "searched", "errors", "state", "search_done", "last_post_at", "created_at"):
+            setattr(campaign, key, payload[key])
+        return campaign
+    
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+    
+    def counts(self) -> Dict[str, int]:
+        counts = {}
+        for note in self.notes.values():
+            counts[note["status"]] = counts.get(note["status"], 0) + 1
+        return counts
+    
+    def analysis_done(self) -> bool:
+        return self.search_done and self._analyzing == 0 and not any(
+            note["status"] == "queued" for note in self.notes.values()
+        )
+    
+    def drafts_done(self) -> bool:
+        """所有通过过滤的笔记都已交给客户端"""
+        return self.analysis_done() and self._draft_queue.empty()
+    
+    def start(self):
+        """启动各阶段任务；从检查点恢复时按状态把笔记放回对应的阶段"""
+        if self.running:
+            return
+        self.state = "running"
+        self._analyze_queue = asyncio.Queue(maxsize=CAMPAIGN_QUEUE_SIZE)
+        self._draft_queue = asyncio.Queue(maxsize=CAMPAIGN_QUEUE_SIZE)
+        self._post_queue = asyncio.Queue()
+        self._titles = SimHashIndex(None)
+        for note_id, note in self.notes.items():
+            title_print = title_fingerprint(note["title"])
+            if title_print is not None:
+                self._titles.put(note_id, title_print)
+        
+        # 已交给客户端但未提交评论的笔记重新等待交付
+        for note in self.notes.values():
+            if note["status"] == "delivered":
+                note["status"] = "ready"
+        queued = [note_id for note_id, note in self.notes.items() if note["status"] == "queued"]
+        ready = [note_id for note_id, note in self.notes.items() if note["status"] == "ready"]
+        for note_id, note in self.notes.items():
+            if note["status"] == "submitted":
+                self._post_queue.put_nowait(note_id)
+        
+        loop = asyncio.get_running_loop()
+        workers = max(1, CAMPAIGN_ANALYZE_WORKERS)
+        self._analyzing = workers
+        self._tasks = [loop.create_task(self._search_stage(queued, workers)), loop.create_task(self._post_stage())]
+        self._tasks += [loop.create_task(self._analyze_stage()) for _ in range(workers)]
+        if ready:
+            self._tasks.append(loop.create_task(self._feed(self._draft_queue, ready)))
+        self.save()
+    
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self.state = "stopped"
+        self.save()
+    
+    async def _feed(self, queue: asyncio.Queue, note_ids: List[str]):
+        for note_id in note_ids:
+            await queue.put(note_id)
+    
+    def _prefilter(self, note_id: str, title: str) -> Optional[str]:
+        """按标题过滤，返回过滤原因"""
+        for word in self.config["exclude"]:
+            if word.lower() in title.lower():
+                return f"标题包含排除词\"{word}\""
+        if engagement_history.lookup("comment", note_id):
+            return "已经评论过"
+        title_print = title_fingerprint(title)
+        if title_print is None:
+            return None
+        if any(other != note_id for other, _ in self._titles.query(title_print, SIMHASH_DISTANCE)):
+            return "与本任务中的其他笔记近似重复"
+        self._titles.put(note_id, title_print)
+        return None
+    
+    def _postfilter(self, note_record: Dict[str, str], domains: List[str]) -> Optional[str]:
+        """按正文和领域过滤，返回过滤原因"""
+        text = f"{note_record['title']}\n{note_record['content']}".lower()
+        for word in self.config["exclude"]:
+            if word.lower() in text:
+                return f"正文包含排除词\"{word}\""
+        if self.config["include"] and not any(word.lower() in text for word in self.config["include"]):
+            return "不包含任何指定关键词"
+        if self.config["domains"] and not set(domains) & set(self.config["domains"]):
+            return f"领域不匹配（{'、'.join(domains)}）"
+        return None
+    
+    async def _search_stage(self, queued: List[str], workers: int):
+        cancelled = False
+        try:
+            # 先放回检查点中尚未分析的笔记
+            await self._feed(self._analyze_queue, queued)
+            for keyword in self.config["keywords"]:
+                if keyword in self.searched:
+                    continue
+                result = await poll_keyword(keyword, self.config["sort_by_time"], self.config["limit"], [])
+                if isinstance(result, str):
+                    self.errors.append(f"搜索\"{keyword}\"失败: {result}")
+                    self.searched.append(keyword)
+                    self.save()
+                    continue
+                for post in result:
+                    note_id = post["note_id"]
+                    if not note_id or note_id in self.notes:
+                        continue
+                    note = {
+                        "url": post["url"].replace('/search_result/', '/explore/'),
+                        "title": post["title"],
+                        "keyword": keyword,
+                        "status": "queued",
+                    }
+                    self.notes[note_id] = note
+                    reason = self._prefilter(note_id, post["title"])
+                    if reason:
+                        note.update(status="filtered", reason=reason)
+                        continue
+                    self.save()
+                    await self._analyze_queue.put(note_id)
+                self.searched.append(keyword)
+                self.save()
+            self.search_done = True
+            self.save()
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # 通知分析阶段没有更多笔记；任务被停止时分析阶段同样被取消，不再有人取出队列，
+            # 此时放入结束标记可能永远阻塞在已满的队列上
+            if not cancelled:
+                for _ in range(workers):
+                    await self._analyze_queue.put(None)
+    
+    async def _analyze_stage(self):
+        try:
+            while True:
+                note_id = await self._analyze_queue.get()
+                if note_id is None:
+                    break
+                note = self.notes[note_id]
+                try:
+                    note_record = await fetch_note_record(note["url"])
+                except Exception as e:
+                    note_record = str(e)
+                if isinstance(note_record, str):
+                    note.update(status="failed", reason=f"分析失败: {note_record}")
+                    self.save()
+                    continue
+                
+                domains = detect_domains(note_record["title"], note_record["content"])
+                note.update(
+                    title=note_record["title"],
+                    author=note_record["author"],
+                    content=note_record["content"][:CAMPAIGN_CONTENT_LENGTH],
+                    domains=domains,
+                )
+                reason = self._postfilter(note_record, domains)
+                if reason:
+                    note.update(status="filtered", reason=reason)
+                    self.save()
+                    continue
+                note["status"] = "ready"
+                self.save()
+                await self._draft_queue.put(note_id)
+        finally:
+            self._analyzing -= 1
+    
+    async def next_drafts(self, max_items: int, wait: float) -> List[Dict[str, Any]]:
+        """取出一批待撰写评论的笔记；暂时没有时最多等待 wait 秒"""
+        drafts = []
+        deadline = time.monotonic() + wait
+        while len(drafts) < max_items:
+            try:
+                note_id = self._draft_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - time.monotonic()
+                if drafts or remaining <= 0 or self.analysis_done() or not self.running:
+                    break
+                try:
+                    note_id = await asyncio.wait_for(self._draft_queue.get(), timeout=min(remaining, 1))
+                except asyncio.TimeoutError:
+                    continue
+            note = self.notes[note_id]
+            note["status"] = "delivered"
+            drafts.append({
+                "note_id": note_id,
+                "url": note["url"],
+                "title": note["title"],
+                "author": note.get("author", ""),
+                "content": note.get("content", ""),
+                "domains": note.get("domains", []),
+            })
+        if drafts:
+            self.save()
+        return drafts
+    
+    def submit(self, comments: Dict[str, str]) -> Tuple[int, int, List[str]]:
+        """提交客户端撰写的评论，加入发布队列；评论为空表示跳过该笔记
+        
+        Returns:
+            Tuple[int, int, List[str]]: 加入发布队列的数量、跳过的数量、无法提交的笔记ID
+        """
+        queued, skipped, rejected = 0, 0, []
+        for note_id, comment in comments.items():
+            note = self.notes.get(note_id)
+            if note is None or note["status"] not in ("delivered", "ready"):
+                rejected.append(note_id)
+                continue
+            comment = (comment or "").strip()
+            if not comment:
+                note.update(status="skipped", reason="客户端跳过")
+                skipped += 1
+                continue
+            note.update(status="submitted", comment=comment)
+            self._post_queue.put_nowait(note_id)
+            queued += 1
+        self.save()
+        return queued, skipped, rejected
+    
+    async def _post_stage(self):
+        while True:
+            note_id = await self._post_queue.get()
+            note = self.notes[note_id]
+            # 按设定的间隔发布，加入少量随机抖动；间隔在重启后同样生效
+            interval = self.config["post_interval"] * random.uniform(0.8, 1.2)
+            delay = self.last_post_at + interval - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                result = await post_comment(note["url"], note["comment"])
+            except Exception as e:
+                result = f"发布评论时出错: {str(e)}"
+            if result.startswith("已成功发布评论"):
+                note["status"] = "posted"
+                self.last_post_at = time.time()
+            elif result.startswith("评论已发送"):
+                note["status"] = "unconfirmed"
+                self.last_post_at = time.time()
+            elif result.startswith("已于"):
+                note["status"] = "skipped"
+            else:
+                note["status"] = "failed"
+                self.last_post_at = time.time()
+            note["result"] = result
+            self.save()
+
+campaigns = {}
+
+def get_campaign(job_id: str) -> Optional[Campaign]:
+    """读取运行中的任务，不在内存中时从检查点加载"""
+    campaign = campaigns.get(job_id)
+    if campaign is None:
+        campaign = Campaign.load(job_id)
+        if campaign is not None:
+            campaigns[job_id] = campaign
+    return campaign
+
+def _split_words(text: str) -> List[str]:
+    return [word.strip() for word in re.split(r'[,，\n]', text or "") if word.strip()]
+
+@mcp.tool()
+async def start_campaign(keywords: str, limit: int = 20, include: str = "", exclude: str = "", domains: str = "",
+                         comment_type: str = "引流", post_interval: int = 120, sort_by_time: bool = True) -> str:
+    """启动营销任务流水线：搜索关键词，过滤并分析笔记，分批交给客户端撰写评论，再按间隔发布
+    
+    Args:
+        keywords: 搜索关键词，多个用逗号分隔
+        limit: 每个关键词搜索的笔记数量
+        include: 笔记标题或正文需要包含的关键词（任意一个），逗号分隔，为空时不限制
+        exclude: 笔记标题或正文包含时排除的关键词，逗号分隔
+        domains: 只保留这些领域的笔记（如 美妆,穿搭），逗号分隔，为空时不限制
+        comment_type: 评论类型，可选值 "引流"、"点赞"、"咨询"、"专业"
+        post_interval: 两条评论之间的发布间隔（秒）
+        sort_by_time: 是否按最新时间排序搜索
+    """
+    keyword_list = list(dict.fromkeys(" ".join(word.split()) for word in _split_words(keywords)))
+    if not keyword_list:
+        return "请提供至少一个搜索关键词"
+    if comment_type not in COMMENT_GUIDES:
+        return f"不支持的评论类型: {comment_type}，可选值为 {', '.join(COMMENT_GUIDES.keys())}"
+    
+    # 同一秒内启动的任务通过随机后缀区分，避免共用检查点文件
+    job_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    campaign = Campaign(job_id, {
+        "keywords": keyword_list,
+        "limit": max(1, limit),
+        "include": _split_words(include),
+        "exclude": _split_words(exclude),
+        "domains": _split_words(domains),
+        "comment_type": comment_type,
+        "post_interval": max(0, post_interval),
+        "sort_by_time": sort_by_time,
+    })
+    campaigns[job_id] = campaign
+    campaign.start()
+    return (f"已启动任务 {job_id}，共 {len(keyword_list)} 个关键词。"
+            f"请调用 get_campaign_drafts(job_id=\"{job_id}\") 分批获取待撰写评论的笔记")
+
+@mcp.tool()
+async def get_campaign_drafts(job_id: str, max_items: int = 5, wait: float = 30) -> str:
+    """获取一批待撰写评论的笔记，撰写后通过 submit_campaign_comments 提交
+    
+    Args:
+        job_id: 任务ID
+        max_items: 本批最多返回的笔记数量
+        wait: 暂时没有待撰写的笔记时最多等待的秒数
+    """
+    campaign = get_campaign(job_id)
+    if campaign is None:
+        return f"未找到任务: {job_id}"
+    if not campaign.running:
+        return f"任务 {job_id} 未在运行，请先调用 resume_campaign 继续任务"
+    
+    drafts = await campaign.next_drafts(max(1, max_items), max(0, wait))
+    finished = campaign.drafts_done()
+    return json.dumps({
+        "job_id": job_id,
+        "comment_type": campaign.config["comment_type"],
+        "comment_guide": COMMENT_GUIDES[campaign.config["comment_type"]],
+        "drafts": drafts,
+        "finished": finished,
+        "message": "请为每条笔记撰写一条不超过30字的自然评论，以 {笔记ID: 评论} 的JSON对象调用 submit_campaign_comments 提交，"
+                   "评论为空表示跳过该笔记" if drafts else ("所有笔记已处理完毕" if finished else "暂时没有待撰写的笔记，请稍后再试"),
+    }, ensure_ascii=False)
+
+@mcp.tool()
+async def submit_campaign_comments(job_id: str, comments: str) -> str:
+    """提交客户端撰写的评论，加入按间隔发布的队列
+    
+    Args:
+        job_id: 任务ID
+        comments: JSON对象，键为笔记ID，值为评论内容，值为空表示跳过该笔记
+    """
+    campaign = get_campaign(job_id)
+    if campaign is None:
+        return f"未找到任务: {job_id}"
+    if not campaign.running:
+        return f"任务 {job_id} 未在运行，请先调用 resume_campaign 继续任务"
+    try:
+        comment_map = json.loads(comments)
+    except json.JSONDecodeError as e:
+        return f"评论格式错误，需要 {{笔记ID: 评论}} 的JSON对象: {str(e)}"
+    if not isinstance(comment_map, dict):
+        return "评论格式错误，需要 {笔记ID: 评论} 的JSON对象"
+    
+    queued, skipped, rejected = campaign.submit({str(key): str(value or "") for key, value in comment_map.items()})
+    result = f"已加入发布队列 {queued} 条，跳过 {skipped} 条"
+    if rejected:
+        result += f"；以下笔记不在待撰写状态，未提交: {', '.join(rejected)}"
+    return result
+
+@mcp.tool()
+async def get_campaign_status(job_id: str = "") -> str:
+    """查看营销任务各阶段的进度
+    
+    Args:
+        job_id: 任务ID，为空时列出所有任务
+    """
+    if job_id:
+        job_ids = [job_id]
+    else:
+        saved = [name[:-len(".json")] for name in os.listdir(CAMPAIGN_DIR) if name.endswith(".json")] \
+            if os.path.isdir(CAMPAIGN_DIR) else []
+        job_ids = sorted(set(saved) | set(campaigns.keys()))
+    if not job_ids:
+        return "当前没有营销任务"
+    
+    result = ""
+    for current_id in job_ids:
+        campaign = get_campaign(current_id)
+        if campaign is None:
+            result += f"未找到任务: {current_id}\n\n"
+            continue
+        state = "运行中" if campaign.running else "已停止"
+        counts = "，".join(f"{status} {count}" for status, count in sorted(campaign.counts().items())) or "暂无笔记"
+        result += f"任务 {current_id}（{state}，创建于 {campaign.created_at}）\n"
+        result += f"   关键词: 已搜索 {len(campaign.searched)}/{len(campaign.config['keywords'])}\n"
+        result += f"   笔记: {counts}\n"
+        for error in campaign.errors[-3:]:
+            result += f"   错误: {error}\n"
+        result += "\n"
+    return result
+
+@mcp.tool()
+async def stop_campaign(job_id: str) -> str:
+    """停止营销任务，进度保存在检查点中，可通过 resume_campaign 继续
+    
+    Args:
+        job_id: 任务ID
+    """
+    campaign = get_campaign(job_id)
+    if campaign is None:
+        return f"未找到任务: {job_id}"
+    campaign.stop()
+    return f"已停止任务 {job_id}"
+
+@mcp.tool()
+async def resume_campaign(job_id: str) -> str:
+    """从检查点继续营销任务：未搜索的关键词继续搜索，未分析的笔记继续分析，已提交的评论继续发布
+    
+    Args:
+        job_id: 任务ID
+    """
+    campaign = get_campaign(job_id)
+    if campaign is None:
+        return f"未找到任务: {job_id}"
+    if campaign.running:
+        return f"任务 {job_id} 已在运行"
+    campaign.start()
+    return f"已继续任务 {job_id}"
+
+def start_background_services():
+    """在主进程的事件循环中启动后台服务（关键词监控等）"""
+    if os.path.exists(os.path.join(MONITOR_DIR, "watches.json")):
+        keyword_monitor.start()
+
+# 笔记页面快照：保存渲染后的DOM，供离线重新提取
+SNAPSHOT_ENABLED = os.environ.get("XHS_SNAPSHOTS", "0") == "1"
+SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshots")
+
+def _write_snapshot(note_id: str, url: str, html: str):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    header = f'<!--xhs-snapshot url="{url}" captured_at="{datetime.now().isoformat(timespec="seconds")}"-->\n'
+    path = os.path.join(SNAPSHOT_DIR, f"{note_id}.html.gz")
+    # 先写临时文件再替换，避免读取到写了一半的快照
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8", compresslevel=6) as f:
+        f.write(header + html)
+    os.replace(path + ".tmp", path)
+
+async def save_snapshot(page, url: str):
+    """快照模式开启时，把页面当前渲染的DOM压缩保存到 DATA_DIR/snapshots/<笔记ID>.html.gz"""
+    note_id = extract_note_id(url)
+    if not SNAPSHOT_ENABLED or not note_id:
+        return
+    try:
+        html = await page.content()
+        await asyncio.to_thread(_write_snapshot, note_id, url, html)
+    except Exception as e:
+        print(f"保存页面快照时出错: {str(e)}")
+
+def read_snapshot(path: str) -> Dict[str, str]:
+    """读取快照文件，返回 note_id、url 和 html"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        html = f.read()
+    url_match = re.match(r'<!--xhs-snapshot url="([^"]*)"', html)
+    return {
+        "note_id": os.path.basename(path).split(".")[0],
+        "url": url_match.group(1) if url_match else "",
+        "html": html,
+    }
+
+# 离线提取规则与页面内提取保持一致
+_COMMENT_AREA_SELECTORS = [
+    '.comments-container',
+    '.comment-list',
+    '.feed-comment',
+    'div[data-v-aed4aacc]',
+    '.comment-item',
+]
+_DATE_PATTERNS = [
+    r'编辑于\s*([\d-]+)',
+    r'(\d{2}-\d{2})',
+    r'(\d{4}-\d{2}-\d{2})',
+    r'(\d+月\d+日)',
+    r'(\d+天前)',
+    r'(\d+小时前)',
+    r'(今天)',
+    r'(昨天)',
+]
+
+def _first_text(root, selectors: List[str]) -> Optional[str]:
+    for selector in selectors:
+        for el in root.cssselect(selector):
+            text = el.text_content().strip()
+            if text:
+                return text
+    return None
+
+def _in_comment_area(el, comment_areas: set) -> bool:
+    return el in comment_areas or any(ancestor in comment_areas for ancestor in el.iterancestors())
+
+def offline_extract_note(root) -> Dict[str, str]:
+    """从快照DOM中提取笔记的标题、作者、发布时间和正文"""
+    post_content = {}
+    post_content["标题"] = _first_text(root, ['#detail-title', 'div.title', 'h1', 'div.note-content div.title']) or "未知标题"
+    post_content["作者"] = _first_text(root, ['span.username', 'a.name', '.author-wrapper .username', '.info .name']) or "未知作者"
+    
+    # 发布时间：先用选择器，再匹配日期格式的文本
+    publish_time = _first_text(root, ['span.date', '.bottom-container .date', '.date'])
+    if not publish_time:
+        for pattern in _DATE_PATTERNS:
+            for el in root.iter():
+                if not isinstance(el.tag, str) or len(el):
+                    continue
+                text = (el.text or "").strip()
+                if text and re.search(pattern, text):
+                    publish_time = text
+                    break
+            if publish_time:
+                break
+    if not publish_time:
+        all_text = root.text_content()
+        for pattern in _DATE_PATTERNS:
+            date_match = re.search(pattern, all_text)
+            if date_match:
+                publish_time = date_match.group(0)
+                break
+    post_content["发布时间"] = publish_time or "未知"
+    
+    comment_areas = set()
+    for selector in _COMMENT_AREA_SELECTORS:
+        comment_areas.update(root.cssselect(selector))
+    
+    content = None
+    # 方法1：detail-desc中的note-text，排除评论区域
+    for el in root.cssselect('#detail-desc .note-text'):
+        text = el.text_content().strip()
+        if not _in_comment_area(el, comment_areas) and len(text) > 50:
+            content = text
+        break
+    # 方法2：XPath
+    if not content:
+        for el in root.xpath('//div[@id="detail-desc"]/span[@class="note-text"]'):
+            text = el.text_content().strip()
+            if len(text) > 20:
+                content = text
+            break
+    # 方法3：评论区以外最长的文本
+    if not content:
+        candidates = [
+            el.text_content().strip()
+            for el in root.cssselect('div#detail-desc, div.note-content, div.desc, span.note-text')
+            if not _in_comment_area(el, comment_areas)
+        ]
+        candidates = [text for text in candidates if 100 < len(text) < 10000]
+        if candidates:
+            content = max(candidates, key=len)
+    # 方法4：note-content区域或正文段落
+    if not content:
+        for note_content in root.cssselect('.note-content')[:1]:
+            note_text = note_content.cssselect('.note-text')
+            if note_text and len(note_text[0].text_content().strip()) > 50:
+                content = note_text[0].text_content().strip()
+            elif len(note_content.text_content().strip()) > 50:
+                content = note_content.text_content().strip()
+        if not content:
+            paragraphs = [
+                p.text_content().strip()
+                for p in root.cssselect('p')
+                if not any(a in comment_areas for a in p.iterancestors()) and len(p.text_content().strip()) > 10
+            ]
+            if paragraphs:
+                content = "\n\n".join(paragraphs)
+    post_content["内容"] = content or "未能获取内容"
+    return post_content
+
+def offline_extract_comments(root) -> List[Dict[str, str]]:
+    """从快照DOM中提取评论的用户名、内容和时间"""
+    comments = []
+    for selector in ["div.comment-item", "div.commentItem", "div.comment-content",
+                     "div.comment-wrapper", "section.comment", "div.feed-comment"]:
+        for comment_element in root.cssselect(selector):
+            username = _first_text(comment_element, ["span.user-name", "a.name", "div.username", "span.nickname", "a.user-nickname"])
+            if not username:
+                user_links = comment_element.cssselect('a[href*="/user/profile/"]')
+                username = user_links[0].text_content().strip() if user_links else "未知用户"
+            
+            content = _first_text(comment_element, ["div.content", "p.content", "div.text", "span.content", "div.comment-text"])
+            if not content:
+                full_text = comment_element.text_content()
+                if username != "未知用户" and username in full_text:
+                    content = full_text.replace(username, "").strip()
+                else:
+                    content = full_text.strip()
+            
+            time_location = _first_text(comment_element, ["span.time", "div.time", "span.date", "div.date", "time"]) or "未知时间"
+            
+            if username != "未知用户" and len(content) > 2:
+                comments.append({"用户名": username, "内容": content, "时间": time_location})
+        
+        # 如果找到了评论，就不继续尝试其他选择器了
+        if comments:
+            break
+    return comments
+
+def _reextract_snapshots(note_ids: List[str], dataset: str, backfill: bool) -> Dict[str, Any]:
+    from lxml import html as lxml_html
+    
+    if note_ids:
+        paths = [os.path.join(SNAPSHOT_DIR, f"{note_id}.html.gz") for note_id in note_ids]
+    else:
+        paths = sorted(
+            os.path.join(SNAPSHOT_DIR, name) for name in os.listdir(SNAPSHOT_DIR) if name.endswith(".html.gz")
+        ) if os.path.isdir(SNAPSHOT_DIR) else []
+    
+    summary = {"snapshots": 0, "missing": [], "notes": [], "comments": 0}
+    for path in paths:
+        if not os.path.exists(path):
+            summary["missing"].append(os.path.basename(path).split(".")[0])
+            continue
+        try:
+            snapshot = read_snapshot(path)
+            root = lxml_html.fromstring(snapshot["html"])
+        except Exception as e:
+            print(f"读取快照 {path} 时出错: {str(e)}")
+            continue
+        summary["snapshots"] += 1
+        
+        if dataset in ("notes", "all"):
+            note_record = build_note_record(snapshot["url"], offline_extract_note(root))
+            note_record["note_id"] = snapshot["note_id"]
+            summary["notes"].append(note_record)
+            if backfill:
+                append_records("notes", [note_record])
+        
+        if dataset in ("comments", "all"):
+            comments = offline_extract_comments(root)
+            summary["comments"] += len(comments)
+            if backfill:
+                append_records("comments", [
+                    {
+                        "note_id": snapshot["note_id"],
+                        "url": snapshot["url"],
+                        "username": comment["用户名"],
+                        "content": comment["内容"],
+                        "time": comment["时间"],
+                    }
+                    for comment in comments
+                ])
+    return summary
+
+@mcp.tool()
+async def reextract_snapshots(note_ids: str = "", dataset: str = "all", backfill: bool = True) -> str:
+    """使用当前的提取规则从已保存的页面快照中离线重新提取数据，无需打开浏览器
+    
+    Args:
+        note_ids: 逗号分隔的笔记ID，为空时处理所有快照
+        dataset: 要提取的数据，可选值 "notes"、"comments" 或 "all"
+        backfill: 是否把提取结果追加到抓取记录中，供 export_data 导出
+    """
+    if dataset not in ("notes", "comments", "all"):
+        return f"未知的数据集: {dataset}，可选值为 notes、comments 或 all"
+    
+    ids = [note_id.strip() for note_id in note_ids.split(",") if note_id.strip()]
+    try:
+        summary = await asyncio.to_thread(_reextract_snapshots, ids, dataset, backfill)
+    except ImportError as e:
+        return f"离线提取需要安装lxml和cssselect: {str(e)}"
+    except Exception as e:
+        return f"离线提取快照时出错: {str(e)}"
+    
+    if summary["snapshots"] == 0:
+        return "未找到可用的页面快照，请设置 XHS_SNAPSHOTS=1 后重新抓取"
+    
+    result = f"已处理 {summary['snapshots']} 个快照"
+    if dataset in ("notes", "all"):
+        result += f"，提取 {len(summary['notes'])} 篇笔记"
+    if dataset in ("comments", "all"):
+        result += f"，{summary['comments']} 条评论"
+    result += "\n"
+    if summary["missing"]:
+        result += f"未找到快照: {', '.join(summary['missing'])}\n"
+    
+    # 指定了笔记ID时，附上提取结果便于核对
+    if ids:
+        for note_record in summary["notes"]:
+            result += f"\n笔记ID: {note_record['note_id']}\n"
+            result += f"标题: {note_record['title']}\n"
+            result += f"作者: {note_record['author']}\n"
+            result += f"发布时间: {note_record['publish_time']}\n"
+            result += f"内容: {note_record['content'][:200]}\n"
+    return result
+
+@mcp.tool()
+async def save_har_recording() -> str:
+    """结束当前的HAR录制：关闭浏览器并写出HAR文件，下次调用工具时会重新启动浏览器并开始新的录制"""
+    if HAR_MODE != "record":
+        return "当前不是HAR录制模式，请设置 XHS_HAR_MODE=record 后重启服务器"
+    if browser_context is None:
+        return "浏览器尚未启动，没有需要保存的录制"
+    await shutdown_browser()
+    return f"HAR录制已保存: {har_recording_path}"
+
+def _coerce_value(value: Any, value_type: str) -> Any:
+    """按表结构转换字段类型，保证每个分块的列类型一致"""
+    if value_type == "int":
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return 0
+    if value_type == "bool":
+        return bool(value)
+    return "" if value is None else str(value)
+
+def _iter_record_chunks(dataset: str, chunk_rows: int):
+    """逐行读取记录文件，按 chunk_rows 分块产出 DataFrame，内存占用与分块大小成正比"""
+    import pandas as pd
+    
+    schema = EXPORT_SCHEMAS[dataset]
+    columns = list(schema.keys())
+    path = os.path.join(RECORDS_DIR, f"{dataset}.jsonl")
+    if not os.path.exists(path):
+        return
+    
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            rows.append([_coerce_value(record.get(column), schema[column]) for column in columns])
+            if len(rows) >= chunk_rows:
+                yield pd.DataFrame(rows, columns=columns)
+                rows = []
+    if rows:
+        yield pd.DataFrame(rows, columns=columns)
+
+def _export_dataset(dataset: str, file_format: str, chunk_rows: int) -> str:
+    """把单个数据集流式导出为分块Parquet文件或单个CSV文件，返回结果描述"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    total_rows = 0
+    chunks = 0
+    
+    if file_format == "parquet":
+        output_path = os.path.join(EXPORT_DIR, f"{dataset}_{timestamp}")
+        os.makedirs(output_path, exist_ok=True)
+        for df in _iter_record_chunks(dataset, chunk_rows):
+            df.to_parquet(os.path.join(output_path, f"part-{chunks:05d}.parquet"), index=False)
+            total_rows += len(df)
+            chunks += 1
+    else:
+        output_path = os.path.join(EXPORT_DIR, f"{dataset}_{timestamp}.csv")
+        for df in _iter_record_chunks(dataset, chunk_rows):
+            df.to_csv(output_path, mode="a", header=chunks == 0, index=False, encoding="utf-8")
+            total_rows += len(df)
+            chunks += 1
+    
+    if chunks == 0:
+        return f"{dataset}: 暂无可导出的数据"
+    return f"{dataset}: 导出 {total_rows} 行（{chunks} 个分块）到 {output_path}"
+
+@mcp.tool()
+async def export_data(dataset: str = "all", file_format: str = "parquet", chunk_rows: int = 50000) -> str:
+    """把已抓取的笔记、评论、搜索结果和用户笔记列表导出到 DATA_DIR/exports
+    
+    Args:
+        dataset: 要导出的数据集，可选值 "notes"、"comments"、"search"、"user_notes" 或 "all"
+        file_format: 导出格式，"parquet"（每个分块一个文件）或 "csv"
+        chunk_rows: 每个分块的行数，决定导出时的内存占用
+    """
+    if dataset == "all":
+        datasets = list(EXPORT_SCHEMAS.keys())
+    elif dataset in EXPORT_SCHEMAS:
+        datasets = [dataset]
+    else:
+        return f"未知的数据集: {dataset}，可选值为 {', '.join(EXPORT_SCHEMAS.keys())} 或 all"
+    
+    if file_format not in ("parquet", "csv"):
+        return f"不支持的导出格式: {file_format}，可选值为 parquet 或 csv"
+    
+    chunk_rows = max(1, chunk_rows)
+    try:
+        results = []
+        for name in datasets:
+            # 文件读写放到线程中执行，避免阻塞其他工具调用
+            results.append(await asyncio.to_thread(_export_dataset, name, file_format, chunk_rows))
+        return "\n".join(results)
+    except ImportError as e:
+        return f"导出Parquet需要安装pyarrow: {str(e)}"
+    except Exception as e:
+        return f"导出数据时出错: {str(e)}"
+
 if __name__ == "__main__":
     # 初始化并运行服务器
     #print("启动小红书MCP服务器...")
     #print("请在MCP客户端（如Claude for Desktop）中配置此服务器")
-    mcp.run(transport='stdio')
\ No newline at end of file
+    try:
+        mcp.run(transport='stdio')
+    finally:
+        if _worker_pool is not None:
+            _worker_pool.shutdown()
\ No newline at end of file